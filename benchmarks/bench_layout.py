@@ -0,0 +1,85 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Layout benchmark
+
+Compares layout.force_layout (cold and warm-started) against the
+nx.spring_layout(G, iterations=5000, seed=42) call it replaced, on random
+geometric graphs shaped like the thresholded language graph. Reports wall
+time, iterations and stress (lower is better) as JSON.
+
+Usage: python benchmarks/bench_layout.py [--sizes 20 100 300] [--out bench_layout.json]
+"""
+
+import sys
+import json
+import time
+import argparse
+import numpy as np
+import networkx as nx
+from scipy.spatial.distance import cdist
+
+sys.path.append(".")
+import layout
+
+# spring_layout is skipped above this size, it takes minutes
+MAX_SPRING_SIZE = 300
+
+
+def make_graph(n, seed=0):
+    """ Random geometric graph with about six edges per node, weighted by distance """
+    rng = np.random.default_rng(seed)
+    points = rng.random((n, 2))
+    dist = cdist(points, points)
+    rows, cols = np.triu_indices(n, k=1)
+    keep = dist[rows, cols] < np.sqrt(6 / (np.pi * n))
+    return rows[keep], cols[keep], 10 * dist[rows, cols][keep]
+
+
+def timed(fn):
+    start = time.perf_counter()
+    result = fn()
+    return result, time.perf_counter() - start
+
+
+def bench(n):
+    rows, cols, weights = make_graph(n)
+    result = {"n": n, "edges": int(len(rows))}
+
+    (pos, iterations), seconds = timed(lambda: layout.force_layout(n, rows, cols, weights))
+    result["fast"] = {"seconds": seconds, "iterations": iterations,
+                      "stress": layout.stress(pos, n, rows, cols)}
+
+    (warm, iterations), seconds = timed(
+        lambda: layout.force_layout(n, rows, cols, weights, initial_pos=pos))
+    result["fast_warm_start"] = {"seconds": seconds, "iterations": iterations,
+                                 "stress": layout.stress(warm, n, rows, cols)}
+
+    if n <= MAX_SPRING_SIZE:
+        G = nx.Graph()
+        G.add_nodes_from(range(n))
+        G.add_weighted_edges_from(zip(rows.tolist(), cols.tolist(), weights.tolist()))
+        spring, seconds = timed(lambda: nx.spring_layout(G, iterations=5000, seed=42))
+        spring = np.array([spring[i] for i in range(n)])
+        result["spring_layout"] = {"seconds": seconds, "iterations": 5000,
+                                   "stress": layout.stress(spring, n, rows, cols)}
+    return result
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[20, 100, 300, 700])
+    parser.add_argument("--out", default=None, help="write the results to this JSON file")
+    args = parser.parse_args()
+
+    results = []
+    for n in args.sizes:
+        result = bench(n)
+        results.append(result)
+        summary = ", ".join(f"{name} {r['seconds']:.3f}s stress {r['stress']:.3f}"
+                            for name, r in result.items() if isinstance(r, dict))
+        print(f"n={n}: {summary}")
+    if args.out:
+        with open(args.out, "w") as f:
+            json.dump(results, f, indent=2)
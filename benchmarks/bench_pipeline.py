@@ -0,0 +1,169 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Pipeline benchmark
+
+Times every stage of the ingest -> graph pipeline on synthetic corpora:
+ingest (fetch, diff and write through IngestPipeline against an in-process
+wiki api and the memory:// storage backend), storage reads, make_frame,
+convert_count_matrix_to_tfid, create_dist_matrix, graph build and layout.
+Each corpus size runs in a fresh process so its peak RSS is its own;
+peak_rss_mb after a stage is the process peak so far, so the stage that
+raised it is the one that needed the memory.
+
+Results are written as JSON. With --compare, stages that got slower than
+the previous results by more than --tolerance are reported.
+
+Usage: python benchmarks/bench_pipeline.py [--sizes 20 200 700 5000]
+           [--out bench_pipeline.json] [--compare old.json]
+"""
+
+import io
+import os
+import sys
+import json
+import contextlib
+import time
+import platform
+import resource
+import argparse
+import subprocess
+import multiprocessing
+import numpy as np
+
+sys.path.append(".")
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+from synthetic_corpus import generate_corpus, CorpusApiSession, VOCABULARY_SIZE, LINK_DENSITY
+
+# Edges per node kept when thresholding the distance matrix for the graph
+EDGES_PER_NODE = 6
+
+
+def peak_rss_mb():
+    """ Peak resident set size of this process so far """
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in kilobytes on Linux and bytes on macOS
+    return peak / 1024 / (1024 if sys.platform == "darwin" else 1)
+
+
+def run_size(n, vocabulary_size=VOCABULARY_SIZE, link_density=LINK_DENSITY, verbose=False):
+    """ Run the pipeline once on n synthetic documents.
+    Returns {"n": n, "stages": {stage: {"seconds", "peak_rss_mb"}}, ...}
+    The pipeline's own progress output is hidden unless verbose. """
+    if not verbose:
+        with contextlib.redirect_stdout(io.StringIO()):
+            return run_size(n, vocabulary_size, link_density, verbose=True)
+    import eda
+    import ingest
+    import layout
+    from features import FeatureCache
+    from wrappers.storage_wrapper import StorageWrapper
+
+    stages = {}
+
+    def timed(stage, fn):
+        start = time.perf_counter()
+        result = fn()
+        stages[stage] = {"seconds": time.perf_counter() - start, "peak_rss_mb": peak_rss_mb()}
+        return result
+
+    corpus = timed("generate", lambda: generate_corpus(
+        n, vocabulary_size=vocabulary_size, link_density=link_density))
+
+    db_name = f"bench_{n}"
+    wrapper = StorageWrapper(db_name, uri="memory://")
+    wrapper.open_or_create("languages")
+    session = CorpusApiSession(corpus)
+    name_to_title = {name: name for name, text in corpus}
+    updated = timed("ingest", lambda: ingest.IngestPipeline(wrapper, session=session)
+                    .run(name_to_title))
+    timed("storage_read", lambda: sum(1 for record in wrapper.iter_all()))
+
+    cache = FeatureCache(StorageWrapper(db_name, uri="memory://"))
+    counts = timed("make_frame", lambda: eda.make_frame(wrapper=wrapper, cache=cache))
+    tfidf = timed("convert_count_matrix_to_tfid", lambda: eda.convert_count_matrix_to_tfid(counts))
+    dist_mat = timed("create_dist_matrix", lambda: eda.create_dist_matrix(tfidf))
+
+    distances = dist_mat.to_numpy()
+    upper = distances[np.triu_indices(n, k=1)]
+    threshold = np.quantile(upper, min(1.0, EDGES_PER_NODE / max(n - 1, 1))) if n > 1 else 0
+
+    def build_graph():
+        rows, cols, weights = eda.build_edges(distances, threshold)
+        return rows, cols, weights, eda.build_graph(n, rows, cols, weights)
+    rows, cols, weights, G = timed("graph_build", build_graph)
+    (pos, iterations) = timed("layout", lambda: layout.force_layout(n, rows, cols, weights))
+
+    return {"n": n, "stages": stages, "documents_written": len(updated),
+            "vocabulary": len(counts.columns), "edges": int(len(rows)),
+            "layout_iterations": iterations, "api_bytes": session.bytes_served,
+            "total_seconds": sum(s["seconds"] for s in stages.values())}
+
+
+def run_isolated(n, vocabulary_size, link_density, verbose=False):
+    """ run_size in a fresh process, so peak RSS is not shared between sizes """
+    with multiprocessing.get_context("spawn").Pool(1) as pool:
+        return pool.apply(run_size, (n, vocabulary_size, link_density, verbose))
+
+
+def environment():
+    try:
+        commit = subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True,
+                                text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return {"commit": commit, "python": platform.python_version(),
+            "numpy": np.__version__, "platform": platform.platform(),
+            "cpus": os.cpu_count(), "time": time.strftime("%Y-%m-%dT%H:%M:%S")}
+
+
+def compare(results, previous, tolerance):
+    """ Return (n, stage, old seconds, new seconds) for every stage slower
+    than in previous by more than the tolerance fraction """
+    old = {r["n"]: r["stages"] for r in previous["results"]}
+    slower = []
+    for result in results:
+        for stage, timing in result["stages"].items():
+            before = old.get(result["n"], {}).get(stage)
+            if before and timing["seconds"] > before["seconds"] * (1 + tolerance):
+                slower.append((result["n"], stage, before["seconds"], timing["seconds"]))
+    return slower
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[20, 200, 700, 5000])
+    parser.add_argument("--vocabulary-size", type=int, default=VOCABULARY_SIZE)
+    parser.add_argument("--link-density", type=float, default=LINK_DENSITY)
+    parser.add_argument("--out", default="bench_pipeline.json")
+    parser.add_argument("--compare", default=None, help="previous results to check against")
+    parser.add_argument("--tolerance", type=float, default=0.2,
+                        help="slowdown fraction reported as a regression")
+    parser.add_argument("--verbose", action="store_true", help="show the pipeline's output")
+    args = parser.parse_args()
+
+    results = []
+    for n in args.sizes:
+        result = run_isolated(n, args.vocabulary_size, args.link_density, args.verbose)
+        results.append(result)
+        summary = ", ".join(f"{stage} {s['seconds']:.2f}s" for stage, s in result["stages"].items())
+        peak = max(s["peak_rss_mb"] for s in result["stages"].values())
+        print(f"n={n}: {summary}; peak rss {peak:.0f} MB")
+
+    report = {"environment": environment(),
+              "parameters": {"vocabulary_size": args.vocabulary_size,
+                             "link_density": args.link_density},
+              "results": results}
+    with open(args.out, "w") as f:
+        json.dump(report, f, indent=2)
+    print(f"Results written to {args.out}")
+
+    if args.compare:
+        with open(args.compare) as f:
+            slower = compare(results, json.load(f), args.tolerance)
+        for n, stage, before, after in slower:
+            print(f"Regression: n={n} {stage} {before:.2f}s -> {after:.2f}s")
+        if slower:
+            sys.exit(1)
@@ -0,0 +1,146 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Startup benchmark
+
+Measures what each entry point costs before it does any work: the wall time
+of a fresh interpreter importing it, its cumulative import time from
+python -X importtime, the heaviest packages it pulls in, and which of the
+plotting and ML libraries got loaded (none of them should be at import).
+Also times the language name -> title map with and without its cached index.
+
+Results are written as JSON. With --compare, modules whose import got slower
+than the previous results by more than --tolerance are reported.
+
+Usage: python benchmarks/bench_startup.py [--modules ingest stages eda service]
+           [--out bench_startup.json] [--compare old.json]
+"""
+
+import os
+import sys
+import json
+import time
+import argparse
+import tempfile
+import subprocess
+
+sys.path.append(".")
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+ENTRY_MODULES = ("ingest", "stages", "eda", "service", "embeddings")
+# Libraries that should only be imported by the stage that needs them
+HEAVY_MODULES = ("pandas", "sklearn", "matplotlib", "networkx", "seaborn", "joblib")
+TOP_IMPORTS = 10
+REPEATS = 3
+
+
+def parse_importtime(stderr):
+    """ Return a list of (name, self us, cumulative us, depth) from the
+    output of python -X importtime, in its order: children before parents """
+    imports = []
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        self_us, cumulative_us, name = line[len("import time:"):].split("|")
+        # Names are indented by two spaces per level below a top-level import
+        depth = (len(name) - len(name.lstrip()) - 1) // 2
+        imports.append((name.strip(), int(self_us), int(cumulative_us), depth))
+    return imports
+
+
+def subtree(imports, module):
+    """ The module's own entry and the imports it triggered """
+    for end, (name, _, _, depth) in enumerate(imports):
+        if name == module and depth == 0:
+            start = end
+            while start > 0 and imports[start - 1][3] > 0:
+                start -= 1
+            return imports[start:end + 1]
+    return []
+
+
+def measure_import(module, repeats=REPEATS):
+    """ Import module in fresh interpreters, keeping the fastest run.
+    Returns {"wall_seconds", "import_seconds", "top", "heavy_loaded"}. """
+    code = (f"import {module}, sys, json; "
+            f"print(json.dumps([m for m in {HEAVY_MODULES!r} if m in sys.modules]))")
+    best = None
+    for _ in range(repeats):
+        start = time.perf_counter()
+        run = subprocess.run([sys.executable, "-X", "importtime", "-c", code],
+                             capture_output=True, text=True, check=True)
+        wall = time.perf_counter() - start
+        if best is None or wall < best[0]:
+            best = (wall, run)
+    wall, run = best
+    imports = subtree(parse_importtime(run.stderr), module)
+    # The packages the module pulled in, heaviest first
+    top = sorted(((name, cumulative) for name, _, cumulative, depth in imports
+                  if depth > 0 and "." not in name),
+                 key=lambda item: item[1], reverse=True)[:TOP_IMPORTS]
+    return {"wall_seconds": wall, "import_seconds": imports[-1][2] / 1e6 if imports else 0.0,
+            "top": [{"name": name, "seconds": cumulative / 1e6} for name, cumulative in top],
+            "heavy_loaded": json.loads(run.stdout.strip().splitlines()[-1])}
+
+
+def measure_name_title_index(csv_path=None):
+    """ Seconds to build the language map from the csv, and from its index """
+    import languages
+    csv_path = csv_path or languages.NAME_TITLE_CSV
+    with tempfile.TemporaryDirectory() as tmp:
+        index_path = os.path.join(tmp, "name_title_index.json")
+        start = time.perf_counter()
+        languages.make_name_title_dict(keep_all=True, csv_path=csv_path, index_path=index_path)
+        built = time.perf_counter() - start
+        start = time.perf_counter()
+        languages.make_name_title_dict(keep_all=True, csv_path=csv_path, index_path=index_path)
+        cached = time.perf_counter() - start
+    return {"build_seconds": built, "cached_seconds": cached}
+
+
+def compare(results, previous, tolerance):
+    """ Return (module, old seconds, new seconds) for every module whose
+    import wall time grew by more than the tolerance fraction """
+    old = previous["modules"]
+    return [(module, old[module]["wall_seconds"], result["wall_seconds"])
+            for module, result in results["modules"].items()
+            if module in old and
+            result["wall_seconds"] > old[module]["wall_seconds"] * (1 + tolerance)]
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--modules", nargs="+", default=list(ENTRY_MODULES))
+    parser.add_argument("--repeats", type=int, default=REPEATS)
+    parser.add_argument("--out", default="bench_startup.json")
+    parser.add_argument("--compare", default=None, help="previous results to check against")
+    parser.add_argument("--tolerance", type=float, default=0.2,
+                        help="slowdown fraction reported as a regression")
+    args = parser.parse_args()
+
+    from bench_pipeline import environment
+    results = {"environment": environment(), "modules": {},
+               "name_title_index": measure_name_title_index()}
+    for module in args.modules:
+        result = measure_import(module, args.repeats)
+        results["modules"][module] = result
+        heaviest = ", ".join(f"{t['name']} {t['seconds']:.2f}s" for t in result["top"][:3])
+        print(f"{module}: {result['wall_seconds']:.2f}s wall, "
+              f"{result['import_seconds']:.2f}s importing ({heaviest})"
+              f"{'; loaded ' + ', '.join(result['heavy_loaded']) if result['heavy_loaded'] else ''}")
+    index = results["name_title_index"]
+    print(f"language map: {index['build_seconds'] * 1000:.1f}ms from the csv, "
+          f"{index['cached_seconds'] * 1000:.1f}ms from the index")
+    with open(args.out, "w") as f:
+        json.dump(results, f, indent=2)
+    print(f"Results written to {args.out}")
+
+    if args.compare:
+        with open(args.compare) as f:
+            slower = compare(results, json.load(f), args.tolerance)
+        for module, before, after in slower:
+            print(f"Regression: import {module} {before:.2f}s -> {after:.2f}s")
+        if slower:
+            sys.exit(1)
@@ -0,0 +1,99 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Synthetic corpus
+
+Generates wiki-markup articles shaped like the language pages: filler words
+with [[links]] drawn from a shared vocabulary. Link targets follow a Zipf
+distribution and each article leans towards one of a few topics, so the
+distance matrix has the clustered structure of the real corpus. Also
+provides an in-process stand-in for the wiki api serving the corpus.
+
+Usage: python benchmarks/synthetic_corpus.py [--docs 20] [--out corpus.json]
+"""
+
+import sys
+import json
+import argparse
+import numpy as np
+
+sys.path.append(".")
+
+VOCABULARY_SIZE = 5000
+WORDS_PER_DOC = 4000
+# Fraction of the words in an article that are [[links]]
+LINK_DENSITY = 0.05
+N_TOPICS = 8
+
+
+def generate_corpus(n_docs, vocabulary_size=VOCABULARY_SIZE, words_per_doc=WORDS_PER_DOC,
+                    link_density=LINK_DENSITY, n_topics=N_TOPICS, seed=0):
+    """ Return a list of (name, text) for n_docs synthetic articles.
+    The result only depends on the arguments. """
+    rng = np.random.default_rng(seed)
+    vocabulary = np.array([f"Term {i}" for i in range(vocabulary_size)], dtype=object)
+    filler = np.array(["the", "language", "is", "a", "of", "and", "with", "for",
+                       "compiler", "program", "type", "system", "was", "by"], dtype=object)
+    # Zipf weights over the vocabulary, reshuffled per topic
+    zipf = 1.0 / np.arange(1, vocabulary_size + 1)
+    topics = [rng.permutation(zipf) for _ in range(n_topics)]
+    n_links = max(1, int(words_per_doc * link_density))
+
+    docs = []
+    for doc in range(n_docs):
+        weights = 0.7 * topics[doc % n_topics] + 0.3 * zipf
+        links = rng.choice(vocabulary, size=n_links, p=weights / weights.sum())
+        words = rng.choice(filler, size=words_per_doc - n_links)
+        tokens = np.concatenate([words, [f"[[{link}]]" for link in links]])
+        rng.shuffle(tokens)
+        docs.append((f"lang{doc}", " ".join(tokens)))
+    return docs
+
+
+class CorpusApiSession:
+    """ Answers wiki api revision queries from a corpus of (title, text),
+    in place of a requests.Session, so ingest runs without the network """
+
+    def __init__(self, corpus, revid=1):
+        self.articles = dict(corpus)
+        self.revid = revid
+        self.bytes_served = 0
+
+    def get(self, url, params=None, timeout=None, headers=None):
+        import requests
+        pages = {}
+        for idx, title in enumerate(params["titles"].split("|")):
+            if title in self.articles:
+                revision = {"revid": self.revid}
+                if "content" in params["rvprop"]:
+                    revision["*"] = self.articles[title]
+                pages[str(idx + 1)] = {"title": title, "revisions": [revision]}
+            else:
+                pages[str(-idx - 1)] = {"title": title, "missing": ""}
+        response = requests.Response()
+        response.status_code = 200
+        response.url = url
+        response._content = json.dumps({"query": {"pages": pages}}).encode("utf-8")
+        response.encoding = "utf-8"
+        self.bytes_served += len(response._content)
+        return response
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--docs", type=int, default=20)
+    parser.add_argument("--vocabulary-size", type=int, default=VOCABULARY_SIZE)
+    parser.add_argument("--words-per-doc", type=int, default=WORDS_PER_DOC)
+    parser.add_argument("--link-density", type=float, default=LINK_DENSITY)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--out", default=None, help="write {name: text} to this JSON file")
+    args = parser.parse_args()
+
+    corpus = generate_corpus(args.docs, args.vocabulary_size, args.words_per_doc,
+                             args.link_density, seed=args.seed)
+    if args.out:
+        with open(args.out, "w") as f:
+            json.dump(dict(corpus), f)
+    else:
+        print(corpus[0][1][:500])
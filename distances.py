@@ -0,0 +1,231 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Distances
+
+Pairwise document distances computed directly on the sparse TF-IDF matrix,
+with an incremental mode that persists the previous distance matrix and IDF
+and only recomputes the rows and columns of documents that changed. A
+document has changed when the hash of its row of counts differs from the
+one saved with the previous distances.
+"""
+
+import os
+import json
+import hashlib
+import numpy as np
+import pandas as pd
+from sklearn.metrics import pairwise_distances
+from scipy import sparse
+from scipy.spatial.distance import cdist
+from features import LabelledMatrix
+
+# Metrics that sklearn computes directly on sparse input
+SPARSE_METRICS = ("cityblock", "manhattan", "cosine", "euclidean", "l1", "l2")
+DISTANCE_STATE_DIR = "./data/distance_state"
+# Largest relative change in the IDF of any shared term before the stored
+# distances between unchanged documents are considered stale
+IDF_TOLERANCE = 0.05
+# Above this fraction of changed documents a full recompute is as cheap
+FULL_RECOMPUTE_FRACTION = 0.5
+# Working memory allowed for one block of a blocked distance computation, on
+# top of the output matrix itself
+MEMORY_CEILING = 256 * 2 ** 20
+
+
+def compute_idf(counts: LabelledMatrix):
+    """ Smoothed IDF per column, matching sklearn's TfidfTransformer defaults """
+    n_docs = counts.matrix.shape[0]
+    doc_freq = np.bincount(counts.matrix.indices, minlength=counts.matrix.shape[1])
+    return np.log((1 + n_docs) / (1 + doc_freq)) + 1
+
+
+def count_row_hashes(counts: LabelledMatrix):
+    """ Return {name: sha1 of the terms and counts in its row}, the same
+    whatever order the columns are in """
+    matrix = counts.matrix.tocsr()
+    columns = np.asarray(counts.columns, dtype=str)
+    hashes = {}
+    for i, name in enumerate(counts.index):
+        row = slice(matrix.indptr[i], matrix.indptr[i + 1])
+        terms = columns[matrix.indices[row]]
+        order = np.argsort(terms)
+        row_hash = hashlib.sha1("\0".join(terms[order]).encode("utf-8"))
+        row_hash.update(np.asarray(matrix.data[row][order], dtype=np.float64).tobytes())
+        hashes[name] = row_hash.hexdigest()
+    return hashes
+
+
+def to_dense(A):
+    return A.toarray() if sparse.issparse(A) else np.asarray(A)
+
+
+def pairwise(A, B, metric='cityblock'):
+    """ Distances between the rows of A and the rows of B, staying sparse when the metric allows """
+    if metric in SPARSE_METRICS:
+        return pairwise_distances(A, B, metric=metric)
+    return cdist(to_dense(A), to_dense(B), metric=metric)
+
+
+def block_size(n_features, metric='cityblock', memory_ceiling=MEMORY_CEILING):
+    """ Rows per side of a square block whose working memory fits the ceiling:
+    a float64 block of distances, its float32 copy, and for metrics that need
+    dense input, both blocks of rows densified """
+    per_row_dense = 0 if metric in SPARSE_METRICS else 2 * n_features * 8
+    # Solve 12 * b^2 + per_row_dense * b <= memory_ceiling for b
+    b = (-per_row_dense + np.sqrt(per_row_dense ** 2 + 48 * memory_ceiling)) / 24
+    return max(1, int(b))
+
+
+def condensed_offset(i, n):
+    """ Position of the pair (i, i + 1) in a condensed distance vector """
+    return n * i - i * (i + 1) // 2
+
+
+def blocked_pairwise(X, metric='cityblock', condensed=False, out=None, path=None,
+                     dtype=np.float32, memory_ceiling=MEMORY_CEILING):
+    """ Distances between all rows of the matrix X, computed in square
+    blocks on and above the diagonal and written into a preallocated output,
+    so peak memory is the output plus one block.
+    The output is an (n, n) matrix, or with condensed the n * (n - 1) / 2
+    upper triangle in scipy's pdist order. It is out if given, else a
+    memory-mapped file at path if given, else an array in memory. """
+    # Dense input, e.g. an embedding, is sliced as is
+    X = X.tocsr() if sparse.issparse(X) else np.asarray(X)
+    n = X.shape[0]
+    shape = (n * (n - 1) // 2,) if condensed else (n, n)
+    if out is None and path is not None:
+        out = np.lib.format.open_memmap(path, mode="w+", dtype=dtype, shape=shape)
+    elif out is None:
+        out = np.empty(shape, dtype=dtype)
+    assert out.shape == shape
+    if not condensed:
+        out[np.diag_indices(n)] = 0
+
+    b = block_size(X.shape[1], metric, memory_ceiling)
+    for start in range(0, n, b):
+        end = min(start + b, n)
+        rows = X[start:end]
+        for col_start in range(start, n, b):
+            col_end = min(col_start + b, n)
+            block = pairwise(rows, X[col_start:col_end], metric).astype(dtype, copy=False)
+            if not condensed:
+                out[start:end, col_start:col_end] = block
+                out[col_start:col_end, start:end] = block.T
+                continue
+            for i in range(start, end):
+                # Columns right of the diagonal within this block
+                first = max(col_start, i + 1)
+                if first >= col_end:
+                    continue
+                offset = condensed_offset(i, n) + first - i - 1
+                out[offset:offset + col_end - first] = block[i - start, first - col_start:]
+    if isinstance(out, np.memmap):
+        out.flush()
+    return out
+
+
+def idf_shift(old_idf, old_columns, new_idf, new_columns):
+    """ Largest relative IDF change over the terms in both vocabularies """
+    _, old_pos, new_pos = np.intersect1d(
+        np.asarray(old_columns, dtype=str), np.asarray(new_columns, dtype=str),
+        assume_unique=True, return_indices=True)
+    if len(old_pos) == 0:
+        return np.inf
+    return float(np.max(np.abs(new_idf[new_pos] - old_idf[old_pos]) / old_idf[old_pos]))
+
+
+def save_distance_state(distances, index, idf, columns, metric, row_hashes,
+                        state_dir=DISTANCE_STATE_DIR):
+    """ Persist the distance matrix, TF-IDF state and the count row hash of
+    each document for the next incremental run """
+    os.makedirs(state_dir, exist_ok=True)
+    # Write to temporary names first so an interrupted run never leaves a
+    # matrix that does not match its labels
+    np.save(os.path.join(state_dir, "distances.tmp.npy"), distances)
+    np.save(os.path.join(state_dir, "idf.tmp.npy"), idf)
+    with open(os.path.join(state_dir, "meta.tmp.json"), "w") as f:
+        json.dump({"index": list(index), "columns": list(columns), "metric": metric,
+                   "hashes": [row_hashes.get(name) for name in index]}, f)
+    for name in ("distances.npy", "idf.npy", "meta.json"):
+        stem, ext = os.path.splitext(name)
+        os.replace(os.path.join(state_dir, f"{stem}.tmp{ext}"), os.path.join(state_dir, name))
+
+
+def load_distance_state(state_dir=DISTANCE_STATE_DIR):
+    """ Return (distances, index, idf, columns, metric, row hashes) or None if
+    nothing is saved. State saved without row hashes has None for each. """
+    try:
+        with open(os.path.join(state_dir, "meta.json")) as f:
+            meta = json.load(f)
+        # Memory-mapped, only the rows that are reused are read
+        distances = np.load(os.path.join(state_dir, "distances.npy"), mmap_mode="r")
+        idf = np.load(os.path.join(state_dir, "idf.npy"))
+    except (OSError, ValueError):
+        return None
+    hashes = meta.get("hashes") or [None] * len(meta["index"])
+    return distances, meta["index"], idf, meta["columns"], meta["metric"], hashes
+
+
+def update_dist_matrix(X: LabelledMatrix, idf, row_hashes, metric='cityblock',
+                       state_dir=DISTANCE_STATE_DIR, tolerance=IDF_TOLERANCE, dtype=np.float64,
+                       path=None, memory_ceiling=MEMORY_CEILING):
+    """ Return the labelled distance matrix for the TF-IDF matrix X.
+    row_hashes is {name: hash} of the count matrix X was built from, see
+    count_row_hashes. Only rows and columns of documents whose hash differs
+    from the saved one (or that are new since the last run) are recomputed;
+    distances between unchanged documents are reused unless the IDF of their
+    shared terms moved by more than tolerance.
+    A full recompute is done in blocks, see blocked_pairwise. With path the
+    matrix is written to that .npy file and memory-mapped, not held in memory. """
+    n = X.matrix.shape[0]
+    previous = load_distance_state(state_dir)
+    full_reason = None
+    if previous is None:
+        full_reason = "no saved distance state"
+    else:
+        old_distances, old_index, old_idf, old_columns, old_metric, old_hashes = previous
+        old_position = {name: pos for pos, name in enumerate(old_index)}
+        stale = {name for name in X.index if name not in old_position or
+                 old_hashes[old_position[name]] is None or
+                 old_hashes[old_position[name]] != row_hashes.get(name)}
+        shift = idf_shift(old_idf, old_columns, idf, X.columns)
+        if old_metric != metric:
+            full_reason = f"metric changed from {old_metric}"
+        elif shift > tolerance:
+            full_reason = f"idf shift {shift:.3f} above tolerance {tolerance}"
+        elif len(stale) > FULL_RECOMPUTE_FRACTION * n:
+            full_reason = f"{len(stale)} of {n} documents changed"
+
+    if full_reason is not None:
+        print(f"Full distance recompute: {full_reason}")
+        distances = blocked_pairwise(X.matrix, metric, path=path, dtype=dtype,
+                                     memory_ceiling=memory_ceiling)
+    else:
+        stale_rows = np.array([i for i, name in enumerate(X.index) if name in stale], dtype=int)
+        print(f"Incremental distance update for {len(stale_rows)} of {n} documents")
+        # Carry over the distances between unchanged documents
+        kept_rows = np.array([i for i in range(n) if X.index[i] not in stale], dtype=int)
+        kept_old = np.array([old_position[X.index[i]] for i in kept_rows], dtype=int)
+        if path is not None:
+            distances = np.lib.format.open_memmap(path, mode="w+", dtype=dtype, shape=(n, n))
+        else:
+            distances = np.zeros((n, n), dtype=dtype)
+        # Both loops go a block of rows at a time to keep temporaries small
+        b = max(1, memory_ceiling // (12 * n))
+        for start in range(0, len(kept_rows), b):
+            rows = kept_rows[start:start + b]
+            distances[np.ix_(rows, kept_rows)] = \
+                old_distances[kept_old[start:start + b]][:, kept_old]
+        for start in range(0, len(stale_rows), b):
+            rows = stale_rows[start:start + b]
+            block = pairwise(X.matrix[rows], X.matrix, metric)
+            distances[rows, :] = block
+            distances[:, rows] = block.T
+        if path is not None:
+            distances.flush()
+
+    save_distance_state(distances, X.index, idf, X.columns, metric, row_hashes, state_dir)
+    lang_names = np.char.title(X.index)
+    return pd.DataFrame(distances, columns=lang_names, index=lang_names, copy=False)
@@ -5,62 +5,55 @@
 * EDA - experiment 1 - connection graph and heatmap of bracketed nouns
 """
 
-from sklearn.feature_extraction.text import TfidfTransformer
-from scipy.spatial.distance import cdist
+from __future__ import annotations
 import os
 import numpy as np
-import matplotlib.pyplot as plt
-import pandas as pd
-import networkx as nx
-import re
 from pprint import pprint as pp
-import seaborn as sns
 from wrappers.storage_wrapper import StorageWrapper
+from features import (LabelledMatrix, NounCountAccumulator, FeatureCache,
+                      stream_noun_counts, from_frame)
+from scipy import sparse
+# pandas, sklearn, networkx and matplotlib are imported by the functions that
+# use them, so reading eda's settings does not load them. See
+# benchmarks/bench_startup.py.
+
+# CONFIGURABLE PARAMS START
+# Edges longer than this distance are not drawn in the graph
+DISTANCE_THRESHOLD = 35
+FONT_SIZE = 15
+# 'fast' for layout.force_layout, 'spring' for networkx's spring_layout
+LAYOUT_ENGINE = "fast"
+GRAPH_FIGURE_PATH = "./figures/eda_graph.png"
+HEATMAP_FIGURE_PATH = "./figures/eda_heatmap.png"
+# CONFIGURABLE PARAMS END
 
 def create_test_data():
     """ Return test data to test the pipeline """
+    import pandas as pd
     return pd.DataFrame([[0, 1, 1, 0], [1, 0, 0, 1], [1, 0, 1, 1], [1, 1, 0, 0]], columns=(
         "The", "Ball", "Player", "Wife"), index=("The Ball Player", "The Wife", "Player Wife", "The Ball"))
 
 
-def make_frame(USE_TEST_DATA=False):
+def make_frame(USE_TEST_DATA=False, wrapper=None, cache=None, names=None, workers=1):
     """ Reads in cached data from the ingestion script.
-    Creates dataframe of word and noun features with
-    programming languages as rows."""
-    X = pd.DataFrame()
-
+    Creates a sparse count matrix of noun features with
+    programming languages as rows.
+    Noun counts in the feature cache are reused for articles that have not
+    changed, the rest are extracted in workers processes.
+    If names is given, only those languages are included. """
     if USE_TEST_DATA == True:
-        X = create_test_data()
-    else:
-        # Pull all the bracketed nouns out of the wikipedia entry using a regex
-        bracketed_nouns = """\\[\\[.*?\\]\\]"""
-        noun_matcher = re.compile(bracketed_nouns)
+        return from_frame(create_test_data())
 
+    if wrapper is None:
         wrapper = StorageWrapper("prod")
         wrapper.open_or_create("languages")
-
-        total_noun_set = set()
-        for pl in wrapper.keys():
-            text, date = wrapper.find(pl)
-            nouns = noun_matcher.findall(text)
-            nouns = [n.lower().strip() for n in nouns]
-            total_noun_set.update(nouns)
-
-        X = pd.DataFrame(columns=list(total_noun_set))
-        # Name the columns so that there is one for each noun
-
-        for pl in wrapper.keys():
-            text, date = wrapper.find(pl)
-            nouns = noun_matcher.findall(text)
-            nouns = [n.lower() for n in nouns]
-            # Create blank row
-            curr_row = np.zeros(shape=len(total_noun_set), dtype=np.float16)
-            # Build count matrix
-            for idx, n in enumerate(X.columns.to_list()):
-                if n in nouns:
-                    curr_row[idx] += 1.0
-            X.loc[pl, :] = curr_row
-    return X
+    if cache is None:
+        # Next to the articles it caches
+        cache = FeatureCache(StorageWrapper(wrapper.db_name, uri=wrapper.uri))
+    accumulator = NounCountAccumulator()
+    for pl, counts in stream_noun_counts(wrapper, cache, names, workers):
+        accumulator.add(pl, counts)
+    return accumulator.to_matrix(sort_rows=True)
 
 
 def remove_low_variance(X: pd.DataFrame):
@@ -72,72 +65,83 @@ def remove_low_variance(X: pd.DataFrame):
 def create_most_frequent_bar_graph(stats: dict):
     top_nouns = list(stats['sorted_noun_freq'].keys())[0:50]
     top_values = list(stats['sorted_noun_freq'].values())[0:50]
+    import matplotlib.pyplot as plt
 
     plt.barh(y=top_nouns, width=top_values)
     plt.xlabel(f"Occurence out of {len(X)} total documents")
     plt.show()
 
 
-def convert_count_matrix_to_tfid(X: pd.DataFrame):
-    old_index = list(X.index)
-    X = TfidfTransformer().fit_transform(X).todense()
-    X = pd.DataFrame(X, index=old_index)
-    return X
-
-
-def create_dist_matrix(X, metric='cityblock'):
-    """ Create a distance matrix for X """
-    X = X.convert_dtypes().astype(float)
-    lang_names = np.char.title(X.index.tolist())
+def convert_count_matrix_to_tfid(X: LabelledMatrix, dtype=np.float64):
+    """ Apply TF-IDF to a count matrix, keeping it sparse.
+    Use dtype=np.float32 to halve its memory. """
+    from sklearn.feature_extraction.text import TfidfTransformer
+    if not isinstance(X, LabelledMatrix):
+        X = from_frame(X)
+    tfidf = TfidfTransformer().fit_transform(X.matrix.astype(dtype))
+    return LabelledMatrix(tfidf.tocsr(), X.index, X.columns)
+
+
+def create_dist_matrix(X: LabelledMatrix, metric='cityblock', low_memory=False, path=None,
+                       memory_ceiling=None):
+    """ Create a distance matrix for X.
+    In low_memory mode the matrix is float32 and computed in blocks, so
+    peak memory is the matrix plus one block; with path it is memory-mapped
+    from that .npy file instead of held in memory. memory_ceiling bounds
+    each block's working memory, see distances.MEMORY_CEILING. """
+    import pandas as pd
+    from distances import pairwise, blocked_pairwise, MEMORY_CEILING
+    if not isinstance(X, LabelledMatrix):
+        X = from_frame(X)
+    lang_names = np.char.title(X.index)
     print(f"lang names sorted:{sorted(lang_names)}")
-    dist_mat = pd.DataFrame(cdist(X, X, metric=metric),
-                            columns=lang_names, index=lang_names)
+    if low_memory:
+        distances = blocked_pairwise(X.matrix, metric, path=path,
+                                     memory_ceiling=memory_ceiling or MEMORY_CEILING)
+    else:
+        distances = pairwise(X.matrix, X.matrix, metric)
+    dist_mat = pd.DataFrame(distances, columns=lang_names, index=lang_names, copy=False)
     assert len(dist_mat.index) == len(dist_mat.columns)
     return dist_mat
 
 
-def return_sorted_most_freq(X: pd.DataFrame):
+def return_sorted_most_freq(X: LabelledMatrix):
     """ Created sorted count dictionary from count matrix
      (features as cols, instances as rows) """
+    if not isinstance(X, LabelledMatrix):
+        X = from_frame(X)
+    totals = np.asarray(X.matrix.sum(axis=0)).ravel()
     sorted_noun_freq = sorted(
-        X.sum().to_dict().items(), key=lambda item: item[1], reverse=True)
+        zip(X.columns, totals.tolist()), key=lambda item: item[1], reverse=True)
     return dict(sorted_noun_freq)
 
 
-def plot_distance_matrix(dist_mat: pd.DataFrame):
-    """ Create networkx undirected graph """
+def build_edges(dist_mat, distance_threshold=DISTANCE_THRESHOLD):
+    """ Return (rows, cols, weights) arrays for every pair i < j whose distance
+    is at most distance_threshold. dist_mat is a square distance matrix, or a
+    sparse upper-triangular COO edge list such as NeighborIndex.radius_edges. """
+    if sparse.issparse(dist_mat):
+        coo = dist_mat.tocoo()
+        keep = (coo.row < coo.col) & (coo.data <= distance_threshold)
+        return coo.row[keep], coo.col[keep], coo.data[keep]
+    dist_mat = np.asarray(dist_mat)
     assert dist_mat.shape[0] == dist_mat.shape[1]
-    # CONFIGURABLE PARAMS START
-    DISTANCE_THRESHOLD = 35
-    FONT_SIZE = 15 
-    # CONFIGURABLE PARAMS END
-    X_row_labels = list(dist_mat.index)
-    dist_mat = dist_mat.to_numpy()
+    rows, cols = np.triu_indices(len(dist_mat), k=1)
+    weights = dist_mat[rows, cols]
+    keep = weights <= distance_threshold
+    return rows[keep], cols[keep], weights[keep]
 
-    # Save number of rows in distance matrix
-    n = len(dist_mat)
-    G = nx.Graph()
-    G.add_nodes_from(range(n))
-    # Create the edge list, skipping edges longer than a threshold
-    for i in range(n):
-        for j in range(i + 1, n):
-            wgt = dist_mat[i][j]
-            if wgt > DISTANCE_THRESHOLD:
-                continue
-            else:
-                G.add_edge(i, j, weight=wgt)
-
-    # Let networkx decide node positions
-    pos = nx.spring_layout(G, iterations=5000, seed=42)
-    # Grab edge weights fr/om the distance matrix
-    weights = [G[u][v]['weight'] for u, v in G.edges()]
 
+def scale_edge_weights(weights):
+    """ Map distances to line widths, with shorter distances drawn thicker """
+    weights = np.asarray(weights, dtype=float)
+    if len(weights) == 0:
+        return weights
     # Scale the weights to 0--1
-    weights = np.asarray(weights)
-    weight_min = weights.min()
-    weights = (weights - weight_min)
+    weights = weights - weights.min()
     weight_max = weights.max()
-    weights = weights / weights.max()
+    if weight_max > 0:
+        weights = weights / weight_max
     # weights are now 0 to 1
     print(f"minmaxed weights, min = {weights.min()}, {weights.max()}")
 
@@ -153,48 +157,96 @@ def plot_distance_matrix(dist_mat: pd.DataFrame):
     # Remove thin weights (only slightly related) to make the graph
     # lines easier to see. If False, draw all edges
     if False:
-        for idx, w in enumerate(weights):
-            if w < 7:
-                weights[idx] = 0
+        weights[weights < 7] = 0
+    return weights
+
+
+def build_graph(n, rows, cols, weights):
+    """ Bulk-load n nodes and the weighted edges into a networkx undirected graph """
+    import networkx as nx
+    G = nx.Graph()
+    G.add_nodes_from(range(n))
+    G.add_weighted_edges_from(zip(rows.tolist(), cols.tolist(), weights.tolist()))
+    return G
+
+
+def compute_layout(G, n, rows, cols, distances, engine=LAYOUT_ENGINE, initial_pos=None):
+    """ Return {node: position} for the graph.
+    The 'fast' engine warm-starts from initial_pos, an (n, 2) array as
+    returned by layout.load_positions, if given; 'spring' is networkx's
+    spring_layout. """
+    import networkx as nx
+    from layout import force_layout
+    if engine == "spring":
+        return nx.spring_layout(G, iterations=5000, seed=42)
+    pos, iterations = force_layout(n, rows, cols, distances, initial_pos=initial_pos, seed=42)
+    print(f"Layout converged after {iterations} iterations"
+          f"{' from saved positions' if initial_pos is not None else ''}")
+    return dict(enumerate(pos))
+
+
+def draw_graph(labels, rows, cols, distances, pos, font_size=FONT_SIZE,
+               path=GRAPH_FIGURE_PATH):
+    """ Draw the graph with edge widths scaled from the distances and save it """
+    import matplotlib.pyplot as plt
+    import networkx as nx
+    G = build_graph(len(labels), rows, cols, distances)
+    weights = scale_edge_weights(distances)
 
     # Draw the figure
     plt.figure(figsize=(11, 7))
     nx.draw_networkx_nodes(G, pos)
-    # Draw the edges
-    colors = ['#FFA07A'] * len(G.edges())
-    nx.draw_networkx_edges(G, pos, edgelist=G.edges(),
+    # Draw the edges in the same order as the weights
+    edgelist = list(zip(rows.tolist(), cols.tolist()))
+    colors = ['#FFA07A'] * len(edgelist)
+    nx.draw_networkx_edges(G, pos, edgelist=edgelist,
                            style='-', alpha=0.4, width=weights, edge_color=colors)
     # Draw the edge labels
-    labels = {(u, v): f"{w:.1f}" for u, v, w in G.edges(data='weight')}
-    # nx.draw_networkx_edge_labels(G, pos, edge_labels=labels,alpha=0.7,font_size=FONT_SIZE)
+    edge_labels = {(u, v): f"{w:.1f}" for u, v, w in G.edges(data='weight')}
+    # nx.draw_networkx_edge_labels(G, pos, edge_labels=edge_labels,alpha=0.7,font_size=font_size)
     # Draw the node labels
-    node_labels = {idx: X_row_labels[idx] for idx in G.nodes()}
+    node_labels = {idx: labels[idx] for idx in G.nodes()}
     nx.draw_networkx_labels(
-        G, pos=pos, labels=node_labels, font_size=FONT_SIZE + 3)
-    plt.savefig("./figures/eda_graph.png")
+        G, pos=pos, labels=node_labels, font_size=font_size + 3)
+    plt.savefig(path)
     plt.close()
     plt.clf()
     plt.cla()
 
 
+def plot_distance_matrix(dist_mat: pd.DataFrame, distance_threshold=DISTANCE_THRESHOLD,
+                         font_size=FONT_SIZE, edges=None, layout_engine=LAYOUT_ENGINE,
+                         path=GRAPH_FIGURE_PATH):
+    """ Create networkx undirected graph.
+    Edges come from dist_mat, or from a sparse edge list if edges is given. """
+    assert dist_mat.shape[0] == dist_mat.shape[1]
+    X_row_labels = list(dist_mat.index)
+    # Save number of rows in distance matrix
+    n = len(dist_mat)
+
+    # Create the edge list, skipping edges longer than a threshold
+    rows, cols, distances = build_edges(
+        dist_mat.to_numpy() if edges is None else edges, distance_threshold)
+    G = build_graph(n, rows, cols, distances)
+
+    # Decide node positions
+    pos = compute_layout(G, n, rows, cols, distances, layout_engine)
+    draw_graph(X_row_labels, rows, cols, distances, pos, font_size, path)
+
+
+def plot_heatmap(dist_mat: pd.DataFrame, path=HEATMAP_FIGURE_PATH, order=None):
+    """ Save a heatmap of the labelled distance matrix in clustering order,
+    downsampled when it is large. See render.py. """
+    from render import plot_heatmap as render_heatmap
+    render_heatmap(dist_mat.to_numpy(), list(dist_mat.index), path, order)
+
+
 def plot_minimal_spanning_tree():
     # for a future iteration
     pass
 
 if __name__ == "__main__":
-    np.random.seed(42)
-    X = make_frame()
-    print(f"Dataframe shape {X.shape}")
-    X = convert_count_matrix_to_tfid(X)
-    print(f"TFIDF matrix shape {X.shape}")
-    dist_mat = create_dist_matrix(X)
-
-    print(dist_mat.index)
-    print(dist_mat.columns)
-    print(
-        f"Dist matrix shape {dist_mat.shape}, type {type(dist_mat)}, max value {dist_mat.max().max():.2f} ")
-    print(dist_mat.head(n=3))
-
-    sns.heatmap(dist_mat)
-    plt.savefig(f"./figures/eda_heatmap.png")
-    plot_distance_matrix(dist_mat)
+    # Run every stage, reusing the saved artifacts of any stage whose inputs
+    # and parameters have not changed. See stages.py for running single stages.
+    import stages
+    stages.main()
@@ -0,0 +1,202 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Embeddings
+
+Projects the sparse TF-IDF matrix down to k dense float32 dimensions with
+randomized TruncatedSVD (LSA) or a sparse random projection, so distances
+cost O(k) per pair instead of O(vocabulary). The fitted projection is saved,
+and new or changed articles are folded in with it rather than refitting;
+terms it has never seen are ignored until it is refit. A projection fitted
+on too few documents for the dimensions asked for is refit once the corpus
+can support more, as is one the corpus has outgrown.
+
+Usage: python embeddings.py [--method svd] [--dims 50 100 200 300]
+prints how many of each language's nearest neighbours in the full
+vocabulary are still its neighbours in the embedding, to help pick k.
+"""
+
+import os
+import time
+import argparse
+import numpy as np
+from scipy import sparse
+from features import LabelledMatrix
+# sklearn and joblib are imported when a projection is fitted, saved or loaded
+
+EMBEDDING_METHODS = ("svd", "random")
+EMBEDDING_DIM = 200
+EMBEDDING_MODEL_PATH = "./data/embedding_model.joblib"
+# Refit instead of folding in once more than this fraction of the current
+# vocabulary was unknown to the fitted projection
+MAX_UNSEEN_TERMS = 0.2
+# Refit instead of folding in once there are this many times the documents
+# the projection was fitted on
+MAX_DOCUMENT_GROWTH = 2.0
+
+
+class Embedding:
+    """ A projection of TF-IDF rows to dims dense dimensions, remembering the
+    vocabulary it was fitted on """
+
+    def __init__(self, method="svd", dims=EMBEDDING_DIM, seed=42):
+        if method not in EMBEDDING_METHODS:
+            raise ValueError(f"Unknown embedding method {method}")
+        self.method = method
+        self.dims = dims
+        self.seed = seed
+        self.model = None
+        self.columns = None
+        # The dimensions actually fitted, which a small corpus limits, and
+        # the number of documents they were fitted on
+        self.components = None
+        self.n_docs = None
+
+    def max_components(self, X: LabelledMatrix):
+        """ Dimensions a projection fitted on X can have, at most dims """
+        n_docs, n_terms = X.matrix.shape
+        if self.method == "svd":
+            # TruncatedSVD needs fewer components than either dimension
+            return max(1, min(self.dims, n_terms - 1, n_docs - 1))
+        return self.dims
+
+    def fit(self, X: LabelledMatrix):
+        """ Fit the projection on the TF-IDF matrix X """
+        from sklearn.decomposition import TruncatedSVD
+        from sklearn.random_projection import SparseRandomProjection
+        if self.method == "svd":
+            self.model = TruncatedSVD(n_components=self.max_components(X),
+                                      algorithm="randomized", random_state=self.seed)
+        else:
+            self.model = SparseRandomProjection(n_components=self.dims, dense_output=True,
+                                                random_state=self.seed)
+        self.model.fit(X.matrix)
+        self.columns = list(X.columns)
+        self.components = self.model.n_components
+        self.n_docs = X.matrix.shape[0]
+        return self
+
+    def unseen_fraction(self, X: LabelledMatrix):
+        """ Fraction of X's vocabulary the projection was not fitted on """
+        if not X.columns:
+            return 0.0
+        known = set(self.columns)
+        return sum(1 for c in X.columns if c not in known) / len(X.columns)
+
+    def align(self, X: LabelledMatrix):
+        """ X's matrix with its columns in the fitted vocabulary's order.
+        Unseen terms are dropped. """
+        position = {c: i for i, c in enumerate(self.columns)}
+        keep = np.array([i for i, c in enumerate(X.columns) if c in position], dtype=int)
+        target = np.array([position[X.columns[i]] for i in keep], dtype=int)
+        mapping = sparse.csr_matrix((np.ones(len(keep)), (keep, target)),
+                                    shape=(len(X.columns), len(self.columns)))
+        return (X.matrix @ mapping).tocsr()
+
+    def transform(self, X: LabelledMatrix):
+        """ Return the embedding of X's rows as a LabelledMatrix holding a
+        dense float32 array """
+        embedded = self.model.transform(self.align(X)).astype(np.float32)
+        return LabelledMatrix(np.ascontiguousarray(embedded), list(X.index),
+                              [f"dim{i}" for i in range(embedded.shape[1])])
+
+    def save(self, path=EMBEDDING_MODEL_PATH):
+        import joblib
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.tmp"
+        joblib.dump({"method": self.method, "dims": self.dims, "seed": self.seed,
+                     "model": self.model, "columns": self.columns,
+                     "components": self.components, "n_docs": self.n_docs}, tmp_path)
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path=EMBEDDING_MODEL_PATH):
+        """ Return the saved Embedding, or None if there is none """
+        import joblib
+        try:
+            saved = joblib.load(path)
+        except (OSError, EOFError):
+            return None
+        embedding = cls(saved["method"], saved["dims"], saved["seed"])
+        embedding.model, embedding.columns = saved["model"], saved["columns"]
+        embedding.components = saved.get("components", embedding.model.n_components)
+        embedding.n_docs = saved.get("n_docs")
+        return embedding
+
+
+def embed(X: LabelledMatrix, method="svd", dims=EMBEDDING_DIM, path=EMBEDDING_MODEL_PATH,
+          max_unseen=MAX_UNSEEN_TERMS, max_growth=MAX_DOCUMENT_GROWTH):
+    """ Embed X with the projection saved at path, folding the rows in, or fit
+    and save a new one when there is none, it was made with other settings,
+    too much of X's vocabulary is new to it, it has fewer dimensions than
+    asked for and X could give it more, or X has many more documents than it
+    was fitted on """
+    embedding = Embedding.load(path) if path else None
+    if embedding is None or (embedding.method, embedding.dims) != (method, dims):
+        reason = "no saved projection" if embedding is None else "settings changed"
+    elif embedding.unseen_fraction(X) > max_unseen:
+        reason = f"{embedding.unseen_fraction(X):.0%} of the vocabulary is new"
+    elif embedding.components < embedding.max_components(X):
+        reason = f"only {embedding.components} dimensions were fitted"
+    elif embedding.n_docs and X.matrix.shape[0] > max_growth * embedding.n_docs:
+        reason = f"fitted on {embedding.n_docs} of {X.matrix.shape[0]} documents"
+    else:
+        print(f"Folding {X.matrix.shape[0]} documents into the saved {method} projection")
+        return embedding.transform(X)
+    print(f"Fitting a {dims} dimension {method} projection: {reason}")
+    embedding = Embedding(method, dims).fit(X)
+    if path:
+        embedding.save(path)
+    return embedding.transform(X)
+
+
+def nearest(distances, k):
+    """ Indices of each row's k nearest other rows """
+    distances = np.array(distances, dtype=float)
+    np.fill_diagonal(distances, np.inf)
+    return np.argsort(distances, axis=1, kind="stable")[:, :k]
+
+
+def neighbor_overlap(full_distances, embedded_distances, k=5):
+    """ Mean fraction of each row's k nearest neighbours under full_distances
+    that are also among its k nearest under embedded_distances """
+    k = min(k, len(full_distances) - 1)
+    full, embedded = nearest(full_distances, k), nearest(embedded_distances, k)
+    return float(np.mean([len(set(a) & set(b)) / k for a, b in zip(full, embedded)]))
+
+
+def overlap_report(X: LabelledMatrix, dims_list, method="svd", k=5, metric="cityblock"):
+    """ For each embedding size, the neighbour overlap with the full-vocabulary
+    distances and the time to embed and compute distances """
+    from distances import blocked_pairwise
+    start = time.perf_counter()
+    full = blocked_pairwise(X.matrix, metric)
+    report = [{"dims": X.matrix.shape[1], "method": "full", "overlap": 1.0,
+               "seconds": time.perf_counter() - start}]
+    for dims in dims_list:
+        start = time.perf_counter()
+        embedded = Embedding(method, dims).fit(X).transform(X)
+        distances = blocked_pairwise(embedded.matrix, metric)
+        report.append({"dims": dims, "method": method,
+                       "overlap": neighbor_overlap(full, distances, k),
+                       "seconds": time.perf_counter() - start})
+    return report
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--method", choices=EMBEDDING_METHODS, default="svd")
+    parser.add_argument("--dims", type=int, nargs="+", default=[50, 100, 200, 300])
+    parser.add_argument("--neighbors", type=int, default=5)
+    parser.add_argument("--metric", default="cityblock")
+    args = parser.parse_args()
+
+    import stages
+    runner = stages.main(["tfidf"])
+    X, idf = runner.result("tfidf")
+    for row in overlap_report(X, args.dims, args.method, args.neighbors, args.metric):
+        print(f"{row['method']} {row['dims']} dims: {row['overlap']:.2f} of "
+              f"{args.neighbors} nearest neighbours kept, {row['seconds']:.2f}s")
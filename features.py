@@ -0,0 +1,238 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Features
+
+Extract the bracketed wiki-link nouns from each article and assemble them into
+a sparse count matrix with programming languages as rows and nouns as columns.
+"""
+
+from __future__ import annotations
+import os
+import re
+import json
+import hashlib
+from array import array
+from datetime import datetime
+from itertools import islice
+from collections import Counter, namedtuple, deque
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+from scipy import sparse
+import metrics
+
+# Pull all the bracketed nouns out of the wikipedia entry using a regex
+BRACKETED_NOUNS = """\\[\\[.*?\\]\\]"""
+noun_matcher = re.compile(BRACKETED_NOUNS)
+# Bump when extract_nouns changes how nouns are normalized. Together with the
+# regex this identifies the extractor, so cached features from another
+# extractor are never reused.
+NORMALIZATION_VERSION = 1
+EXTRACTOR_VERSION = hashlib.sha1(
+    f"{BRACKETED_NOUNS}:{NORMALIZATION_VERSION}".encode("utf-8")).hexdigest()[:12]
+# Worker processes used for extraction by the command line tools, and the
+# number of articles sent to a worker at a time
+EXTRACT_WORKERS = os.cpu_count() or 1
+EXTRACT_BATCH_SIZE = 8
+
+# A sparse matrix with row labels (languages) and column labels (nouns)
+LabelledMatrix = namedtuple("LabelledMatrix", ["matrix", "index", "columns"])
+
+
+def extract_nouns(text):
+    """ Return the normalized bracketed nouns in an article, one per occurrence """
+    return [n.lower().strip() for n in noun_matcher.findall(text)]
+
+
+def count_batch(named_texts):
+    """ Worker task: [(name, text), ...] to [(name, noun counts), ...] """
+    return [(name, Counter(extract_nouns(text))) for name, text in named_texts]
+
+
+def extract_counts(named_texts, workers=1, batch_size=EXTRACT_BATCH_SIZE):
+    """ Generator stage turning (name, text) into (name, noun counts).
+    With workers > 1, batches of articles are counted in a process pool.
+    Results are yielded in input order whatever order the workers finish in,
+    and at most two batches per worker are in flight so memory stays bounded. """
+    if workers <= 1:
+        for name, text in named_texts:
+            yield name, Counter(extract_nouns(text))
+        return
+
+    named_texts = iter(named_texts)
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        pending = deque()
+        while True:
+            while len(pending) < 2 * workers:
+                batch = list(islice(named_texts, batch_size))
+                if not batch:
+                    break
+                pending.append(executor.submit(count_batch, batch))
+            if not pending:
+                return
+            yield from pending.popleft().result()
+
+
+class NounCountAccumulator:
+    """ Incrementally assembles per-document noun counts into a sparse count matrix.
+    The vocabulary assigns column numbers as nouns are first seen and the
+    matrix is built from COO triplets, so no document is visited twice. """
+
+    def __init__(self):
+        self.vocabulary = {}
+        self.index = []
+        self.rows, self.cols, self.data = array("i"), array("i"), array("i")
+
+    def add(self, name, counts):
+        """ Append one document's {noun: count} as the next row """
+        row = len(self.index)
+        self.index.append(name)
+        for noun, count in counts.items():
+            self.rows.append(row)
+            self.cols.append(self.vocabulary.setdefault(noun, len(self.vocabulary)))
+            self.data.append(count)
+
+    def to_matrix(self, sort_rows=False):
+        """ Return the accumulated LabelledMatrix in CSR format.
+        Columns are sorted so the result does not depend on document order,
+        and rows too if sort_rows is True. """
+        matrix = sparse.csr_matrix(
+            (np.frombuffer(self.data, dtype=np.int32),
+             (np.frombuffer(self.rows, dtype=np.int32), np.frombuffer(self.cols, dtype=np.int32))),
+            shape=(len(self.index), len(self.vocabulary)), dtype=np.int32)
+        columns = np.array(list(self.vocabulary), dtype=object)
+        col_order = np.argsort(columns) if len(columns) else np.array([], dtype=int)
+        index = np.array(self.index, dtype=object)
+        row_order = np.argsort(index) if sort_rows and len(index) else np.arange(len(index))
+        return LabelledMatrix(matrix[row_order][:, col_order].tocsr(),
+                              list(index[row_order]), list(columns[col_order]))
+
+
+def build_count_matrix(named_texts, workers=1):
+    """ Build a CSR count matrix from an iterable of (name, text), reading each article once """
+    accumulator = NounCountAccumulator()
+    for name, counts in extract_counts(named_texts, workers):
+        accumulator.add(name, counts)
+    return accumulator.to_matrix()
+
+
+def content_hash(text):
+    """ Hash of an article's text, used as the cache key when its revision id is unknown """
+    return hashlib.sha1(text.encode("utf-8")).hexdigest()
+
+
+class FeatureCache:
+    """ Per-document noun counts saved in a side collection of a StorageWrapper.
+    Entries are keyed on the article's revision id, or on a hash of its text
+    when the revision id is unknown. The collection name carries
+    EXTRACTOR_VERSION, so changing the extraction regex invalidates every entry. """
+    COLLECTION_PREFIX = "noun_counts"
+
+    def __init__(self, store):
+        self.store = store
+        self.collection_name = f"{self.COLLECTION_PREFIX}_{EXTRACTOR_VERSION}"
+        # Drop caches written by other versions of the extractor
+        for collection_name in store.collection_names():
+            if collection_name.startswith(self.COLLECTION_PREFIX) and \
+                    collection_name != self.collection_name:
+                print(f"Dropping stale feature cache {collection_name}")
+                store.delete_collection(collection_name)
+        store.open_or_create(self.collection_name)
+        # Names re-extracted during the last stream_noun_counts call
+        self.changed = []
+
+    def revids(self):
+        """ Return {name: revision id} of the cached entries """
+        return self.store.revids()
+
+    def get_many(self, names):
+        """ Generator of (name, content hash, noun counts) for cached names """
+        for name, payload, date in self.store.find_many(names):
+            entry = json.loads(payload)
+            yield name, entry["hash"], entry["counts"]
+
+    def put_many(self, entries):
+        """ Save (name, revid, content hash, noun counts) entries in one bulk write """
+        todays_date = datetime.today().date()
+        self.store.insert_or_update_many(
+            (name, json.dumps({"hash": text_hash, "counts": counts}), todays_date, revid)
+            for name, revid, text_hash, counts in entries)
+
+    def evict(self, keep_names):
+        """ Remove entries for languages that are not in keep_names, i.e. every
+        stored article, not only those of one run """
+        keep_names = set(keep_names)
+        for name in set(self.store.keys()) - keep_names:
+            self.store.delete(name)
+
+    def clear(self):
+        """ Invalidate every entry """
+        self.store.delete_collection(self.collection_name)
+        self.store.open_or_create(self.collection_name)
+
+
+def stream_noun_counts(wrapper, cache=None, names=None, workers=1):
+    """ Generator of (name, noun counts) for every article in wrapper, or only
+    those in names. With a FeatureCache, articles whose revision id (or, when
+    that is unknown, text hash) matches the cache are not parsed again, and
+    those with a known unchanged revision are not even read. Cache entries for
+    articles no longer in wrapper are evicted, those outside names are kept
+    for later runs. Articles that are parsed are spread over workers processes. """
+    if cache is None:
+        articles = wrapper.iter_all() if names is None else wrapper.find_many(names)
+        yield from extract_counts(((name, text) for name, text, date in articles), workers)
+        return
+
+    stored_revids = article_revids = wrapper.revids()
+    if names is not None:
+        names = set(names)
+        article_revids = {n: r for n, r in stored_revids.items() if n in names}
+    cached_revids = cache.revids()
+    unchanged = {name for name, revid in article_revids.items()
+                 if revid is not None and cached_revids.get(name) == revid}
+    to_read = [name for name in article_revids if name not in unchanged]
+    # Articles without a revision id are matched on their text hash instead
+    cached_hashes = {name: (text_hash, counts) for name, text_hash, counts in
+                     cache.get_many([n for n in to_read if article_revids[n] is None])}
+
+    for name, text_hash, counts in cache.get_many(unchanged):
+        yield name, counts
+
+    cache.changed = []
+    fresh = []
+    text_hashes = {}
+    hash_hits = []
+
+    def to_extract():
+        for name, text, date in wrapper.find_many(to_read):
+            text_hash = content_hash(text)
+            if name in cached_hashes and cached_hashes[name][0] == text_hash:
+                hash_hits.append((name, cached_hashes[name][1]))
+                continue
+            text_hashes[name] = text_hash
+            yield name, text
+
+    for name, counts in extract_counts(to_extract(), workers):
+        fresh.append((name, article_revids[name], text_hashes[name], counts))
+        cache.changed.append(name)
+        yield name, counts
+    yield from hash_hits
+    metrics.count("documents_reused", len(article_revids) - len(fresh))
+    metrics.count("documents_extracted", len(fresh))
+    print(f"Reused noun counts for {len(article_revids) - len(fresh)} articles, "
+          f"extracted {len(fresh)}")
+    cache.put_many(fresh)
+    cache.evict(stored_revids)
+
+
+def from_frame(X: pd.DataFrame):
+    """ Convert a dense labelled DataFrame to a LabelledMatrix """
+    return LabelledMatrix(sparse.csr_matrix(X.to_numpy(dtype=float)),
+                          list(X.index), list(X.columns))
+
+
+def to_frame(X: LabelledMatrix):
+    """ Convert a LabelledMatrix to a dense DataFrame. Only use on small matrices. """
+    import pandas as pd
+    return pd.DataFrame(X.matrix.toarray(), index=X.index, columns=X.columns)
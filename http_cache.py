@@ -0,0 +1,258 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+HTTP cache
+
+On-disk cache of wiki api responses, stored in SQLite with their ETag and
+Last-Modified validators. Responses younger than the TTL are served without
+a request; older ones are revalidated with a conditional request, and a 304
+refreshes the cached copy instead of downloading it again. Revision
+metadata queries, which incremental ingest uses to find edited articles,
+are always revalidated, and a cached article older than the latest revision
+id seen for it is revalidated whatever its age. The least recently used
+responses are evicted when the cache grows past its limits.
+
+In offline mode every request is answered from the cache and nothing is
+sent, so the ingest pipeline can run, and be tested or benchmarked, without
+network access. Requests that are not cached get a 504 response, as for
+HTTP's only-if-cached.
+"""
+
+import os
+import json
+import time
+import sqlite3
+import hashlib
+import threading
+from collections import namedtuple
+import requests
+from requests.structures import CaseInsensitiveDict
+
+HTTP_CACHE_PATH = "./data/http_cache.sqlite3"
+# Seconds a cached response is served without revalidating it
+HTTP_CACHE_TTL = 3600
+# The same for revision id queries, so an edit made within HTTP_CACHE_TTL
+# of the last run is still seen
+REVISION_METADATA_TTL = 0
+# Evict least recently used responses above either limit
+HTTP_CACHE_MAX_BYTES = 512 * 1024 * 1024
+HTTP_CACHE_MAX_ENTRIES = 100000
+# Header marking responses made up by the cache rather than received
+CACHE_STATUS_HEADER = "X-Cache"
+OFFLINE_MISS = "offline-miss"
+
+CachedResponse = namedtuple("CachedResponse", [
+    "url", "status_code", "headers", "body", "etag", "last_modified", "fetched_at"])
+
+
+def request_key(url, params=None):
+    """ Cache key for a GET request, independent of parameter order """
+    params = sorted((str(k), str(v)) for k, v in (params or {}).items())
+    return hashlib.sha1(json.dumps([url, params]).encode("utf-8")).hexdigest()
+
+
+def is_revision_metadata(params):
+    """ True for a query of revision ids or timestamps without the content """
+    params = params or {}
+    return params.get("prop") == "revisions" and "content" not in params.get("rvprop", "")
+
+
+def page_revids(body):
+    """ Return {page title: revision id} from an api response body, or an
+    empty dict if it is not a revisions query result """
+    try:
+        pages = json.loads(body)["query"]["pages"]
+        return {page["title"]: page["revisions"][0].get("revid")
+                for page in pages.values() if page.get("revisions")}
+    except (ValueError, KeyError, TypeError, AttributeError):
+        return {}
+
+
+def to_response(cached, cache_status):
+    """ Build a requests.Response from a cached entry """
+    response = requests.Response()
+    response.status_code = cached.status_code
+    response.url = cached.url
+    response.headers = CaseInsensitiveDict(cached.headers)
+    response.headers[CACHE_STATUS_HEADER] = cache_status
+    response._content = cached.body
+    response.encoding = "utf-8"
+    return response
+
+
+def offline_miss(url):
+    response = requests.Response()
+    response.status_code = 504
+    response.url = url
+    response.reason = "Not cached"
+    response.headers = CaseInsensitiveDict({CACHE_STATUS_HEADER: OFFLINE_MISS})
+    response._content = b""
+    return response
+
+
+class HttpCache:
+    """ SQLite store of responses keyed by request_key. Safe to share between
+    the fetch threads; every statement runs under one lock. """
+
+    def __init__(self, path=HTTP_CACHE_PATH, ttl=HTTP_CACHE_TTL,
+                 max_bytes=HTTP_CACHE_MAX_BYTES, max_entries=HTTP_CACHE_MAX_ENTRIES):
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self.path = path
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.max_entries = max_entries
+        self.lock = threading.Lock()
+        self.counters = {"hits": 0, "revalidated": 0, "misses": 0, "stored": 0, "evicted": 0}
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute(
+            "CREATE TABLE IF NOT EXISTS responses (key TEXT PRIMARY KEY, url TEXT, "
+            "status_code INTEGER, headers TEXT, body BLOB, etag TEXT, last_modified TEXT, "
+            "fetched_at REAL, last_used REAL, size INTEGER)")
+        self.connection.execute(
+            "CREATE INDEX IF NOT EXISTS responses_last_used ON responses (last_used)")
+        self.connection.commit()
+
+    def count(self, counter):
+        with self.lock:
+            self.counters[counter] += 1
+
+    def get(self, key):
+        """ Return the CachedResponse for key, marking it as used, or None """
+        with self.lock:
+            row = self.connection.execute(
+                "SELECT url, status_code, headers, body, etag, last_modified, fetched_at "
+                "FROM responses WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                return None
+            self.connection.execute(
+                "UPDATE responses SET last_used = ? WHERE key = ?", (time.time(), key))
+            self.connection.commit()
+        url, status_code, headers, body, etag, last_modified, fetched_at = row
+        return CachedResponse(url, status_code, json.loads(headers), body,
+                              etag, last_modified, fetched_at)
+
+    def is_fresh(self, cached, ttl=None):
+        return time.time() - cached.fetched_at < (self.ttl if ttl is None else ttl)
+
+    def put(self, key, response):
+        """ Save a response with its validators, then evict down to the limits """
+        headers = {k: v for k, v in response.headers.items() if k != CACHE_STATUS_HEADER}
+        body = response.content
+        now = time.time()
+        with self.lock:
+            self.connection.execute(
+                "INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (key, response.url, response.status_code, json.dumps(headers), body,
+                 response.headers.get("ETag"), response.headers.get("Last-Modified"),
+                 now, now, len(body)))
+            self.counters["stored"] += 1
+            self.evict()
+            self.connection.commit()
+
+    def refresh(self, key):
+        """ Restart the TTL of a response the server confirmed is unchanged """
+        with self.lock:
+            self.connection.execute(
+                "UPDATE responses SET fetched_at = ? WHERE key = ?", (time.time(), key))
+            self.connection.commit()
+
+    def evict(self):
+        """ Delete least recently used responses until both limits hold.
+        Called with the lock held. """
+        entries, size = self.connection.execute(
+            "SELECT COUNT(*), COALESCE(SUM(size), 0) FROM responses").fetchone()
+        if entries <= self.max_entries and size <= self.max_bytes:
+            return
+        for key, entry_size in self.connection.execute(
+                "SELECT key, size FROM responses ORDER BY last_used").fetchall():
+            if entries <= self.max_entries and size <= self.max_bytes:
+                break
+            self.connection.execute("DELETE FROM responses WHERE key = ?", (key,))
+            entries -= 1
+            size -= entry_size
+            self.counters["evicted"] += 1
+
+    def size(self):
+        """ Return (number of responses, total body bytes) """
+        with self.lock:
+            return self.connection.execute(
+                "SELECT COUNT(*), COALESCE(SUM(size), 0) FROM responses").fetchone()
+
+    def clear(self):
+        with self.lock:
+            self.connection.execute("DELETE FROM responses")
+            self.connection.commit()
+
+    def close(self):
+        self.connection.close()
+
+
+class CachedSession:
+    """ Wraps a requests.Session so GETs go through an HttpCache. Only
+    successful responses are cached; throttled and failed ones are passed
+    through so the caller's retry logic still sees them. Revision metadata
+    queries use REVISION_METADATA_TTL instead of the cache's TTL, and the
+    revision ids they return are remembered: a cached article with an older
+    revision is not fresh, so an edit found by the revision check is always
+    downloaded. """
+
+    def __init__(self, session, cache, offline=False):
+        self.session = session
+        self.cache = cache
+        self.offline = offline
+        # {page title: latest revision id} from this session's metadata queries
+        self.latest_revids = {}
+        self.lock = threading.Lock()
+
+    def is_outdated(self, cached):
+        """ True if the cached response has a page older than the latest
+        revision id seen for it """
+        with self.lock:
+            if not self.latest_revids:
+                return False
+            latest = dict(self.latest_revids)
+        return any(title in latest and latest[title] != revid
+                   for title, revid in page_revids(cached.body).items())
+
+    def remember_revids(self, params, body):
+        if is_revision_metadata(params):
+            revids = page_revids(body)
+            with self.lock:
+                self.latest_revids.update(revids)
+
+    @property
+    def headers(self):
+        return self.session.headers
+
+    def get(self, url, params=None, timeout=None):
+        key = request_key(url, params)
+        cached = self.cache.get(key)
+        ttl = REVISION_METADATA_TTL if is_revision_metadata(params) else None
+        if cached is not None and (self.offline or (
+                self.cache.is_fresh(cached, ttl) and not self.is_outdated(cached))):
+            self.cache.count("hits")
+            self.remember_revids(params, cached.body)
+            return to_response(cached, "hit")
+        if self.offline:
+            self.cache.count("misses")
+            return offline_miss(url)
+
+        headers = {}
+        if cached is not None and cached.etag:
+            headers["If-None-Match"] = cached.etag
+        if cached is not None and cached.last_modified:
+            headers["If-Modified-Since"] = cached.last_modified
+        response = self.session.get(url, params=params, timeout=timeout, headers=headers)
+        if response.status_code == 304 and cached is not None:
+            self.cache.count("revalidated")
+            self.cache.refresh(key)
+            self.remember_revids(params, cached.body)
+            return to_response(cached, "revalidated")
+        self.cache.count("misses")
+        if response.status_code == 200 and "MediaWiki-API-Error" not in response.headers:
+            self.cache.put(key, response)
+            self.remember_revids(params, response.content)
+        return response
@@ -10,132 +10,507 @@ If the entry is a certain amount different than the existing copy, update the st
 
 from datetime import datetime
 from difflib import SequenceMatcher
-import pandas as pd
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from urllib.parse import unquote
+import time
+import queue
+import threading
 import requests
-import json
+import requests.adapters
 from collections import namedtuple
 import wrappers.storage_wrapper as stor
+from wrappers.fingerprint import fingerprint, similarity
+import metrics
+from languages import make_name_title_dict
+from http_cache import HttpCache, CachedSession, CACHE_STATUS_HEADER, OFFLINE_MISS
 
+WIKI_API_URL = "https://en.wikipedia.org/w/api.php"
+USER_AGENT = "unsupervised-pl/0.1 (https://github.com/blakeb211/unsupervised-pl)"
+# Concurrency and batching for the fetch engine. The api accepts up to 50
+# titles per query; smaller batches keep large article bodies under the
+# api's response size limit so fewer 'continue' round trips are needed.
+FETCH_WORKERS = 8
+TITLES_PER_QUERY = 20
+REQUEST_TIMEOUT = 30
+MAX_RETRIES = 5
+BACKOFF_SECONDS = 1.0
+RETRY_STATUS_CODES = (429, 500, 502, 503, 504)
+# Revision metadata is tiny, so those queries can use the api's full title limit
+TITLES_PER_METADATA_QUERY = 50
+# Articles at least this similar to the stored copy are not saved again.
+# Records stored without a fingerprint are compared by text, with difflib's
+# quick_ratio, which only compares character counts.
+ARTICLE_SIMILARITY_CUTOFF = 0.99
+# The same for records with one, compared by the Jaccard similarity of their
+# 3-word shingles estimated from MinHash fingerprints, see
+# wrappers/fingerprint.py. A one-word edit changes three shingles, so it is
+# far less similar by this measure. Calibrated on sample edits: a one-word
+# edit to an article of 300 words or more stays above it, as it stayed above
+# the text cutoff, and adding a paragraph of a tenth of its length does not.
+# Rewording 1% of the words, which the text ratio barely notices, falls
+# below it.
+FINGERPRINT_SIMILARITY_CUTOFF = 0.95
+# Pipeline settings for update_cache_if_newer. The queues between stages are
+# bounded, so fetchers block instead of buffering articles when the diff or
+# write stages fall behind.
+DIFF_WORKERS = 2
+QUEUE_SIZE = 32
+WRITE_BATCH_SIZE = 20
+# Longest time a pending write waits for its batch to fill
+WRITE_FLUSH_SECONDS = 1.0
 
-def make_name_title_dict():
-    """ Ingest spreadsheet and create dictionary holding the PL name and it's wikipedia page title """
-    df = pd.read_csv("./data/All_Programming_Languages.csv")
-    names = [t.rsplit('/', 1)[-1].lower() for t in df.ProgrammingLanguage]
-    titles = [t.rsplit('/', 1)[-1] for t in df.Source]
+LangEntry = namedtuple("LangEntry", ["name", "json_text", "revid", "fingerprint"],
+                       defaults=(None, None))
+# A new revision whose text is too similar to the stored copy to save again
+MetadataUpdate = namedtuple("MetadataUpdate", ["name", "revid", "fingerprint"])
 
-    # The source csv has over 600 languages, but we are not interested in all of them.
-    # Pre-filter what goes into the dictionary so that it is more relevant and
-    # wieldy.
-    list_langs_to_keep = ["C++", "Bash", "Java", "C#", "Rust", "Go", "Python",
-                          "Javascript", "R", "Julia", "Php", "Scala", "Ruby",
-                          "F#", "Fortran", "Matlab", "Elixir", "Clojure", "Kotlin"]
 
-    name_to_page_title = {}
-    for name, title in zip(names, titles):
-        if name.strip().title() not in list_langs_to_keep:
-            continue
-        name_to_page_title.update({name: title})
+def make_session(pool_size=FETCH_WORKERS, cache=None, offline=False):
+    """ Create a requests session with a keep-alive connection pool large
+    enough for every fetch worker to hold its own connection.
+    With an http_cache.HttpCache, responses are cached on disk; offline
+    answers every request from that cache without using the network. """
+    session = requests.Session()
+    adapter = requests.adapters.HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    session.headers.update({"User-Agent": USER_AGENT})
+    if cache is not None:
+        return CachedSession(session, cache, offline)
+    return session
+
+
+def retry_delay(result, attempt, backoff=BACKOFF_SECONDS):
+    """ Return the seconds to wait before retrying a throttled request.
+    Honours the Retry-After header when the server sends one, otherwise
+    backs off exponentially. """
+    retry_after = None if result is None else result.headers.get("Retry-After")
+    if retry_after is not None:
+        try:
+            return max(float(retry_after), 0.0)
+        except ValueError:
+            pass
+    return backoff * 2 ** attempt
 
-    assert len(name_to_page_title.keys()) == len(list_langs_to_keep)
-    return name_to_page_title
 
+def is_throttled(result):
+    """ True if the api asked us to slow down """
+    if result.headers.get(CACHE_STATUS_HEADER) == OFFLINE_MISS:
+        # Retrying an offline cache miss cannot help
+        return False
+    if result.status_code in RETRY_STATUS_CODES:
+        return True
+    # The api reports maxlag as a 200 with an error header
+    return result.headers.get("MediaWiki-API-Error") == "maxlag"
 
-def clean_raw_record(text):
-    """ Return useful text from raw wiki result or return an error.
-        On error, return early with False as the second entry of the tuple"""
 
-    # Drill down from total json response to the article text
-    lang_entry_as_json = None
-    try:
-        lang_entry_as_json = json.loads(text)
-    except json.JSONDecodeError as e:
-        print(f"Exception occurred {e.with_traceback()}")
-        return None, False
-    json_obj = lang_entry_as_json
-    # All json objects have the key 'query'
+def get_with_backoff(session, params, max_retries=MAX_RETRIES, backoff=BACKOFF_SECONDS):
+    """ GET the wiki api, retrying throttled responses and connection errors.
+    Returns the last response, or None if every attempt raised. """
+    result = None
+    for attempt in range(max_retries + 1):
+        try:
+            result = session.get(WIKI_API_URL, params=params, timeout=REQUEST_TIMEOUT)
+        except requests.RequestException as e:
+            print(f"Exception occurred {e}, attempt {attempt + 1}")
+            result = None
+        else:
+            metrics.count("http_requests")
+            if not is_throttled(result):
+                metrics.count("http_bytes", len(result.content))
+                return result
+            metrics.count("http_throttled")
+            print(f"Throttled with status {result.status_code}, attempt {attempt + 1}")
+        if attempt < max_retries:
+            time.sleep(retry_delay(result, attempt, backoff))
+    return result
+
+
+def clean_raw_batch(json_obj):
+    """ Return a dict of {page title: latest revision} from a parsed multi-title
+    api response, plus a dict mapping normalized titles back to the titles
+    that were requested. Missing pages (negative page ids) are left out.
+    A revision is the api's dict, e.g. with keys '*', 'revid' and 'timestamp'
+    depending on the rvprop that was requested. """
     assert 'query' in json_obj.keys()
     query_content = json_obj['query']
-    # All 'query' entries have the key 'pages'
-    assert 'pages' in query_content.keys()
-    num_pages = len(query_content['pages'].keys())
-    # All 'pages' entries have a single page
-    assert num_pages == 1
-    key_name_for_page = list(query_content['pages'].keys())[0]
-    meaningful_text_content = query_content['pages'][key_name_for_page]
-    # Skip langs that have a '-1' as their page id, because these
-    # entries do not have any data
-    if key_name_for_page == '-1':
-        return None, False
-    assert 'revisions' in meaningful_text_content.keys()
-
-    text = meaningful_text_content['revisions'][0]['*']
-    return text, True
-
-
-def query_wiki_api_for_latest():
-    """ Generator for entries in the wiki api. """
-    name_to_title = make_name_title_dict()
-    skipped_for_bad_request_result = []
+    requested_title = {n['to']: n['from'] for n in query_content.get('normalized', [])}
+    revisions = {}
+    for page_id, page in query_content.get('pages', {}).items():
+        if int(page_id) < 0 or 'revisions' not in page:
+            continue
+        revisions[page['title']] = page['revisions'][0]
+    return revisions, requested_title
 
-    for name, article_title in name_to_title.items():
-        query = fr"https://en.wikipedia.org/w/api.php?action=query&titles={article_title}&prop=revisions&rvprop=content&format=json"
+
+def fetch_batch(session, titles, rvprop="content|ids"):
+    """ Fetch one batch of titles with a single multi-title query, following
+    'continue' until every page in the batch has been returned.
+    Returns a dict of {requested title: latest revision}. """
+    params = {"action": "query", "titles": "|".join(titles), "prop": "revisions",
+              "rvprop": rvprop, "format": "json"}
+    revisions = {}
+    while True:
+        result = get_with_backoff(session, params)
+        if result is None or not result.ok or len(result.text) < 3:
+            print(f"Unusable result for batch starting with {titles[0]}, skipping")
+            return revisions
         try:
-            result = requests.get(query)
-        except Exception as e:
-            skipped_for_bad_request_result.append(name)
-            print(f"Exception occurred {e.with_traceback()}")
-            continue
+            json_obj = result.json()
+        except ValueError as e:
+            print(f"Exception occurred {e}")
+            return revisions
+        batch_revisions, requested_title = clean_raw_batch(json_obj)
+        for title, revision in batch_revisions.items():
+            revisions[requested_title.get(title, title)] = revision
+        if 'continue' not in json_obj:
+            return revisions
+        params = {**params, **json_obj['continue']}
 
-        text_to_save = clean_raw_record(result.text)
 
-        if not result.ok or len(result.text) < 3:
-            print(f"Unusable result for language {name}, skipping")
-            skipped_for_bad_request_result.append(name)
-            continue
+def batched(items, size):
+    """ Split a list into consecutive chunks of at most size items """
+    return [items[i:i + size] for i in range(0, len(items), size)]
 
-        # Create return value
-        usable_text, ok = clean_raw_record(result.text)
-        if ok == False:
-            continue
 
-        ret_val = namedtuple("LangEntry", ["name", "json_text"])
-        yield ret_val(name=name.strip(), json_text=usable_text)
+def group_titles(name_to_title):
+    """ Map each unquoted page title to every language name that uses it """
+    title_to_names = {}
+    for name, article_title in name_to_title.items():
+        title_to_names.setdefault(unquote(article_title), []).append(name)
+    return title_to_names
+
 
+def fetch_entries(session, titles, title_to_names):
+    """ Fetch the latest revision of one batch of titles and return a LangEntry
+    for every language name using one of those titles """
+    entries = []
+    for title, revision in fetch_batch(session, titles).items():
+        for name in title_to_names.get(title, []):
+            entries.append(LangEntry(name=name.strip(), json_text=revision['*'],
+                                     revid=revision.get('revid')))
+    return entries
 
-def update_cache_if_newer(wrapper):
-    """ Update local shelf file entries if the new entry is less
-    than a threshold similar in content """
-    ARTICLE_SIMILARITY_CUTOFF = 0.99
-    # Store the entries that we update so that we can use it later
-    updated = []
-    todays_date = datetime.today().date()
-    for lang_entry in query_wiki_api_for_latest():
-        if lang_entry.name in wrapper.keys():
-
-            # Load entry from database
-            stored_json, stored_date = wrapper.find(lang_entry.name)
-
-            seq_diff = SequenceMatcher(None, lang_entry.json_text, stored_json)
-            ratio = seq_diff.quick_ratio()
-            if ratio >= ARTICLE_SIMILARITY_CUTOFF:
-                print(f"{lang_entry.name} entry was not newer than saved copy")
+
+def query_wiki_api_for_revisions(name_to_title=None, workers=FETCH_WORKERS,
+                                 titles_per_query=TITLES_PER_METADATA_QUERY, session=None):
+    """ Return a dict of {name: latest revision id} using metadata-only
+    queries, without downloading any article content """
+    if name_to_title is None:
+        name_to_title = make_name_title_dict()
+    if session is None:
+        session = make_session(workers)
+
+    title_to_names = group_titles(name_to_title)
+    latest_revids = {}
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        futures = [pool.submit(fetch_batch, session, batch, "ids|timestamp")
+                   for batch in batched(list(title_to_names), titles_per_query)]
+        for future in as_completed(futures):
+            for title, revision in future.result().items():
+                for name in title_to_names.get(title, []):
+                    latest_revids[name.strip()] = revision.get('revid')
+    return latest_revids
+
+
+def query_wiki_api_for_latest(name_to_title=None, workers=FETCH_WORKERS,
+                              titles_per_query=TITLES_PER_QUERY, session=None):
+    """ Generator for entries in the wiki api.
+    Titles are grouped into multi-title queries which are fetched concurrently
+    over a shared keep-alive session. Entries are yielded as each batch completes. """
+    if name_to_title is None:
+        name_to_title = make_name_title_dict()
+    if session is None:
+        session = make_session(workers)
+
+    # Several names can share a page title, so map each title to all of them
+    title_to_names = group_titles(name_to_title)
+
+    skipped_for_bad_request_result = {name.strip() for name in name_to_title}
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        futures = [pool.submit(fetch_entries, session, batch, title_to_names)
+                   for batch in batched(list(title_to_names), titles_per_query)]
+        for future in as_completed(futures):
+            for lang_entry in future.result():
+                skipped_for_bad_request_result.discard(lang_entry.name)
+                yield lang_entry
+
+    if skipped_for_bad_request_result:
+        print(f"No usable result for {sorted(skipped_for_bad_request_result)}")
+
+
+def changed_since_last_run(wrapper, name_to_title, session=None):
+    """ Return the subset of name_to_title whose latest revision id differs
+    from the one stored with the record, or that has no stored record """
+    stored_revids = wrapper.revids()
+    latest_revids = query_wiki_api_for_revisions(name_to_title, session=session)
+    changed = {}
+    for name, article_title in name_to_title.items():
+        latest = latest_revids.get(name.strip())
+        stored = stored_revids.get(name.strip())
+        if latest is None or stored is None or latest != stored:
+            changed[name] = article_title
+    metrics.count("documents_unchanged_revision", len(name_to_title) - len(changed))
+    print(f"{len(changed)} of {len(name_to_title)} articles changed since the last run")
+    return changed
+
+
+def is_meaningful_change(lang_entry, stored_text=None, stored_fingerprint=None):
+    """ True if the fetched article differs enough from the stored copy to save it.
+    Compares fingerprints when both have one, otherwise the texts. """
+    if stored_fingerprint is not None and lang_entry.fingerprint is not None:
+        ratio = similarity(lang_entry.fingerprint, stored_fingerprint)
+        cutoff = FINGERPRINT_SIMILARITY_CUTOFF
+    else:
+        ratio = SequenceMatcher(None, lang_entry.json_text, stored_text).quick_ratio()
+        cutoff = ARTICLE_SIMILARITY_CUTOFF
+    if ratio >= cutoff:
+        print(f"{lang_entry.name} entry was not newer than saved copy")
+        return False
+    print(f"Meaningful difference of {ratio} found for {lang_entry.name}")
+    return True
+
+
+class StageStats:
+    """ Per-stage counters for the ingest pipeline: items handled, seconds
+    spent working, and seconds blocked on the queues either side """
+
+    def __init__(self, stages):
+        self.lock = threading.Lock()
+        self.counters = {stage: {"items": 0, "busy_seconds": 0.0, "blocked_seconds": 0.0}
+                         for stage in stages}
+
+    def add(self, stage, items=0, busy_seconds=0.0, blocked_seconds=0.0):
+        with self.lock:
+            counter = self.counters[stage]
+            counter["items"] += items
+            counter["busy_seconds"] += busy_seconds
+            counter["blocked_seconds"] += blocked_seconds
+
+    def report(self):
+        """ Print the counters and add them to the run's metrics """
+        for stage, counter in self.counters.items():
+            metrics.add_time(f"ingest.{stage}", counter["busy_seconds"], calls=counter["items"])
+            metrics.add_time(f"ingest.{stage}_blocked", counter["blocked_seconds"], calls=0)
+            print(f"{stage}: {counter['items']} items, {counter['busy_seconds']:.2f}s busy, "
+                  f"{counter['blocked_seconds']:.2f}s blocked")
+
+
+class IngestPipeline:
+    """ Fetch, diff and store articles as three concurrent stages:
+
+        fetch workers -> entries queue -> diff workers -> writes queue -> writer
+
+    Fetchers download multi-title batches, diff workers fingerprint each
+    article and compare it with the stored copy's fingerprint, and a single
+    writer saves accepted articles with insert_or_update_many in batches.
+    Rejected articles with a new revision id only have their revision id
+    saved, so incremental runs do not download them again. Storage access is
+    serialized by a lock because not every backend connection can be shared
+    between threads.
+    A failure in any stage is re-raised by run() after the other stages have
+    shut down and the writer has flushed what it already had. """
+    STAGES = ("fetch", "diff", "write")
+
+    def __init__(self, wrapper, check_similarity=True, session=None,
+                 fetch_workers=FETCH_WORKERS, diff_workers=DIFF_WORKERS,
+                 titles_per_query=TITLES_PER_QUERY, queue_size=QUEUE_SIZE,
+                 write_batch_size=WRITE_BATCH_SIZE, flush_seconds=WRITE_FLUSH_SECONDS):
+        self.wrapper = wrapper
+        self.check_similarity = check_similarity
+        self.session = session if session is not None else make_session(fetch_workers)
+        self.fetch_workers = fetch_workers
+        self.diff_workers = diff_workers
+        self.titles_per_query = titles_per_query
+        self.write_batch_size = write_batch_size
+        self.flush_seconds = flush_seconds
+        self.entries = queue.Queue(maxsize=queue_size)
+        self.writes = queue.Queue(maxsize=queue_size)
+        self.storage_lock = threading.Lock()
+        self.stats = StageStats(self.STAGES)
+        self.errors = []
+        self.updated = []
+        self.fetched_names = set()
+
+    def put(self, stage, target, item):
+        start = time.perf_counter()
+        target.put(item)
+        self.stats.add(stage, blocked_seconds=time.perf_counter() - start)
+
+    def get(self, stage, source, timeout=None):
+        start = time.perf_counter()
+        try:
+            return source.get(timeout=timeout)
+        finally:
+            self.stats.add(stage, blocked_seconds=time.perf_counter() - start)
+
+    def fetch_worker(self, batches, title_to_names):
+        while True:
+            try:
+                batch = batches.get_nowait()
+            except queue.Empty:
+                return
+            start = time.perf_counter()
+            try:
+                lang_entries = fetch_entries(self.session, batch, title_to_names)
+            except Exception as e:
+                self.errors.append(e)
                 continue
-            else:
-                print(
-                    f"Meaningful difference of {ratio} found for {lang_entry.name}")
-                wrapper.insert_or_update(
-                    lang_entry.name, lang_entry.json_text, todays_date)
+            self.stats.add("fetch", items=len(lang_entries),
+                           busy_seconds=time.perf_counter() - start)
+            for lang_entry in lang_entries:
+                self.fetched_names.add(lang_entry.name)
+                self.put("fetch", self.entries, lang_entry)
+
+    def diff_worker(self, stored_fingerprints, stored_revids):
+        while True:
+            lang_entry = self.get("diff", self.entries)
+            if lang_entry is None:
+                return
+            start = time.perf_counter()
+            try:
+                lang_entry = item = lang_entry._replace(
+                    fingerprint=fingerprint(lang_entry.json_text))
+                if lang_entry.name in stored_fingerprints:
+                    stored_fingerprint = stored_fingerprints[lang_entry.name]
+                    if self.check_similarity:
+                        stored_text = None
+                        if stored_fingerprint is None:
+                            # Stored before fingerprints were, so compare the text
+                            metrics.count("documents_read_for_diff")
+                            with self.storage_lock:
+                                stored_text, stored_date = self.wrapper.find(lang_entry.name)
+                        if not is_meaningful_change(lang_entry, stored_text, stored_fingerprint):
+                            metrics.count("documents_unchanged_text")
+                            if (lang_entry.revid == stored_revids.get(lang_entry.name)
+                                    and stored_fingerprint is not None):
+                                continue
+                            # The fingerprint stays the stored text's, so small
+                            # edits cannot add up unnoticed across runs
+                            if stored_fingerprint is None:
+                                stored_fingerprint = fingerprint(stored_text)
+                            item = MetadataUpdate(lang_entry.name, lang_entry.revid,
+                                                  stored_fingerprint)
+                else:
+                    print(f"{lang_entry.name} was not in cache. Adding it now")
+            except Exception as e:
+                # Keep draining so the fetchers are never blocked on a full queue
+                self.errors.append(e)
                 continue
-        else:
-            print(f"{lang_entry.name} was not in cache. Adding it now")
-            # Save new entry to database
-            wrapper.insert_or_update(
-                lang_entry.name, lang_entry.json_text, todays_date)
+            finally:
+                self.stats.add("diff", items=1, busy_seconds=time.perf_counter() - start)
+            self.put("diff", self.writes, item)
+
+    def write_worker(self):
+        todays_date = datetime.today().date()
+        pending = []
+        done = False
+        while not done:
+            try:
+                lang_entry = self.get("write", self.writes, timeout=self.flush_seconds)
+            except queue.Empty:
+                lang_entry = False
+            if lang_entry is None:
+                done = True
+            elif lang_entry:
+                pending.append(lang_entry)
+            if pending and (done or lang_entry is False or len(pending) >= self.write_batch_size):
+                start = time.perf_counter()
+                articles = [e for e in pending if isinstance(e, LangEntry)]
+                revisions = [e for e in pending if isinstance(e, MetadataUpdate)]
+                try:
+                    with self.storage_lock:
+                        if articles:
+                            self.wrapper.insert_or_update_many(
+                                (e.name, e.json_text, todays_date, e.revid, e.fingerprint)
+                                for e in articles)
+                        if revisions:
+                            self.wrapper.update_metadata_many(revisions)
+                    self.updated.extend(e.name for e in articles)
+                except Exception as e:
+                    self.errors.append(e)
+                self.stats.add("write", items=len(pending), busy_seconds=time.perf_counter() - start)
+                pending = []
+
+    def run(self, name_to_title):
+        """ Fetch every article in name_to_title and save the changed ones.
+        Returns the names that were written. """
+        title_to_names = group_titles(name_to_title)
+        batches = queue.Queue()
+        for batch in batched(list(title_to_names), self.titles_per_query):
+            batches.put(batch)
+        # Projection queries, so no stored article text is read to diff
+        stored_fingerprints = self.wrapper.fingerprints()
+        stored_revids = self.wrapper.revids()
+
+        fetchers = [threading.Thread(target=self.fetch_worker, args=(batches, title_to_names))
+                    for _ in range(self.fetch_workers)]
+        differs = [threading.Thread(target=self.diff_worker, args=(stored_fingerprints, stored_revids))
+                   for _ in range(self.diff_workers)]
+        writer = threading.Thread(target=self.write_worker)
+        for thread in fetchers + differs + [writer]:
+            thread.start()
+        # Shut down stage by stage, so every queued article reaches the writer
+        for thread in fetchers:
+            thread.join()
+        for _ in differs:
+            self.entries.put(None)
+        for thread in differs:
+            thread.join()
+        self.writes.put(None)
+        writer.join()
+
+        self.stats.report()
+        skipped = {name.strip() for name in name_to_title} - self.fetched_names
+        if skipped:
+            print(f"No usable result for {sorted(skipped)}")
+        if self.errors:
+            raise self.errors[0]
+        return self.updated
+
+
+def update_cache_if_newer(wrapper, name_to_title=None, incremental=False,
+                          check_similarity=True, session=None):
+    """ Update local shelf file entries if the new entry is less
+    than a threshold similar in content.
+    In incremental mode, only articles whose revision id changed are downloaded.
+    check_similarity keeps the text similarity cutoff as a secondary filter.
+    Downloading, comparing and saving run concurrently, see IngestPipeline. """
+    if name_to_title is None:
+        name_to_title = make_name_title_dict()
+    if session is None:
+        session = make_session()
+    if incremental:
+        with metrics.timer("ingest.revision_check"):
+            name_to_title = changed_since_last_run(wrapper, name_to_title, session)
+    with metrics.timer("ingest.pipeline"):
+        return IngestPipeline(wrapper, check_similarity, session).run(name_to_title)
 
 
 if __name__ == "__main__":
     QUERY_ENDPOINT_FOR_UPDATES = True
-    wrapper = stor.StorageWrapper("prod")
+    # Fetch every language in the spreadsheet instead of the keep-list
+    FETCH_ALL_LANGUAGES = False
+    # Only download articles whose revision id changed since the last run
+    INCREMENTAL = True
+    # Keep api responses in an on-disk cache, see http_cache.py
+    USE_HTTP_CACHE = True
+    # Answer every request from the http cache, without network access
+    OFFLINE = False
+    # Also write the run report in Prometheus text format, and capture
+    # cProfile and tracemalloc statistics in it
+    PROMETHEUS_REPORT = False
+    PROFILE_CPU = False
+    PROFILE_MEMORY = False
+    wrapper = metrics.InstrumentedStorage(stor.StorageWrapper("prod"))
     wrapper.open_or_create("languages")
-    if QUERY_ENDPOINT_FOR_UPDATES:
-        update_cache_if_newer(wrapper)
+    cache = HttpCache() if USE_HTTP_CACHE or OFFLINE else None
+    session = make_session(cache=cache, offline=OFFLINE)
+    with metrics.profiled(PROFILE_CPU, PROFILE_MEMORY), metrics.timer("ingest.total"):
+        if QUERY_ENDPOINT_FOR_UPDATES:
+            update_cache_if_newer(wrapper, make_name_title_dict(keep_all=FETCH_ALL_LANGUAGES),
+                                  incremental=INCREMENTAL, session=session)
+    if cache is not None:
+        for counter, value in cache.counters.items():
+            metrics.count(f"http_cache_{counter}", value)
+    metrics.write_report("ingest", prometheus=PROMETHEUS_REPORT)
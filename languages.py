@@ -0,0 +1,82 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Languages
+
+The programming language name -> wikipedia page title map read from the
+languages spreadsheet. The parsed spreadsheet is kept as a small json index
+next to it, rebuilt only when the csv's contents change, so every run does
+not pay for parsing it. Only the standard library is imported here, so the
+entry points can build their language lists before loading anything heavy.
+"""
+
+import os
+import csv
+import json
+import hashlib
+
+NAME_TITLE_CSV = "./data/All_Programming_Languages.csv"
+NAME_TITLE_INDEX_PATH = "./data/name_title_index.json"
+# The source csv has over 600 languages, but we are not interested in all of them.
+# Pre-filter what goes into the dictionary so that it is more relevant and wieldy.
+LANGUAGES_TO_KEEP = ["C++", "Bash", "Java", "C#", "Rust", "Go", "Python",
+                     "Javascript", "R", "Julia", "Php", "Scala", "Ruby",
+                     "F#", "Fortran", "Matlab", "Elixir", "Clojure", "Kotlin"]
+
+
+def file_hash(path):
+    with open(path, "rb") as f:
+        return hashlib.sha1(f.read()).hexdigest()
+
+
+def read_name_title_csv(csv_path=NAME_TITLE_CSV):
+    """ Return a list of (name, title) for every row of the spreadsheet """
+    with open(csv_path, newline="", encoding="utf-8") as f:
+        return [(row["ProgrammingLanguage"].rsplit('/', 1)[-1].lower(),
+                 row["Source"].rsplit('/', 1)[-1]) for row in csv.DictReader(f)]
+
+
+def load_name_title_index(csv_path=NAME_TITLE_CSV, index_path=NAME_TITLE_INDEX_PATH):
+    """ Return the spreadsheet's list of (name, title), from the index when it
+    was built from the same csv. An unchanged modification time and size is
+    trusted; otherwise the csv's hash decides whether it is parsed again. """
+    stat = os.stat(csv_path)
+    try:
+        with open(index_path) as f:
+            index = json.load(f)
+    except (OSError, ValueError):
+        index = {}
+    if index.get("mtime_ns") == stat.st_mtime_ns and index.get("size") == stat.st_size:
+        return [tuple(pair) for pair in index["languages"]]
+
+    digest = file_hash(csv_path)
+    if index.get("sha1") == digest:
+        languages = [tuple(pair) for pair in index["languages"]]
+    else:
+        print(f"Building the language index from {csv_path}")
+        languages = read_name_title_csv(csv_path)
+    index = {"mtime_ns": stat.st_mtime_ns, "size": stat.st_size, "sha1": digest,
+             "languages": languages}
+    if os.path.dirname(index_path):
+        os.makedirs(os.path.dirname(index_path), exist_ok=True)
+    tmp_path = f"{index_path}.tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(index, f, separators=(",", ":"))
+    os.replace(tmp_path, index_path)
+    return languages
+
+
+def make_name_title_dict(keep_all=False, csv_path=NAME_TITLE_CSV,
+                         index_path=NAME_TITLE_INDEX_PATH):
+    """ Create dictionary holding the PL name and it's wikipedia page title.
+    If keep_all is True, every language in the spreadsheet is kept. """
+    name_to_page_title = {}
+    for name, title in load_name_title_index(csv_path, index_path):
+        if not keep_all and name.strip().title() not in LANGUAGES_TO_KEEP:
+            continue
+        name_to_page_title.update({name: title})
+
+    if not keep_all:
+        assert len(name_to_page_title.keys()) == len(LANGUAGES_TO_KEEP)
+    return name_to_page_title
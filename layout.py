@@ -0,0 +1,248 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Layout
+
+Force-directed graph layout in NumPy. Uses the same Fruchterman-Reingold
+forces as networkx's spring_layout, but stops once the layout converges,
+lays out large graphs multilevel (coarsen, lay out, refine) and can
+warm-start from the positions saved by a previous run.
+"""
+
+import os
+import json
+import numpy as np
+from scipy import sparse
+
+MAX_ITERATIONS = 500
+# Stop when the mean node displacement per iteration drops below this,
+# the same convergence test spring_layout uses
+CONVERGENCE_THRESHOLD = 1e-4
+# Graphs larger than this are coarsened before layout
+COARSEST_SIZE = 50
+REFINE_ITERATIONS = 50
+# Repulsion is computed in row blocks so memory stays O(block * n)
+REPULSION_BLOCK = 512
+# Starting temperature, i.e. the largest step a node may take, for a fresh
+# layout and for refining a warm start or a prolonged coarse layout
+START_TEMPERATURE = 0.1
+REFINE_TEMPERATURE = 0.02
+# Factor the step shrinks by whenever the layout energy rises
+COOLING = 0.9
+# Pull of every node towards the centre of the layout
+GRAVITY = 1.0
+
+
+def repulsion(pos, k, block=REPULSION_BLOCK):
+    """ Sum over every other node of delta * k^2 / distance^2, in row blocks.
+    Returns (forces, stiffness), the stiffness being each node's sum of
+    k^2 / distance^2, how fast its repulsion changes as it moves. """
+    n = len(pos)
+    disp = np.zeros_like(pos)
+    stiffness = np.zeros(n)
+    for start in range(0, n, block):
+        delta = pos[start:start + block, None, :] - pos[None, :, :]
+        distance2 = np.maximum(np.einsum("ijk,ijk->ij", delta, delta), 1e-4)
+        push = k * k / distance2
+        disp[start:start + block] = np.einsum("ijk,ij->ik", delta, push)
+        # Less the node's own term
+        stiffness[start:start + block] = push.sum(axis=1) - k * k / 1e-4
+    return disp, stiffness
+
+
+def fruchterman_reingold(pos, rows, cols, weights, iterations, temperature,
+                         threshold=CONVERGENCE_THRESHOLD):
+    """ Run Fruchterman-Reingold iterations from pos with adaptive cooling:
+    the step grows while the force energy keeps falling and shrinks when it
+    rises (Hu, 2005). A node moves by its force divided by its stiffness, a
+    Newton-like step capped at the temperature, so nodes in balance stay put
+    and a layout already at equilibrium stops at once.
+    Returns (positions, iterations run). """
+    pos = pos.copy()
+    n = len(pos)
+    if n < 2:
+        return pos, 0
+    k = np.sqrt(1.0 / n)
+    t = temperature
+    energy = np.inf
+    progress = 0
+    for iteration in range(iterations):
+        disp, stiffness = repulsion(pos, k)
+        # Attraction along the edges, A * distance / k, as in spring_layout
+        delta = pos[rows] - pos[cols]
+        distance = np.maximum(np.linalg.norm(delta, axis=1), 0.01)
+        pull = delta * (weights * distance / k)[:, None]
+        for axis in range(pos.shape[1]):
+            disp[:, axis] -= np.bincount(rows, weights=pull[:, axis], minlength=n)
+            disp[:, axis] += np.bincount(cols, weights=pull[:, axis], minlength=n)
+        # Plus the attraction's derivative along each edge, 2 * A * distance / k
+        edge_stiffness = 2 * weights * distance / k
+        stiffness += np.bincount(rows, weights=edge_stiffness, minlength=n)
+        stiffness += np.bincount(cols, weights=edge_stiffness, minlength=n)
+        # Gravity keeps disconnected components from drifting apart forever,
+        # so the layout has an equilibrium to converge to
+        disp -= GRAVITY * (pos - pos.mean(axis=0))
+        stiffness += GRAVITY
+        length = np.maximum(np.linalg.norm(disp, axis=1), 1e-12)
+        newton = length / stiffness
+        pos += disp * (np.minimum(newton, t) / length)[:, None]
+        # Judge convergence by the uncapped step, so a layout that only
+        # cooled down without reaching balance keeps going
+        if np.linalg.norm(newton) / n < threshold:
+            return pos, iteration + 1
+        previous_energy, energy = energy, np.sum(length ** 2)
+        if energy < previous_energy:
+            progress += 1
+            if progress >= 5:
+                progress = 0
+                t = min(t / COOLING, temperature)
+        else:
+            progress = 0
+            t *= COOLING
+    return pos, iterations
+
+
+def coarsen(n, rows, cols, weights, rng):
+    """ Heavy-edge matching: pair each node with its unmatched neighbour on the
+    heaviest edge. Returns (parent of each node, coarse node count, coarse edges). """
+    adjacency = sparse.coo_matrix((weights, (rows, cols)), shape=(n, n)).tocsr()
+    adjacency = (adjacency + adjacency.T).tocsr()
+    parent = np.full(n, -1)
+    n_coarse = 0
+    for node in rng.permutation(n):
+        if parent[node] >= 0:
+            continue
+        parent[node] = n_coarse
+        start, end = adjacency.indptr[node], adjacency.indptr[node + 1]
+        neighbours, strengths = adjacency.indices[start:end], adjacency.data[start:end]
+        free = parent[neighbours] < 0
+        if free.any():
+            parent[neighbours[free][np.argmax(strengths[free])]] = n_coarse
+        n_coarse += 1
+    lo = np.minimum(parent[rows], parent[cols])
+    hi = np.maximum(parent[rows], parent[cols])
+    coarse = sparse.coo_matrix((weights, (lo, hi)), shape=(n_coarse, n_coarse)).tocsr().tocoo()
+    keep = coarse.row != coarse.col
+    return parent, n_coarse, (coarse.row[keep], coarse.col[keep], coarse.data[keep])
+
+
+def equilibrium_scale(pos, rows, cols, weights):
+    """ Factor to scale pos (about its mean) by so its forces balance overall.
+    At equilibrium sum(pos . force) is zero; under a uniform scale s the
+    repulsion's share of it is fixed, attraction's grows as s^3 and
+    gravity's as s^2, so s is the positive root of a cubic. A layout that
+    converged and was then rescaled is returned to the solver's scale. """
+    n = len(pos)
+    k = np.sqrt(1.0 / n)
+    centered = pos - pos.mean(axis=0)
+    distance = np.linalg.norm(centered[rows] - centered[cols], axis=1)
+    repulsive = k * k * n * (n - 1) / 2
+    attractive = np.sum(weights * distance ** 3) / k
+    central = GRAVITY * np.sum(centered ** 2)
+    roots = np.roots([attractive, central, 0.0, -repulsive])
+    real = roots[(np.abs(roots.imag) < 1e-9) & (roots.real > 0)].real
+    return float(real.max()) if len(real) else 1.0
+
+
+def rescale(pos):
+    """ Center on the origin and scale into [-1, 1], like networkx's rescale_layout """
+    pos = pos - pos.mean(axis=0)
+    lim = np.abs(pos).max()
+    return pos / lim if lim > 0 else pos
+
+
+def force_layout(n, rows, cols, weights, initial_pos=None, seed=42,
+                 max_iterations=MAX_ITERATIONS, multilevel=True):
+    """ Lay out a graph of n nodes with edges (rows, cols, weights).
+    initial_pos is an optional (n, 2) array in [-1, 1] with NaN rows for nodes
+    that have no previous position; it warm-starts the layout.
+    Returns (positions as an (n, 2) array in [-1, 1], total iterations run).
+    The result only depends on the inputs and the seed. """
+    rng = np.random.default_rng(seed)
+    rows, cols = np.asarray(rows, dtype=int), np.asarray(cols, dtype=int)
+    weights = np.asarray(weights, dtype=float)
+
+    if initial_pos is not None:
+        pos = warm_start_positions(initial_pos, rows, cols, weights, rng)
+        pos, iterations = fruchterman_reingold(
+            pos, rows, cols, weights, max_iterations, REFINE_TEMPERATURE)
+        return rescale(pos), iterations
+
+    if not multilevel or n <= COARSEST_SIZE:
+        pos, iterations = fruchterman_reingold(
+            rng.random((n, 2)), rows, cols, weights, max_iterations, START_TEMPERATURE)
+        return rescale(pos), iterations
+
+    parent, n_coarse, coarse_edges = coarsen(n, rows, cols, weights, rng)
+    if n_coarse > 0.9 * n:
+        # Too few edges to coarsen further
+        return force_layout(n, rows, cols, weights, seed=seed,
+                            max_iterations=max_iterations, multilevel=False)
+    coarse_pos, iterations = force_layout(n_coarse, *coarse_edges, seed=seed,
+                                          max_iterations=max_iterations)
+    # Prolong: each node starts at its coarse parent, jittered apart from its
+    # sibling, at the scale the finer graph balances at
+    pos = coarse_pos[parent] + rng.normal(scale=0.01, size=(n, 2))
+    pos = pos * equilibrium_scale(pos, rows, cols, weights)
+    pos, refine_iterations = fruchterman_reingold(
+        pos, rows, cols, weights, REFINE_ITERATIONS, REFINE_TEMPERATURE)
+    return rescale(pos), iterations + refine_iterations
+
+
+def warm_start_positions(initial_pos, rows, cols, weights, rng):
+    """ Place nodes without a previous position at the mean of their placed
+    neighbours, or at random, then scale the positions from [-1, 1] back to
+    the scale the layout's forces balance at, see equilibrium_scale """
+    pos = np.array(initial_pos, dtype=float)
+    missing = np.isnan(pos).any(axis=1)
+    for node in np.flatnonzero(missing):
+        neighbours = np.concatenate([cols[rows == node], rows[cols == node]])
+        neighbours = neighbours[~missing[neighbours]]
+        if len(neighbours):
+            pos[node] = pos[neighbours].mean(axis=0) + rng.normal(scale=0.01, size=2)
+        else:
+            pos[node] = rng.uniform(-1, 1, size=2)
+    return pos * equilibrium_scale(pos, rows, cols, weights)
+
+
+def stress(pos, n, rows, cols):
+    """ Normalized stress of a layout against hop distances in the graph,
+    after the best uniform scaling. Lower is better; pairs in different
+    components are ignored. """
+    from scipy.sparse.csgraph import shortest_path
+    adjacency = sparse.coo_matrix((np.ones(len(rows)), (rows, cols)), shape=(n, n))
+    hops = shortest_path(adjacency, directed=False, unweighted=True)
+    i, j = np.triu_indices(n, k=1)
+    target = hops[i, j]
+    connected = np.isfinite(target)
+    if not connected.any():
+        return 0.0
+    target = target[connected]
+    drawn = np.linalg.norm(pos[i[connected]] - pos[j[connected]], axis=1)
+    # Best scale s minimizing sum((s * drawn - target)^2 / target^2)
+    scale = np.sum(drawn / target) / max(np.sum(drawn ** 2 / target ** 2), 1e-12)
+    return float(np.mean((scale * drawn - target) ** 2 / target ** 2))
+
+
+def save_positions(labels, pos, path):
+    """ Persist node positions by label so the next run can warm-start """
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w") as f:
+        json.dump({label: [float(x), float(y)] for label, (x, y) in zip(labels, pos)}, f)
+    os.replace(tmp_path, path)
+
+
+def load_positions(labels, path):
+    """ Return an (n, 2) array of saved positions for labels, NaN where a label
+    has none, or None if nothing was saved """
+    try:
+        with open(path) as f:
+            saved = json.load(f)
+    except (OSError, ValueError):
+        return None
+    pos = np.array([saved.get(label, [np.nan, np.nan]) for label in labels], dtype=float)
+    if np.isnan(pos).all():
+        return None
+    return pos
@@ -0,0 +1,181 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Metrics
+
+Run instrumentation shared by ingest.py and the eda stages: timers for each
+pipeline stage and storage call, counters (http bytes, skipped documents,
+cache hits, database round trips), and optional cProfile and tracemalloc
+capture. A run ends with a JSON report and, optionally, the same numbers in
+Prometheus text format for a node exporter's textfile collector.
+
+    with metrics.timer("stage.distances"):
+        ...
+    metrics.count("http_bytes", len(result.content))
+    metrics.write_report("ingest", prometheus=True)
+"""
+
+import io
+import os
+import json
+import time
+import pstats
+import cProfile
+import threading
+import tracemalloc
+import contextlib
+
+# Reports are written here as <run name>.json and <run name>.prom
+REPORT_DIR = "./data/reports"
+PROMETHEUS_PREFIX = "unsupervised_pl"
+# Functions and allocation sites listed in the report when profiling
+PROFILE_TOP = 25
+
+
+class Metrics:
+    """ Thread-safe timers and counters for one run """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.started = time.time()
+        self.timers = {}
+        self.counters = {}
+        self.profile = {}
+
+    def add_time(self, name, seconds, calls=1):
+        with self.lock:
+            timer = self.timers.setdefault(name, {"calls": 0, "seconds": 0.0})
+            timer["calls"] += calls
+            timer["seconds"] += seconds
+
+    @contextlib.contextmanager
+    def timer(self, name):
+        """ Time the enclosed block under name, including when it raises """
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add_time(name, time.perf_counter() - start)
+
+    def count(self, name, value=1):
+        with self.lock:
+            self.counters[name] = self.counters.get(name, 0) + value
+
+    def report(self):
+        with self.lock:
+            return {"started": time.strftime("%Y-%m-%dT%H:%M:%S", time.localtime(self.started)),
+                    "wall_seconds": time.time() - self.started,
+                    "timers": {k: dict(v) for k, v in sorted(self.timers.items())},
+                    "counters": dict(sorted(self.counters.items())),
+                    "profile": dict(self.profile)}
+
+    def prometheus_text(self, prefix=PROMETHEUS_PREFIX):
+        """ The timers and counters in Prometheus text exposition format """
+        report = self.report()
+        lines = [f"# TYPE {prefix}_wall_seconds gauge",
+                 f"{prefix}_wall_seconds {report['wall_seconds']:.6f}",
+                 f"# TYPE {prefix}_timer_seconds_total counter",
+                 f"# TYPE {prefix}_timer_calls_total counter"]
+        for name, timer in report["timers"].items():
+            lines.append(f'{prefix}_timer_seconds_total{{name="{name}"}} {timer["seconds"]:.6f}')
+            lines.append(f'{prefix}_timer_calls_total{{name="{name}"}} {timer["calls"]}')
+        lines.append(f"# TYPE {prefix}_events_total counter")
+        for name, value in report["counters"].items():
+            lines.append(f'{prefix}_events_total{{name="{name}"}} {value}')
+        return "\n".join(lines) + "\n"
+
+    def reset(self):
+        with self.lock:
+            self.started = time.time()
+            self.timers, self.counters, self.profile = {}, {}, {}
+
+
+# The registry the pipeline modules report to
+METRICS = Metrics()
+timer = METRICS.timer
+count = METRICS.count
+add_time = METRICS.add_time
+
+
+def write_text(path, text):
+    if os.path.dirname(path):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w") as f:
+        f.write(text)
+    os.replace(tmp_path, path)
+
+
+def write_report(name, prometheus=False, report_dir=REPORT_DIR, metrics=METRICS):
+    """ Write the run report as JSON, and in Prometheus text format too if
+    prometheus is True. Returns the JSON report's path. """
+    path = os.path.join(report_dir, f"{name}.json")
+    write_text(path, json.dumps(metrics.report(), indent=2))
+    if prometheus:
+        write_text(os.path.join(report_dir, f"{name}.prom"), metrics.prometheus_text())
+    print(f"Run report written to {path}")
+    return path
+
+
+@contextlib.contextmanager
+def profiled(cpu=False, memory=False, profile_path=None, metrics=METRICS):
+    """ Optionally run the enclosed block under cProfile and tracemalloc.
+    The top functions by cumulative time and the top allocation sites go in
+    the run report; profile_path also keeps the raw cProfile stats. """
+    profiler = cProfile.Profile() if cpu else None
+    if memory:
+        tracemalloc.start()
+    if profiler is not None:
+        profiler.enable()
+    try:
+        yield
+    finally:
+        if profiler is not None:
+            profiler.disable()
+            if profile_path:
+                profiler.dump_stats(profile_path)
+            out = io.StringIO()
+            pstats.Stats(profiler, stream=out).sort_stats("cumulative").print_stats(PROFILE_TOP)
+            metrics.profile["cpu"] = out.getvalue()
+        if memory:
+            current, peak = tracemalloc.get_traced_memory()
+            top = tracemalloc.take_snapshot().statistics("lineno")[:PROFILE_TOP]
+            tracemalloc.stop()
+            metrics.profile["memory"] = {"current_bytes": current, "peak_bytes": peak,
+                                         "top": [str(stat) for stat in top]}
+
+
+class InstrumentedStorage:
+    """ Proxy for a StorageWrapper that times every call as storage.<method>
+    and counts it as a database round trip. Generators returned by the
+    wrapper, e.g. from find_many, are timed while they are consumed. """
+
+    def __init__(self, wrapper, metrics=METRICS):
+        self._wrapper = wrapper
+        self._metrics = metrics
+
+    def __getattr__(self, name):
+        attr = getattr(self._wrapper, name)
+        if not callable(attr):
+            return attr
+
+        def call(*args, **kwargs):
+            self._metrics.count("db_round_trips")
+            with self._metrics.timer(f"storage.{name}"):
+                result = attr(*args, **kwargs)
+            if hasattr(result, "__next__"):
+                return self._timed_iter(name, result)
+            return result
+        return call
+
+    def _timed_iter(self, name, iterator):
+        while True:
+            start = time.perf_counter()
+            try:
+                item = next(iterator)
+            except StopIteration:
+                self._metrics.add_time(f"storage.{name}", time.perf_counter() - start, calls=0)
+                return
+            self._metrics.add_time(f"storage.{name}", time.perf_counter() - start, calls=0)
+            yield item
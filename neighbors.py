@@ -0,0 +1,143 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Neighbors
+
+Nearest-neighbour index over the TF-IDF matrix, or its embedding. Builds k-NN
+and radius graphs as sparse edge lists, used by the neighbors stage in
+stages.py, and answers "what is similar to Rust" queries without
+materializing the full distance matrix.
+"""
+
+from collections import defaultdict
+import numpy as np
+from scipy import sparse
+from sklearn.neighbors import NearestNeighbors
+from features import LabelledMatrix
+from distances import pairwise
+
+# Random-projection LSH settings. More tables find more true neighbours,
+# more bits make buckets smaller and candidate lists shorter.
+LSH_TABLES = 8
+LSH_BITS = 8
+# Buckets larger than this are mostly noise and would make candidate
+# generation quadratic again, so they are skipped
+MAX_BUCKET_SIZE = 200
+
+
+class NeighborIndex:
+    """ Neighbour queries over the rows of a LabelledMatrix.
+    method='exact' uses brute force on the sparse matrix, chunked by sklearn so
+    memory stays bounded. method='lsh' hashes rows with random hyperplanes and
+    only computes exact distances for rows sharing a bucket in some table. """
+
+    def __init__(self, X: LabelledMatrix, metric='cityblock', method='exact',
+                 n_tables=LSH_TABLES, n_bits=LSH_BITS, seed=42):
+        if method not in ("exact", "lsh"):
+            raise ValueError(f"Unknown neighbour method {method}")
+        self.X = X
+        # sklearn's sparse cityblock distances are wrong for rows whose column
+        # indices are not sorted. Dense input, e.g. an embedding, is used as is.
+        self.matrix = X.matrix.tocsr().sorted_indices() if sparse.issparse(X.matrix) \
+            else np.asarray(X.matrix)
+        self.metric = metric
+        self.method = method
+        self.position = {name.lower(): pos for pos, name in enumerate(X.index)}
+        if method == "exact":
+            self.model = NearestNeighbors(metric=metric, algorithm="brute").fit(self.matrix)
+        else:
+            self.signatures, self.buckets = self.hash_rows(n_tables, n_bits, seed)
+
+    def hash_rows(self, n_tables, n_bits, seed):
+        """ Return the per-table row signatures and one {signature: [row, ...]}
+        dict per table """
+        rng = np.random.default_rng(seed)
+        planes = rng.standard_normal(
+            (self.matrix.shape[1], n_tables * n_bits)).astype(np.float32)
+        bits = np.asarray(self.matrix @ planes) > 0
+        powers = 1 << np.arange(n_bits)
+        signatures = [bits[:, t * n_bits:(t + 1) * n_bits] @ powers for t in range(n_tables)]
+        buckets = []
+        for table_signatures in signatures:
+            table_buckets = defaultdict(list)
+            for row, signature in enumerate(table_signatures):
+                table_buckets[int(signature)].append(row)
+            buckets.append(table_buckets)
+        return signatures, buckets
+
+    def candidates(self, row):
+        """ Rows sharing an LSH bucket with row in any table """
+        found = set()
+        for table_buckets, signatures in zip(self.buckets, self.signatures):
+            bucket = table_buckets.get(int(signatures[row]), [])
+            if len(bucket) <= MAX_BUCKET_SIZE:
+                found.update(bucket)
+        found.discard(row)
+        return np.array(sorted(found), dtype=int)
+
+    def row_of(self, lang):
+        try:
+            return self.position[lang.lower()]
+        except KeyError:
+            raise KeyError(f"{lang} is not in the neighbour index")
+
+    def neighbors(self, lang, k=5):
+        """ Return the k closest languages to lang as a list of (name, distance) """
+        row = self.row_of(lang)
+        k = min(k, self.matrix.shape[0] - 1)
+        if k <= 0:
+            return []
+        if self.method == "exact":
+            dist, idx = self.model.kneighbors(self.matrix[row:row + 1], n_neighbors=k + 1)
+            pairs = [(i, d) for i, d in zip(idx[0], dist[0]) if i != row][:k]
+        else:
+            cand = self.candidates(row)
+            if len(cand) < k:
+                # Too few bucket mates; one row against all is still cheap
+                cand = np.array([i for i in range(self.matrix.shape[0]) if i != row])
+            dist = pairwise(self.matrix[row:row + 1], self.matrix[cand], self.metric)[0]
+            order = np.argsort(dist, kind="stable")[:k]
+            pairs = [(cand[i], dist[i]) for i in order]
+        return [(self.X.index[i], float(d)) for i, d in pairs]
+
+    def knn_edges(self, k=5):
+        """ Sparse upper-triangular COO matrix of edges from each row to its k
+        nearest neighbours, weighted by distance """
+        rows, cols, weights = [], [], []
+        for row, name in enumerate(self.X.index):
+            for other, d in self.neighbors(name, k):
+                rows.append(row)
+                cols.append(self.position[other.lower()])
+                weights.append(d)
+        return self.to_upper_coo(rows, cols, weights)
+
+    def radius_edges(self, radius):
+        """ Sparse upper-triangular COO matrix of every edge no longer than radius """
+        if self.method == "exact":
+            graph = self.model.radius_neighbors_graph(radius=radius, mode="distance").tocoo()
+            return self.to_upper_coo(graph.row, graph.col, graph.data)
+        rows, cols, weights = [], [], []
+        for row in range(self.matrix.shape[0]):
+            cand = self.candidates(row)
+            cand = cand[cand > row]
+            if len(cand) == 0:
+                continue
+            dist = pairwise(self.matrix[row:row + 1], self.matrix[cand], self.metric)[0]
+            keep = dist <= radius
+            rows.extend([row] * int(keep.sum()))
+            cols.extend(cand[keep])
+            weights.extend(dist[keep])
+        return self.to_upper_coo(rows, cols, weights)
+
+    def to_upper_coo(self, rows, cols, weights):
+        """ Deduplicate (i, j)/(j, i) pairs into an upper-triangular COO matrix.
+        Zero distances are kept as explicit entries. """
+        rows, cols = np.asarray(rows, dtype=int), np.asarray(cols, dtype=int)
+        weights = np.asarray(weights, dtype=float)
+        lo, hi = np.minimum(rows, cols), np.maximum(rows, cols)
+        keep = lo != hi
+        lo, hi, weights = lo[keep], hi[keep], weights[keep]
+        n = self.matrix.shape[0]
+        _, first = np.unique(lo * n + hi, return_index=True)
+        return sparse.coo_matrix((weights[first], (lo[first], hi[first])), shape=(n, n))
@@ -0,0 +1,121 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Render
+
+Draws the pipeline's figures headless and in bounded time. The heatmap rows
+and columns are put in hierarchical-clustering leaf order, so related
+languages sit in blocks, and matrices larger than HEATMAP_MAX_SIZE are
+block-averaged down to it before being drawn as a single imshow raster.
+The heatmap and graph figures are rendered concurrently in separate
+processes.
+"""
+
+import math
+from concurrent.futures import ProcessPoolExecutor
+import matplotlib
+# Figures are only ever saved to files, often from cron without a display
+matplotlib.use("Agg")
+import matplotlib.pyplot as plt
+import numpy as np
+from scipy.cluster.hierarchy import linkage, leaves_list
+from scipy.spatial.distance import squareform
+
+LINKAGE_METHOD = "average"
+# Largest heatmap drawn cell for cell; bigger matrices are block-averaged down
+HEATMAP_MAX_SIZE = 1000
+# Language names are drawn on the heatmap axes only up to this many rows
+HEATMAP_MAX_LABELS = 60
+# seaborn's default sequential palette, as sns.heatmap drew before
+HEATMAP_CMAP = "rocket"
+HEATMAP_DPI = 100
+
+
+def leaf_order(distances, method=LINKAGE_METHOD):
+    """ Row order of the square distance matrix that puts the leaves of its
+    hierarchical clustering side by side """
+    n = len(distances)
+    if n < 3:
+        return np.arange(n)
+    condensed = squareform(np.asarray(distances, dtype=np.float64), checks=False)
+    return leaves_list(linkage(condensed, method=method))
+
+
+def downsample(distances, order, max_size=HEATMAP_MAX_SIZE):
+    """ The distance matrix in the given row and column order, as a float32
+    image of at most max_size x max_size pixels, each pixel the mean of a
+    block of cells. Only one band of rows is reordered in memory at a time,
+    so a memory-mapped matrix is never read in full into memory. """
+    n = len(order)
+    factor = max(1, math.ceil(n / max_size))
+    starts = np.arange(0, n, factor)
+    sizes = np.diff(np.append(starts, n))
+    image = np.empty((len(starts), len(starts)), dtype=np.float32)
+    for i, start in enumerate(starts):
+        band = np.asarray(distances[order[start:start + factor]])[:, order]
+        sums = np.add.reduceat(band.sum(axis=0), starts)
+        image[i] = sums / (sizes[i] * sizes)
+    return image
+
+
+def render_heatmap(image, labels, path, factor=1):
+    """ Draw the heatmap image with one imshow raster and save it """
+    import seaborn as sns
+    n = len(image)
+    fig, ax = plt.subplots(figsize=(11, 9))
+    im = ax.imshow(image, cmap=sns.color_palette(HEATMAP_CMAP, as_cmap=True),
+                   interpolation="nearest")
+    fig.colorbar(im, ax=ax)
+    if factor == 1 and n <= HEATMAP_MAX_LABELS:
+        ax.set_xticks(range(n))
+        ax.set_xticklabels(labels, rotation=90, fontsize=8)
+        ax.set_yticks(range(n))
+        ax.set_yticklabels(labels, fontsize=8)
+    else:
+        ax.set_xticks([])
+        ax.set_yticks([])
+        scale = f", {factor}x{factor} blocks per pixel" if factor > 1 else ""
+        ax.set_title(f"{len(labels)} languages in clustering order{scale}")
+    fig.tight_layout()
+    fig.savefig(path, dpi=HEATMAP_DPI)
+    plt.close(fig)
+    return path
+
+
+def render_graph(labels, rows, cols, distances, pos, font_size, path):
+    import eda
+    eda.draw_graph(labels, rows, cols, distances, pos, font_size, path)
+    return path
+
+
+def plot_heatmap(distances, labels, path, order=None, max_size=HEATMAP_MAX_SIZE):
+    """ Save a clustered, downsampled heatmap of the square distance matrix """
+    if order is None:
+        order = leaf_order(distances)
+    factor = max(1, math.ceil(len(order) / max_size))
+    image = downsample(distances, order, max_size)
+    return render_heatmap(image, [labels[i] for i in order], path, factor)
+
+
+def render_figures(dist_mat, order, layout, font_size, heatmap_path, graph_path,
+                   max_size=HEATMAP_MAX_SIZE, processes=2):
+    """ Render the heatmap and the graph, in separate processes when
+    processes > 1. dist_mat is the labelled distance matrix, order its leaf
+    order and layout the (rows, cols, distances, pos) edges and positions.
+    Only the downsampled image is sent to the heatmap process. """
+    labels = list(dist_mat.index)
+    factor = max(1, math.ceil(len(order) / max_size))
+    image = downsample(dist_mat.to_numpy(), order, max_size)
+    ordered_labels = [labels[i] for i in order]
+    rows, cols, distances, pos = layout
+    pos = dict(enumerate(np.asarray(pos)))
+    if processes <= 1:
+        render_heatmap(image, ordered_labels, heatmap_path, factor)
+        render_graph(labels, rows, cols, distances, pos, font_size, graph_path)
+        return heatmap_path, graph_path
+    with ProcessPoolExecutor(max_workers=2) as executor:
+        heatmap = executor.submit(render_heatmap, image, ordered_labels, heatmap_path, factor)
+        graph = executor.submit(render_graph, labels, rows, cols, distances, pos,
+                                font_size, graph_path)
+        return heatmap.result(), graph.result()
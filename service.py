@@ -0,0 +1,243 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Service
+
+Long-running HTTP/JSON similarity server. Loads the TF-IDF matrix, distance
+matrix and graph layout once, bringing the stage artifacts up to date from
+storage as stages.py would, and answers queries from memory, neighbours from
+a NeighborIndex over the matrix the distances were computed from:
+
+    GET /neighbors?lang=kotlin&k=5   closest languages and their distances
+    GET /distance?a=rust&b=go        distance between two languages
+    GET /terms?lang=rust&k=10        highest weighted TF-IDF terms
+    GET /graph                       node positions and edges, for a webpage
+    GET /status                      languages loaded and when
+
+The stored corpus is polled every --poll-seconds. When ingest.py has written
+new documents a new model is built in the background and swapped in whole,
+so every query sees either the old model or the new one. Building it takes
+the same lock as stages.py, so a reload and a cron run of stages.py never
+write the shared artifacts and distance state at the same time.
+
+Usage: python service.py [--host 127.0.0.1] [--port 8765] [stages.py options]
+"""
+
+import sys
+import json
+import time
+import argparse
+import threading
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlparse, parse_qs
+import numpy as np
+import metrics
+import stages
+
+SERVICE_HOST = "127.0.0.1"
+SERVICE_PORT = 8765
+# Seconds between checks of the stored corpus for new documents
+POLL_SECONDS = 60
+DEFAULT_NEIGHBORS = 5
+DEFAULT_TERMS = 10
+# The query parameters each endpoint requires
+ENDPOINTS = {"/neighbors": ("lang",), "/distance": ("a", "b"), "/terms": ("lang",),
+             "/graph": (), "/status": ()}
+
+
+class SimilarityModel:
+    """ The pipeline's outputs for one version of the corpus, held in memory """
+
+    def __init__(self, tfidf, dist_mat, layout, index, corpus_key=None):
+        self.labels = list(dist_mat.index)
+        self.names = list(tfidf.index)
+        # Languages are looked up by stored name or drawn label, in any case
+        self.position = {name.lower(): pos for pos, name in enumerate(tfidf.index)}
+        self.position.update({name.lower(): pos for pos, name in enumerate(self.labels)})
+        # Copied out of the memory map, so queries never wait on the disk
+        self.distances = np.array(dist_mat.to_numpy())
+        self.tfidf = tfidf.matrix.tocsr()
+        self.terms = list(tfidf.columns)
+        self.rows, self.cols, self.edge_distances, self.pos = layout
+        self.index = index
+        self.corpus_key = corpus_key
+        self.loaded = time.time()
+
+    @classmethod
+    def from_runner(cls, runner, corpus_key=None):
+        """ Build the model from a StageRunner's tfidf, distances and layout,
+        with a neighbour index over its embedding stage """
+        tfidf, idf = runner.result("tfidf")
+        X, idf = runner.result("embedding")
+        return cls(tfidf, runner.result("distances"), runner.result("layout"),
+                   runner.neighbor_index(X), corpus_key)
+
+    def row_of(self, lang):
+        try:
+            return self.position[lang.lower()]
+        except KeyError:
+            raise KeyError(f"{lang} is not a known language")
+
+    def neighbors(self, lang, k=DEFAULT_NEIGHBORS):
+        """ The k closest languages to lang as a list of (name, distance) """
+        found = self.index.neighbors(self.names[self.row_of(lang)], k)
+        return [(self.labels[self.row_of(name)], d) for name, d in found]
+
+    def distance(self, a, b):
+        return float(self.distances[self.row_of(a), self.row_of(b)])
+
+    def top_terms(self, lang, k=DEFAULT_TERMS):
+        """ The k highest weighted TF-IDF terms of lang as a list of (term, weight) """
+        row = self.tfidf[self.row_of(lang)]
+        order = np.argsort(-row.data, kind="stable")[:k]
+        return [(self.terms[row.indices[i]], float(row.data[i])) for i in order]
+
+    def graph(self):
+        nodes = [{"name": name, "x": float(x), "y": float(y)}
+                 for name, (x, y) in zip(self.labels, np.asarray(self.pos))]
+        edges = [{"source": self.labels[i], "target": self.labels[j], "distance": float(d)}
+                 for i, j, d in zip(self.rows.tolist(), self.cols.tolist(),
+                                    self.edge_distances.tolist())]
+        return {"nodes": nodes, "edges": edges}
+
+    def status(self):
+        return {"languages": len(self.labels), "corpus": self.corpus_key,
+                "loaded": time.strftime("%Y-%m-%dT%H:%M:%S", time.localtime(self.loaded))}
+
+
+class SimilarityService:
+    """ Keeps the current SimilarityModel and replaces it when the stored
+    corpus changes. Queries read self.model once, so a reload never mixes
+    two versions of the corpus in one answer. """
+
+    def __init__(self, params, wrapper=None, artifact_dir=stages.ARTIFACT_DIR,
+                 lock_path=stages.STAGE_LOCK_PATH):
+        self.params = params
+        self.artifact_dir = artifact_dir
+        self.lock_path = lock_path
+        self.wrapper = wrapper
+        self.reload_lock = threading.Lock()
+        self.model = None
+        self.stopped = threading.Event()
+
+    def corpus_key(self):
+        """ Changes whenever ingest stores a new revision of a language """
+        return stages.corpus_fingerprint(self.wrapper, self.params["names"])
+
+    def reload(self):
+        """ Build a model from up to date artifacts and swap it in """
+        with self.reload_lock, stages.stage_lock(self.lock_path):
+            runner = stages.StageRunner(self.params, wrapper=self.wrapper,
+                                        artifact_dir=self.artifact_dir)
+            # The runner opens the default storage if it was not given one
+            self.wrapper = runner.open_storage()
+            # Read before building, so documents written meanwhile cause another reload
+            corpus_key = self.corpus_key()
+            with metrics.timer("service.reload"):
+                model = SimilarityModel.from_runner(runner, corpus_key)
+            self.model = model
+            print(f"Loaded {len(model.labels)} languages, stages run: {runner.ran or 'none'}")
+            return model
+
+    def check_for_updates(self):
+        """ Reload if the stored corpus changed since the model was built.
+        Returns True if it did. """
+        if self.model is not None and self.corpus_key() == self.model.corpus_key:
+            return False
+        self.reload()
+        return True
+
+    def poll(self, seconds=POLL_SECONDS):
+        while not self.stopped.wait(seconds):
+            try:
+                self.check_for_updates()
+            except Exception as e:
+                # Keep serving the current model
+                print(f"Reload failed: {e}")
+
+    def query(self, path, query):
+        """ Answer one request. Returns (status code, json-serializable body). """
+        model = self.model
+        if path not in ENDPOINTS:
+            return 404, {"error": f"unknown endpoint {path}"}
+        if model is None:
+            return 503, {"error": "the model is still loading"}
+        args = {key: values[-1] for key, values in query.items()}
+        missing = [name for name in ENDPOINTS[path] if name not in args]
+        if missing:
+            return 400, {"error": f"missing parameters {missing}"}
+        try:
+            if path == "/neighbors":
+                k = int(args.get("k", DEFAULT_NEIGHBORS))
+                return 200, {"lang": args["lang"], "neighbors": [
+                    {"name": name, "distance": d} for name, d in model.neighbors(args["lang"], k)]}
+            if path == "/distance":
+                return 200, {"a": args["a"], "b": args["b"],
+                             "distance": model.distance(args["a"], args["b"])}
+            if path == "/terms":
+                k = int(args.get("k", DEFAULT_TERMS))
+                return 200, {"lang": args["lang"], "terms": [
+                    {"term": term, "weight": w} for term, w in model.top_terms(args["lang"], k)]}
+            if path == "/graph":
+                return 200, model.graph()
+            return 200, model.status()
+        except KeyError as e:
+            return 404, {"error": e.args[0]}
+        except ValueError as e:
+            return 400, {"error": str(e)}
+
+
+class QueryHandler(BaseHTTPRequestHandler):
+    """ Serves SimilarityService.query as JSON over GET """
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        with metrics.timer(f"service{url.path.replace('/', '.')}"):
+            status, body = self.server.service.query(url.path, parse_qs(url.query))
+        payload = json.dumps(body).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def log_message(self, format, *args):
+        # One line per query would drown the reload messages
+        pass
+
+
+def make_server(service, host=SERVICE_HOST, port=SERVICE_PORT):
+    """ HTTP server for the service. Port 0 picks a free port. """
+    server = ThreadingHTTPServer((host, port), QueryHandler)
+    server.daemon_threads = True
+    server.service = service
+    return server
+
+
+def serve(service, host=SERVICE_HOST, port=SERVICE_PORT, poll_seconds=POLL_SECONDS):
+    """ Load the model, then serve queries and poll for new documents until interrupted """
+    service.reload()
+    poller = threading.Thread(target=service.poll, args=(poll_seconds,), daemon=True)
+    poller.start()
+    server = make_server(service, host, port)
+    print(f"Serving on http://{host}:{server.server_address[1]}/")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        service.stopped.set()
+        server.server_close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default=SERVICE_HOST)
+    parser.add_argument("--port", type=int, default=SERVICE_PORT)
+    parser.add_argument("--poll-seconds", type=float, default=POLL_SECONDS)
+    args, stage_argv = parser.parse_known_args(sys.argv[1:])
+    stage_args = stages.parse_args(stage_argv)
+    serve(SimilarityService(stages.make_params(stage_args), artifact_dir=stage_args.artifact_dir),
+          args.host, args.port, args.poll_seconds)
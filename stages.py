@@ -0,0 +1,457 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Stages
+
+Runs eda.py's pipeline as separate stages with on-disk artifacts:
+
+    counts -> tfidf -> embedding -> distances -> order ------> figures
+                                 -> neighbors -> layout -/
+
+Each artifact is keyed by a hash of its parameters and the keys of the stages
+it depends on (the counts stage also hashes the stored corpus revisions), so
+only stages whose inputs changed are rerun. Changing the font size only
+redraws the figures; changing the edge threshold reruns neighbors, layout and
+figures. The order stage is the heatmap's hierarchical-clustering leaf order,
+computed once per distance matrix. The neighbors stage builds the graph's
+edges with a NeighborIndex (see neighbors.py): every pair within the
+threshold, or with --neighbors-k each language's k nearest within it.
+
+Usage: python stages.py [stage ...] [--force] [--threshold 35] [--font-size 15]
+           [--neighbors-k 5] [--neighbor-method exact]
+"""
+
+import os
+import sys
+import json
+import hashlib
+import argparse
+import contextlib
+import numpy as np
+from scipy import sparse
+import eda
+import metrics
+from features import (LabelledMatrix, FeatureCache, EXTRACTOR_VERSION, EXTRACT_WORKERS,
+                      content_hash)
+from embeddings import embed, EMBEDDING_METHODS, EMBEDDING_DIM
+from layout import load_positions, save_positions
+from languages import file_hash, make_name_title_dict
+# pandas, distances, neighbors and render load sklearn, scipy and matplotlib, so
+# they are imported by the stages that use them and a run with nothing to do skips them
+from wrappers.storage_wrapper import StorageWrapper
+try:
+    import fcntl
+except ImportError:
+    # Windows
+    fcntl = None
+    import msvcrt
+
+ARTIFACT_DIR = "./data/artifacts"
+# Taken by every process running stages, i.e. stages.py and service.py's
+# reloads, since they share the artifacts, the distance state and the
+# feature cache
+STAGE_LOCK_PATH = "./data/stages.lock"
+STAGES = ("counts", "tfidf", "embedding", "distances", "neighbors", "order", "layout",
+          "figures")
+DEPENDENCIES = {"counts": (), "tfidf": ("counts",), "embedding": ("tfidf",),
+                "distances": ("embedding",), "neighbors": ("embedding",),
+                "order": ("distances",), "layout": ("neighbors",),
+                "figures": ("distances", "order", "layout")}
+# The parameters each stage's output depends on
+STAGE_PARAMS = {"counts": ("names",), "tfidf": ("low_memory",),
+                "embedding": ("embedding_method", "embedding_dim"), "distances": ("metric",),
+                "neighbors": ("metric", "distance_threshold", "neighbor_method", "neighbor_k"),
+                "order": (),
+                "layout": ("distance_threshold", "layout_engine", "layout_warm_start"),
+                "figures": ("font_size",)}
+NEIGHBOR_METHODS = ("exact", "lsh")
+
+
+def hash_key(obj):
+    """ Stable short hash of a json-serializable object """
+    return hashlib.sha1(json.dumps(obj, sort_keys=True).encode("utf-8")).hexdigest()[:16]
+
+
+def corpus_fingerprint(wrapper, names):
+    """ Hash of the stored articles that feed the pipeline. Uses revision ids,
+    and the text hash only for articles that were stored without one. """
+    revids = wrapper.revids()
+    if names is not None:
+        names = set(names)
+        revids = {n: r for n, r in revids.items() if n in names}
+    unknown = [n for n, r in revids.items() if r is None]
+    hashes = {n: content_hash(text) for n, text, date in wrapper.find_many(unknown)}
+    return hash_key(sorted((n, r if r is not None else hashes.get(n)) for n, r in revids.items()))
+
+
+@contextlib.contextmanager
+def stage_lock(path=STAGE_LOCK_PATH):
+    """ Hold an exclusive lock on path, waiting for any other process or
+    thread holding it to finish """
+    if os.path.dirname(path):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "a+b") as f:
+        if fcntl is not None:
+            fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+        else:
+            f.seek(0)
+            while True:
+                try:
+                    # Gives up after 10 seconds, so keep trying
+                    msvcrt.locking(f.fileno(), msvcrt.LK_LOCK, 1)
+                    break
+                except OSError:
+                    pass
+        try:
+            yield
+        finally:
+            if fcntl is not None:
+                fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+            else:
+                f.seek(0)
+                msvcrt.locking(f.fileno(), msvcrt.LK_UNLCK, 1)
+
+
+def save_labels(path, **labels):
+    with open(path, "w") as f:
+        json.dump(labels, f)
+
+
+def load_labels(path):
+    with open(path) as f:
+        return json.load(f)
+
+
+class StageRunner:
+    """ Runs pipeline stages on demand, loading fresh artifacts from disk
+    instead of recomputing them. A stage is fresh when the manifest records
+    the same key for it and all of its output files exist. """
+
+    def __init__(self, params, wrapper=None, artifact_dir=ARTIFACT_DIR, force=()):
+        self.params = params
+        self.artifact_dir = artifact_dir
+        self.force = set(force)
+        self.wrapper = wrapper
+        self.keys = {}
+        self.results = {}
+        self.ran = []
+        os.makedirs(artifact_dir, exist_ok=True)
+        self.manifest_path = os.path.join(artifact_dir, "manifest.json")
+        try:
+            with open(self.manifest_path) as f:
+                self.manifest = json.load(f)
+        except (OSError, ValueError):
+            self.manifest = {}
+
+    def path(self, filename):
+        return os.path.join(self.artifact_dir, filename)
+
+    def outputs(self, stage):
+        """ Files written by a stage """
+        return {"counts": [self.path("counts.npz"), self.path("counts_labels.json")],
+                "tfidf": [self.path("tfidf.npz"), self.path("idf.npy")],
+                # Without an embedding method the stage passes the TF-IDF through
+                "embedding": [self.path("embedding.npy")] if self.embedded() else [],
+                "distances": [self.path("distances.npy"), self.path("distances_labels.json")],
+                "neighbors": [self.path("neighbors.npz"), self.path("neighbors_labels.json")],
+                "order": [self.path("order.npy")],
+                "layout": [self.path("layout.npz"), self.path("layout_positions.json")],
+                "figures": [self.params["heatmap_path"], self.params["graph_path"]]}[stage]
+
+    def open_storage(self):
+        if self.wrapper is None:
+            self.wrapper = metrics.InstrumentedStorage(StorageWrapper("prod"))
+            self.wrapper.open_or_create("languages")
+        return self.wrapper
+
+    def key(self, stage):
+        """ Hash of the stage's parameters and its inputs' keys """
+        if stage not in self.keys:
+            inputs = {name: self.params.get(name) for name in STAGE_PARAMS[stage]}
+            inputs["upstream"] = [self.key(dep) for dep in DEPENDENCIES[stage]]
+            if stage == "counts":
+                inputs["extractor"] = EXTRACTOR_VERSION
+                inputs["corpus"] = corpus_fingerprint(self.open_storage(), self.params["names"])
+            if stage == "layout" and self.params.get("layout_warm_start"):
+                # The positions themselves, so replacing the file reruns the layout
+                path = self.params["layout_warm_start"]
+                inputs["warm_start_positions"] = file_hash(path) if os.path.exists(path) else None
+            self.keys[stage] = hash_key([stage, inputs])
+        return self.keys[stage]
+
+    def is_fresh(self, stage):
+        return stage not in self.force and self.manifest.get(stage) == self.key(stage) and \
+            all(os.path.exists(p) for p in self.outputs(stage))
+
+    def result(self, stage):
+        """ Return the stage's output, computing it only if it is stale """
+        if stage not in self.results:
+            if self.is_fresh(stage):
+                print(f"Stage {stage} is up to date")
+                metrics.count("stages_skipped")
+                with metrics.timer(f"stage.{stage}.load"):
+                    self.results[stage] = getattr(self, f"load_{stage}")()
+            else:
+                print(f"Running stage {stage}")
+                inputs = [self.result(dep) for dep in DEPENDENCIES[stage]]
+                metrics.count("stages_run")
+                with metrics.timer(f"stage.{stage}"):
+                    self.results[stage] = getattr(self, f"run_{stage}")(*inputs)
+                self.manifest[stage] = self.key(stage)
+                self.save_manifest()
+                self.ran.append(stage)
+        return self.results[stage]
+
+    def ensure(self, stage):
+        """ Bring the stage up to date, without loading its output if it already is """
+        if stage in self.results:
+            return
+        if self.is_fresh(stage):
+            print(f"Stage {stage} is up to date")
+            metrics.count("stages_skipped")
+        else:
+            self.result(stage)
+
+    def save_manifest(self):
+        tmp_path = f"{self.manifest_path}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(self.manifest, f, indent=2)
+        os.replace(tmp_path, self.manifest_path)
+
+    def dtype(self):
+        """ float32 TF-IDF and distances in low-memory mode """
+        return np.float32 if self.params.get("low_memory") else np.float64
+
+    def run_counts(self):
+        self.cache = FeatureCache(metrics.InstrumentedStorage(
+            StorageWrapper(self.open_storage().db_name, uri=self.open_storage().uri)))
+        X = eda.make_frame(wrapper=self.open_storage(), cache=self.cache,
+                           names=self.params["names"],
+                           workers=self.params.get("workers", 1))
+        print(f"Count matrix shape {X.matrix.shape}")
+        sparse.save_npz(self.path("counts.npz"), X.matrix)
+        save_labels(self.path("counts_labels.json"), index=X.index, columns=X.columns)
+        return X
+
+    def load_counts(self):
+        labels = load_labels(self.path("counts_labels.json"))
+        return LabelledMatrix(sparse.load_npz(self.path("counts.npz")).tocsr(),
+                              labels["index"], labels["columns"])
+
+    def run_tfidf(self, counts):
+        from distances import compute_idf
+        idf = compute_idf(counts)
+        X = eda.convert_count_matrix_to_tfid(counts, dtype=self.dtype())
+        print(f"TFIDF matrix shape {X.matrix.shape}")
+        sparse.save_npz(self.path("tfidf.npz"), X.matrix)
+        np.save(self.path("idf.npy"), idf)
+        return X, idf
+
+    def load_tfidf(self):
+        counts = self.result("counts") if "counts" in self.results else None
+        labels = counts if counts is not None else self.load_counts()
+        return (LabelledMatrix(sparse.load_npz(self.path("tfidf.npz")).tocsr(),
+                               labels.index, labels.columns),
+                np.load(self.path("idf.npy")))
+
+    def embedded(self):
+        return self.params.get("embedding_method") is not None
+
+    def run_embedding(self, tfidf):
+        X, idf = tfidf
+        if not self.embedded():
+            return X, idf
+        X = embed(X, self.params["embedding_method"], self.params["embedding_dim"],
+                  path=self.path("embedding_model.joblib"))
+        print(f"Embedding shape {X.matrix.shape}")
+        np.save(self.path("embedding.npy"), X.matrix)
+        return X, idf
+
+    def load_embedding(self):
+        X, idf = self.result("tfidf")
+        if not self.embedded():
+            return X, idf
+        matrix = np.load(self.path("embedding.npy"))
+        return LabelledMatrix(matrix, X.index, [f"dim{i}" for i in range(matrix.shape[1])]), idf
+
+    def run_distances(self, embedding):
+        from distances import update_dist_matrix, count_row_hashes, MEMORY_CEILING
+        X, idf = embedding
+        metric = self.params["metric"]
+        memory_ceiling = self.params.get("memory_ceiling") or MEMORY_CEILING
+        # In low-memory mode the matrix is written straight to a memory-mapped
+        # file, under a temporary name until it is complete
+        path = self.path("distances.tmp.npy") if self.params.get("low_memory") else None
+        if self.embedded():
+            # Distances over a few hundred dense dimensions are cheap enough
+            # to recompute in full
+            dist_mat = eda.create_dist_matrix(X, metric, low_memory=True, path=path,
+                                              memory_ceiling=memory_ceiling)
+        else:
+            # Stale rows are found by comparing the counts artifact with the
+            # row hashes saved alongside the previous distances
+            row_hashes = count_row_hashes(self.result("counts"))
+            dist_mat = update_dist_matrix(X, idf, row_hashes, metric=metric, dtype=self.dtype(),
+                                          path=path, memory_ceiling=memory_ceiling)
+        print(f"Dist matrix shape {dist_mat.shape}, max value {dist_mat.max().max():.2f}")
+        labels = list(dist_mat.index)
+        if path is None:
+            np.save(self.path("distances.npy"), dist_mat.to_numpy())
+        else:
+            # Unmapped before the rename, which Windows refuses on an open mapping
+            del dist_mat
+            os.replace(path, self.path("distances.npy"))
+        save_labels(self.path("distances_labels.json"), index=labels)
+        return self.load_distances()
+
+    def load_distances(self):
+        import pandas as pd
+        # Memory-mapped, so later stages only page in what they touch
+        distances = np.load(self.path("distances.npy"), mmap_mode="r")
+        labels = load_labels(self.path("distances_labels.json"))["index"]
+        return pd.DataFrame(distances, index=labels, columns=labels, copy=False)
+
+    def neighbor_index(self, X):
+        """ NeighborIndex over the embedding stage's matrix """
+        from neighbors import NeighborIndex
+        return NeighborIndex(X, self.params["metric"], self.params.get("neighbor_method", "exact"))
+
+    def run_neighbors(self, embedding):
+        X, idf = embedding
+        index = self.neighbor_index(X)
+        k = self.params.get("neighbor_k")
+        threshold = self.params["distance_threshold"]
+        edges = index.knn_edges(k) if k else index.radius_edges(threshold)
+        rows, cols, distances = eda.build_edges(edges, threshold)
+        edges = sparse.coo_matrix((distances, (rows, cols)), shape=edges.shape)
+        print(f"Neighbour graph has {edges.nnz} edges")
+        sparse.save_npz(self.path("neighbors.npz"), edges)
+        # Drawn with the same labels as the distance matrix
+        labels = list(np.char.title(np.asarray(X.index, dtype=str)))
+        save_labels(self.path("neighbors_labels.json"), index=labels)
+        return edges, labels
+
+    def load_neighbors(self):
+        return (sparse.load_npz(self.path("neighbors.npz")).tocoo(),
+                load_labels(self.path("neighbors_labels.json"))["index"])
+
+    def run_order(self, dist_mat):
+        import render
+        order = render.leaf_order(dist_mat.to_numpy())
+        np.save(self.path("order.npy"), order)
+        return order
+
+    def load_order(self):
+        return np.load(self.path("order.npy"))
+
+    def run_layout(self, neighbors):
+        edges, labels = neighbors
+        rows, cols, distances = eda.build_edges(edges, self.params["distance_threshold"])
+        G = eda.build_graph(len(labels), rows, cols, distances)
+        initial_pos = None
+        if self.params.get("layout_warm_start"):
+            initial_pos = load_positions(labels, self.params["layout_warm_start"])
+        pos = eda.compute_layout(G, len(labels), rows, cols, distances,
+                                 self.params["layout_engine"], initial_pos)
+        pos = np.array([pos[i] for i in range(len(labels))]).reshape(len(labels), 2)
+        np.savez(self.path("layout.npz"), rows=rows, cols=cols, distances=distances, pos=pos)
+        # For a later run to warm-start from, see --warm-start
+        save_positions(labels, pos, self.path("layout_positions.json"))
+        return rows, cols, distances, pos
+
+    def load_layout(self):
+        saved = np.load(self.path("layout.npz"))
+        return saved["rows"], saved["cols"], saved["distances"], saved["pos"]
+
+    def run_figures(self, dist_mat, order, layout):
+        import render
+        return render.render_figures(dist_mat, order, layout, self.params["font_size"],
+                                     self.params["heatmap_path"], self.params["graph_path"],
+                                     processes=self.params.get("render_processes", 2))
+
+    def load_figures(self):
+        return self.params["heatmap_path"], self.params["graph_path"]
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    # Checked below rather than with choices, which argparse also applies to
+    # the default of an empty positional list
+    parser.add_argument("stages", nargs="*", metavar="stage",
+                        help=f"stages to bring up to date, with their dependencies: "
+                             f"{', '.join(STAGES)} or all (default all)")
+    parser.add_argument("--force", action="store_true",
+                        help="rerun the named stages even if their artifacts are fresh")
+    parser.add_argument("--all-languages", action="store_true",
+                        help="use every language in the spreadsheet instead of the keep-list")
+    parser.add_argument("--workers", type=int, default=EXTRACT_WORKERS,
+                        help="processes used to extract nouns from changed articles")
+    parser.add_argument("--metric", default="cityblock")
+    parser.add_argument("--embedding", choices=EMBEDDING_METHODS, default=None,
+                        help="project the TF-IDF to a dense embedding before distances")
+    parser.add_argument("--embedding-dim", type=int, default=EMBEDDING_DIM)
+    parser.add_argument("--low-memory", action="store_true",
+                        help="float32 TF-IDF and distances, computed in blocks and "
+                             "written straight to disk")
+    parser.add_argument("--memory-ceiling", type=int, default=None, metavar="MIB",
+                        help="working memory for each block of distances, "
+                             "by default distances.MEMORY_CEILING")
+    parser.add_argument("--threshold", type=float, default=eda.DISTANCE_THRESHOLD,
+                        help="longest distance drawn as an edge")
+    parser.add_argument("--neighbors-k", type=int, default=None,
+                        help="only draw edges to each language's k nearest neighbours")
+    parser.add_argument("--neighbor-method", choices=NEIGHBOR_METHODS, default="exact",
+                        help="exact neighbours, or approximate from random-projection hashing")
+    parser.add_argument("--font-size", type=int, default=eda.FONT_SIZE)
+    parser.add_argument("--layout-engine", choices=("fast", "spring"), default=eda.LAYOUT_ENGINE)
+    parser.add_argument("--warm-start", default=None, metavar="POSITIONS",
+                        help="start the fast layout from positions saved by an earlier run, "
+                             "e.g. a copy of layout_positions.json from the artifact dir")
+    parser.add_argument("--artifact-dir", default=ARTIFACT_DIR)
+    parser.add_argument("--prometheus", action="store_true",
+                        help="also write the run report in Prometheus text format")
+    parser.add_argument("--profile", action="store_true",
+                        help="add cProfile statistics to the run report")
+    parser.add_argument("--tracemalloc", action="store_true",
+                        help="add tracemalloc statistics to the run report")
+    args = parser.parse_args(argv)
+    unknown = [stage for stage in args.stages if stage not in STAGES + ("all",)]
+    if unknown:
+        parser.error(f"invalid stage {unknown[0]!r} (choose from {', '.join(STAGES)}, all)")
+    if not args.stages or "all" in args.stages:
+        args.stages = list(STAGES)
+    return args
+
+
+def make_params(args):
+    """ StageRunner parameters from the parsed command line """
+    names = sorted(name.strip() for name in make_name_title_dict(keep_all=args.all_languages))
+    return {"names": names, "metric": args.metric, "distance_threshold": args.threshold,
+            "font_size": args.font_size, "layout_engine": args.layout_engine,
+            "workers": args.workers, "low_memory": args.low_memory,
+            "memory_ceiling": args.memory_ceiling and args.memory_ceiling * 2 ** 20,
+            "embedding_method": args.embedding, "embedding_dim": args.embedding_dim,
+            "neighbor_k": args.neighbors_k, "neighbor_method": args.neighbor_method,
+            "layout_warm_start": args.warm_start,
+            "heatmap_path": eda.HEATMAP_FIGURE_PATH, "graph_path": eda.GRAPH_FIGURE_PATH}
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    targets = args.stages
+    params = make_params(args)
+    with stage_lock():
+        runner = StageRunner(params, artifact_dir=args.artifact_dir,
+                             force=targets if args.force else ())
+        with metrics.profiled(args.profile, args.tracemalloc):
+            for stage in targets:
+                runner.ensure(stage)
+    print(f"Stages run: {runner.ran or 'none, everything was up to date'}")
+    metrics.write_report("eda", prometheus=args.prometheus)
+    return runner
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
@@ -0,0 +1,33 @@
+import sys
+sys.path.append(".")
+sys.path.append("./benchmarks")
+from synthetic_corpus import generate_corpus
+import bench_pipeline
+
+
+def test_generate_corpus_is_deterministic_with_link_density():
+    corpus = generate_corpus(5, vocabulary_size=50, words_per_doc=1000, link_density=0.1)
+    assert corpus == generate_corpus(5, vocabulary_size=50, words_per_doc=1000, link_density=0.1)
+    name, text = corpus[0]
+    assert name == "lang0"
+    assert text.count("[[") == 100
+    assert text.count("]]") == 100
+
+
+def test_run_size_times_every_stage():
+    result = bench_pipeline.run_size(20, vocabulary_size=200)
+    assert list(result["stages"]) == [
+        "generate", "ingest", "storage_read", "make_frame", "convert_count_matrix_to_tfid",
+        "create_dist_matrix", "graph_build", "layout"]
+    assert result["documents_written"] == 20
+    assert all(s["seconds"] >= 0 and s["peak_rss_mb"] > 0 for s in result["stages"].values())
+    slower = bench_pipeline.compare([result], {"results": [result]}, tolerance=0.2)
+    assert slower == []
+
+
+def test_entry_points_import_without_heavy_libraries():
+    import bench_startup
+    result = bench_startup.measure_import("stages", repeats=1)
+    assert result["heavy_loaded"] == []
+    assert result["import_seconds"] > 0
+    assert "numpy" in [t["name"] for t in result["top"]]
@@ -0,0 +1,105 @@
+import sys
+sys.path.append(".")
+import numpy as np
+from sklearn.feature_extraction.text import TfidfTransformer
+from features import build_count_matrix, LabelledMatrix
+import distances
+
+
+def make_corpus(n_docs, seed, vocab=40):
+    """ Random wiki-link documents, one per language """
+    rng = np.random.default_rng(seed)
+    docs = []
+    for i in range(n_docs):
+        links = rng.integers(0, vocab, size=30)
+        docs.append((f"lang{i:02d}", " ".join(f"[[noun{j}]]" for j in links)))
+    return docs
+
+
+def tfidf_of(counts):
+    return LabelledMatrix(TfidfTransformer().fit_transform(counts.matrix).tocsr(),
+                          counts.index, counts.columns)
+
+
+def test_compute_idf_matches_sklearn():
+    counts = build_count_matrix(make_corpus(10, seed=0))
+    expected = TfidfTransformer().fit(counts.matrix).idf_
+    assert np.allclose(distances.compute_idf(counts), expected)
+
+
+def test_update_dist_matrix_incremental(tmp_path, capsys):
+    """ Changing one document only recomputes its row and column, found from
+    the count row hashes, and the result matches a full recompute when the
+    idf barely moves """
+    docs = make_corpus(20, seed=1)
+    counts = build_count_matrix(docs)
+    first = distances.update_dist_matrix(
+        tfidf_of(counts), distances.compute_idf(counts), distances.count_row_hashes(counts),
+        state_dir=tmp_path)
+    assert first.shape == (20, 20)
+
+    docs[3] = (docs[3][0], docs[3][1] + " [[noun1]]")
+    counts = build_count_matrix(docs)
+    tfidf = tfidf_of(counts)
+    capsys.readouterr()
+    second = distances.update_dist_matrix(
+        tfidf, distances.compute_idf(counts), distances.count_row_hashes(counts),
+        state_dir=tmp_path, tolerance=1.0, path=str(tmp_path / "artifact.npy"))
+    assert "Incremental distance update for 1 of 20 documents" in capsys.readouterr().out
+    # Written to the memory-mapped file given
+    assert np.array_equal(np.load(tmp_path / "artifact.npy"), second.to_numpy())
+    full = distances.pairwise(tfidf.matrix, tfidf.matrix)
+    assert np.allclose(second.to_numpy()[3], full[3])
+    assert np.allclose(second.to_numpy()[:, 3], full[:, 3])
+    # Unchanged pairs are carried over from the first run
+    assert np.allclose(second.to_numpy()[0, 1], first.to_numpy()[0, 1])
+
+
+def test_update_dist_matrix_falls_back_on_idf_shift(tmp_path, capsys):
+    docs = make_corpus(6, seed=2, vocab=200)
+    counts = build_count_matrix(docs)
+    distances.update_dist_matrix(tfidf_of(counts), distances.compute_idf(counts),
+                                 distances.count_row_hashes(counts), state_dir=tmp_path)
+    docs = [(name, text + " [[noun0]] [[noun1]]") for name, text in docs[:2]] + docs[2:]
+    capsys.readouterr()
+    counts = build_count_matrix(docs)
+    tfidf = tfidf_of(counts)
+    result = distances.update_dist_matrix(
+        tfidf, distances.compute_idf(counts), distances.count_row_hashes(counts),
+        state_dir=tmp_path, tolerance=0.0)
+    assert "Full distance recompute: idf shift" in capsys.readouterr().out
+    assert np.allclose(result.to_numpy(), distances.pairwise(tfidf.matrix, tfidf.matrix))
+
+
+def test_count_row_hashes_ignore_column_order():
+    """ A row hashes the same when the vocabulary is ordered differently,
+    and differently when one of its counts changes """
+    docs = make_corpus(4, seed=4)
+    counts = build_count_matrix(docs)
+    order = np.arange(len(counts.columns))[::-1]
+    reordered = LabelledMatrix(counts.matrix[:, order], counts.index,
+                               [counts.columns[i] for i in order])
+    assert distances.count_row_hashes(reordered) == distances.count_row_hashes(counts)
+    docs[0] = (docs[0][0], docs[0][1] + " [[noun0]]")
+    changed = distances.count_row_hashes(build_count_matrix(docs))
+    assert [name for name, h in changed.items()
+            if h != distances.count_row_hashes(counts)[name]] == ["lang00"]
+
+
+def test_blocked_pairwise_square_condensed_and_memmap(tmp_path):
+    """ Blocked float32 distances match scipy's, in both layouts, for block
+    sizes that do not divide the row count """
+    from scipy.spatial.distance import pdist, squareform
+    tfidf = tfidf_of(build_count_matrix(make_corpus(23, seed=3)))
+    expected = pdist(tfidf.matrix.toarray(), "cityblock")
+    ceiling = 12 * 5 * 5
+    square = distances.blocked_pairwise(tfidf.matrix, memory_ceiling=ceiling)
+    assert square.dtype == np.float32
+    assert np.allclose(square, squareform(expected), atol=1e-5)
+    condensed = distances.blocked_pairwise(tfidf.matrix, condensed=True, memory_ceiling=ceiling)
+    assert np.allclose(condensed, expected, atol=1e-5)
+
+    path = str(tmp_path / "distances.npy")
+    distances.blocked_pairwise(tfidf.matrix, "braycurtis", path=path, memory_ceiling=ceiling)
+    mapped = np.load(path, mmap_mode="r")
+    assert np.allclose(mapped, squareform(pdist(tfidf.matrix.toarray(), "braycurtis")), atol=1e-5)
@@ -0,0 +1,69 @@
+import sys
+sys.path.append(".")
+import numpy as np
+from scipy.spatial.distance import cdist
+from sklearn.feature_extraction.text import TfidfTransformer
+import eda
+
+
+def test_sparse_pipeline_matches_dense():
+    """ The sparse TF-IDF and distance stages give the same distances as the
+    dense computation on the test data """
+    X = eda.make_frame(USE_TEST_DATA=True)
+    tfidf = eda.convert_count_matrix_to_tfid(X)
+    assert tfidf.matrix.format == "csr"
+    dist_mat = eda.create_dist_matrix(tfidf)
+
+    dense = TfidfTransformer().fit_transform(eda.create_test_data()).toarray()
+    assert np.allclose(dist_mat.to_numpy(), cdist(dense, dense, metric="cityblock"))
+    assert list(dist_mat.index) == ["The Ball Player", "The Wife", "Player Wife", "The Ball"]
+
+
+def test_build_edges_matches_pairwise_loop():
+    """ The vectorized edge list equals the old nested loop over i < j """
+    from scipy import sparse
+    rng = np.random.default_rng(0)
+    points = rng.random((12, 3))
+    dist_mat = cdist(points, points)
+    threshold = 0.6
+    expected = [(i, j, dist_mat[i][j]) for i in range(12) for j in range(i + 1, 12)
+                if not dist_mat[i][j] > threshold]
+    rows, cols, weights = eda.build_edges(dist_mat, threshold)
+    assert list(zip(rows.tolist(), cols.tolist(), weights.tolist())) == expected
+
+    # A sparse edge list gives the same edges
+    coo = sparse.coo_matrix(np.triu(dist_mat, k=1))
+    rows, cols, weights = eda.build_edges(coo, threshold)
+    assert sorted(zip(rows.tolist(), cols.tolist(), weights.tolist())) == expected
+
+    G = eda.build_graph(12, rows, cols, weights)
+    assert G.number_of_nodes() == 12 and G.number_of_edges() == len(expected)
+
+
+def test_scale_edge_weights_inverts_range():
+    widths = eda.scale_edge_weights([1.0, 3.0, 5.0])
+    assert np.isclose(widths[0], 10) and np.isclose(widths[-1], 1)
+    assert len(eda.scale_edge_weights([])) == 0
+    assert np.allclose(eda.scale_edge_weights([2.0, 2.0]), 10)
+
+
+def test_low_memory_distances_match():
+    X = eda.make_frame(USE_TEST_DATA=True)
+    dense = eda.create_dist_matrix(eda.convert_count_matrix_to_tfid(X))
+    tfidf = eda.convert_count_matrix_to_tfid(X, dtype=np.float32)
+    assert tfidf.matrix.dtype == np.float32
+    low = eda.create_dist_matrix(tfidf, low_memory=True)
+    assert low.to_numpy().dtype == np.float32
+    assert np.allclose(low.to_numpy(), dense.to_numpy(), atol=1e-5)
+
+
+def test_make_frame_caches_next_to_the_given_storage():
+    """ The default feature cache lives in the wrapper's database, not prod """
+    from datetime import date
+    from wrappers.storage_wrapper import StorageWrapper
+    wrapper = StorageWrapper("test_make_frame", uri="memory://")
+    wrapper.open_or_create("languages")
+    wrapper.insert_or_update_many([("rust", "[[LLVM]] [[Cargo]]", date.today(), 1)])
+    X = eda.make_frame(wrapper=wrapper)
+    assert X.index == ["rust"]
+    assert any(name.startswith("noun_counts") for name in wrapper.collection_names())
@@ -0,0 +1,65 @@
+import sys
+sys.path.append(".")
+import numpy as np
+from sklearn.feature_extraction.text import TfidfTransformer
+from features import build_count_matrix, LabelledMatrix
+import embeddings
+
+
+def tfidf_corpus(n_docs, seed, vocab=60, extra=()):
+    rng = np.random.default_rng(seed)
+    docs = [(f"lang{i:02d}", " ".join(f"[[noun{j}]]" for j in rng.integers(0, vocab, size=30)))
+            for i in range(n_docs)]
+    docs.extend(extra)
+    counts = build_count_matrix(docs)
+    return LabelledMatrix(TfidfTransformer().fit_transform(counts.matrix).tocsr(),
+                          counts.index, counts.columns)
+
+
+def test_fold_in_uses_the_saved_projection(tmp_path):
+    path = str(tmp_path / "model.joblib")
+    X = tfidf_corpus(30, seed=0)
+    first = embeddings.embed(X, "svd", 10, path=path)
+    assert first.matrix.shape == (30, 10)
+    assert first.matrix.dtype == np.float32
+
+    # A new article with one unseen term is folded in, not refit
+    grown = tfidf_corpus(30, seed=0, extra=[("new", "[[noun1]] [[noun2]] [[brand new]]")])
+    again = embeddings.embed(grown, "svd", 10, path=path)
+    model = embeddings.Embedding.load(path)
+    assert "[[brand new]]" not in model.columns
+    assert again.index[-1] == "new"
+    assert np.allclose(again.matrix[-1], model.transform(
+        LabelledMatrix(grown.matrix[-1], ["new"], grown.columns)).matrix[0])
+
+    # A mostly new vocabulary triggers a refit
+    other = tfidf_corpus(30, seed=1, vocab=200)
+    embeddings.embed(other, "svd", 10, path=path)
+    assert embeddings.Embedding.load(path).columns == other.columns
+
+
+def test_refit_when_the_corpus_can_support_more_dimensions(tmp_path):
+    """ A projection stunted by a small corpus is refit once the corpus grows """
+    path = str(tmp_path / "model.joblib")
+    small = embeddings.embed(tfidf_corpus(5, seed=0), "svd", 10, path=path)
+    assert small.matrix.shape == (5, 4)
+    assert embeddings.Embedding.load(path).components == 4
+
+    X = tfidf_corpus(30, seed=0)
+    assert embeddings.embed(X, "svd", 10, path=path).matrix.shape == (30, 10)
+    model = embeddings.Embedding.load(path)
+    assert (model.components, model.n_docs) == (10, 30)
+
+    # Many more documents than it was fitted on also refit it
+    embeddings.embed(tfidf_corpus(70, seed=0), "svd", 10, path=path)
+    assert embeddings.Embedding.load(path).n_docs == 70
+
+
+def test_random_projection_and_overlap_report():
+    X = tfidf_corpus(25, seed=2)
+    embedded = embeddings.Embedding("random", 40).fit(X).transform(X)
+    assert embedded.matrix.shape == (25, 40)
+    report = embeddings.overlap_report(X, [5, 20], method="svd", k=3)
+    assert [row["dims"] for row in report] == [len(X.columns), 5, 20]
+    assert all(0 <= row["overlap"] <= 1 for row in report)
+    assert embeddings.neighbor_overlap(np.eye(4), np.eye(4), k=2) == 1.0
@@ -0,0 +1,107 @@
+import sys
+sys.path.append(".")
+import numpy as np
+from features import build_count_matrix, extract_nouns
+
+
+def test_extract_nouns_normalizes():
+    text = "A [[Compiler]] for [[ LLVM ]] and [[compiler]]s"
+    assert extract_nouns(text) == ["[[compiler]]", "[[ llvm ]]", "[[compiler]]"]
+
+
+def test_build_count_matrix_counts_occurrences():
+    """ Counts, not presence, and columns sorted independent of document order """
+    docs = [("rust", "[[LLVM]] [[Memory safety]] [[llvm]]"),
+            ("c++", "[[Templates]] [[LLVM]]")]
+    X = build_count_matrix(docs)
+    assert X.index == ["rust", "c++"]
+    assert X.columns == ["[[llvm]]", "[[memory safety]]", "[[templates]]"]
+    assert X.matrix.format == "csr"
+    assert np.array_equal(X.matrix.toarray(), [[2, 1, 0], [1, 0, 1]])
+
+    reversed_X = build_count_matrix(reversed(docs))
+    assert reversed_X.columns == X.columns
+
+
+def test_build_count_matrix_empty():
+    X = build_count_matrix([])
+    assert X.matrix.shape == (0, 0)
+
+
+def make_stores(db_name):
+    from wrappers.storage_wrapper import StorageWrapper
+    from features import FeatureCache
+    wrapper = StorageWrapper(db_name, uri="memory://")
+    for collection_name in wrapper.collection_names():
+        wrapper.delete_collection(collection_name)
+    wrapper.open_or_create("languages")
+    cache = FeatureCache(StorageWrapper(db_name, uri="memory://"))
+    return wrapper, cache
+
+
+def test_stream_noun_counts_reuses_unchanged_revisions():
+    """ Articles with an unchanged revision are not read or parsed again """
+    from datetime import date
+    import features
+    wrapper, cache = make_stores("test_features")
+    wrapper.insert_or_update_many([("rust", "[[LLVM]] [[llvm]]", date.today(), 1),
+                                   ("go", "[[Goroutine]]", date.today(), 5)])
+    first = dict(features.stream_noun_counts(wrapper, cache))
+    assert first == {"rust": {"[[llvm]]": 2}, "go": {"[[goroutine]]": 1}}
+    assert cache.revids() == {"rust": 1, "go": 5}
+
+    wrapper.insert_or_update("go", "[[Goroutine]] [[Channel]]", date.today(), 6)
+    read = []
+    find_many = wrapper.find_many
+    wrapper.find_many = lambda names: (read.extend(names), find_many(names))[1]
+    second = dict(features.stream_noun_counts(wrapper, cache))
+    assert read == ["go"]
+    assert cache.changed == ["go"]
+    assert second == {"rust": {"[[llvm]]": 2},
+                      "go": {"[[goroutine]]": 1, "[[channel]]": 1}}
+
+
+def test_feature_cache_hash_key_eviction_and_invalidation():
+    """ Without a revision id the text hash is the key, languages outside the
+    requested names are kept but deleted articles are evicted, and a new
+    extractor version drops the cache """
+    from datetime import date
+    from wrappers.storage_wrapper import StorageWrapper
+    import features
+    wrapper, cache = make_stores("test_feature_cache")
+    wrapper.insert_or_update_many([("ruby", "[[Gem]]", date.today()),
+                                   ("perl", "[[CPAN]]", date.today())])
+    list(features.stream_noun_counts(wrapper, cache))
+    assert sorted(cache.changed) == ["perl", "ruby"]
+    list(features.stream_noun_counts(wrapper, cache))
+    assert cache.changed == []
+
+    list(features.stream_noun_counts(wrapper, cache, names=["ruby"]))
+    assert sorted(cache.store.keys()) == ["perl", "ruby"]
+    wrapper.delete("perl")
+    list(features.stream_noun_counts(wrapper, cache, names=["ruby"]))
+    assert cache.store.keys() == ["ruby"]
+
+    stale = StorageWrapper("test_feature_cache", uri="memory://")
+    stale.open_or_create("noun_counts_0ld")
+    features.FeatureCache(StorageWrapper("test_feature_cache", uri="memory://"))
+    assert "noun_counts_0ld" not in stale.collection_names()
+
+
+def test_parallel_extraction_is_deterministic():
+    """ A process pool gives the same matrix as serial extraction, in input order """
+    import features
+    docs = [(f"lang{i}", " ".join(f"[[Noun {j}]]" for j in range(i % 7, i % 7 + i % 5 + 1)))
+            for i in range(40)]
+    serial = features.build_count_matrix(docs)
+    parallel = features.build_count_matrix(docs, workers=3)
+    assert parallel.index == serial.index == [name for name, text in docs]
+    assert parallel.columns == serial.columns
+    assert (parallel.matrix != serial.matrix).nnz == 0
+
+    wrapper, cache = make_stores("test_parallel_features")
+    from datetime import date
+    wrapper.insert_or_update_many((name, text, date.today(), i) for i, (name, text) in enumerate(docs))
+    streamed = dict(features.stream_noun_counts(wrapper, cache, workers=3))
+    assert streamed == dict(features.extract_counts(docs))
+    assert sorted(cache.changed) == sorted(name for name, text in docs)
@@ -0,0 +1,117 @@
+import sys
+sys.path.append(".")
+import json
+import requests
+from requests.structures import CaseInsensitiveDict
+import ingest
+from http_cache import HttpCache, CachedSession
+
+
+class ValidatingServer:
+    """ Stand-in for a requests.Session serving wiki api pages with an ETag
+    per article version, answering 304 to a matching If-None-Match """
+
+    def __init__(self, articles, revids=None):
+        self.articles = articles
+        self.revids = revids or {}
+        self.calls = []
+
+    def get(self, url, params=None, timeout=None, headers=None):
+        self.calls.append(dict(headers or {}))
+        titles = params["titles"].split("|")
+        etag = '"' + "|".join(self.articles[t] for t in titles) + '"'
+        response = requests.Response()
+        response.url = url
+        response.headers = CaseInsensitiveDict({"ETag": etag})
+        if (headers or {}).get("If-None-Match") == etag:
+            response.status_code = 304
+            response._content = b""
+            return response
+        pages = {str(i + 1): {"title": t, "revisions": [
+            {"revid": self.revids.get(t, 1), "*": self.articles[t]}]}
+            for i, t in enumerate(titles)}
+        response.status_code = 200
+        response._content = json.dumps({"query": {"pages": pages}}).encode("utf-8")
+        return response
+
+
+def test_fresh_hits_revalidation_and_offline(tmp_path):
+    server = ValidatingServer({"Rust": "rust text", "Go": "go text"})
+    cache = HttpCache(str(tmp_path / "cache.sqlite3"), ttl=60)
+    session = CachedSession(server, cache)
+    assert ingest.fetch_batch(session, ["Rust"])["Rust"]["*"] == "rust text"
+    assert ingest.fetch_batch(session, ["Rust"])["Rust"]["*"] == "rust text"
+    assert len(server.calls) == 1
+    assert cache.counters["hits"] == 1
+
+    # Once stale, a conditional request is sent and the 304 served from cache
+    cache.ttl = 0
+    assert ingest.fetch_batch(session, ["Rust"])["Rust"]["*"] == "rust text"
+    assert server.calls[-1]["If-None-Match"] == '"rust text"'
+    assert cache.counters["revalidated"] == 1
+    server.articles["Rust"] = "new rust text"
+    assert ingest.fetch_batch(session, ["Rust"])["Rust"]["*"] == "new rust text"
+
+    # Offline: cached pages are served and misses are not retried
+    offline = CachedSession(server, cache, offline=True)
+    calls = len(server.calls)
+    assert ingest.fetch_batch(offline, ["Rust"])["Rust"]["*"] == "new rust text"
+    assert ingest.fetch_batch(offline, ["Go"]) == {}
+    assert len(server.calls) == calls
+    assert cache.counters["misses"] == 3
+
+
+def test_revision_queries_are_always_revalidated(tmp_path):
+    """ Revision id queries skip the TTL, so an edit within it is still
+    seen, while content queries are served from the cache """
+    server = ValidatingServer({"Rust": "rust text"})
+    cache = HttpCache(str(tmp_path / "cache.sqlite3"), ttl=3600)
+    session = CachedSession(server, cache)
+    for _ in range(2):
+        ingest.fetch_batch(session, ["Rust"], rvprop="ids|timestamp")
+        ingest.fetch_batch(session, ["Rust"])
+    assert len(server.calls) == 3
+    assert server.calls[-1]["If-None-Match"] == '"rust text"'
+    assert cache.counters["revalidated"] == 1 and cache.counters["hits"] == 1
+
+    # Offline, the last revision ids seen are still served
+    offline = CachedSession(server, cache, offline=True)
+    assert ingest.fetch_batch(offline, ["Rust"], rvprop="ids|timestamp")["Rust"]["revid"] == 1
+    assert len(server.calls) == 3
+
+
+def test_article_with_a_newer_revision_is_downloaded_again(tmp_path):
+    """ Once the revision check has seen a new revision id, the cached copy of
+    the article is not served, however recently it was fetched """
+    server = ValidatingServer({"Rust": "rust text"}, revids={"Rust": 1})
+    session = CachedSession(server, HttpCache(str(tmp_path / "cache.sqlite3"), ttl=3600))
+    name_to_title = {"rust": "Rust"}
+    assert ingest.query_wiki_api_for_revisions(name_to_title, session=session) == {"rust": 1}
+    assert ingest.fetch_batch(session, ["Rust"])["Rust"]["*"] == "rust text"
+    assert ingest.fetch_batch(session, ["Rust"])["Rust"]["*"] == "rust text"
+    calls = len(server.calls)
+
+    server.articles["Rust"], server.revids["Rust"] = "edited rust text", 2
+    assert ingest.query_wiki_api_for_revisions(name_to_title, session=session) == {"rust": 2}
+    revision = ingest.fetch_batch(session, ["Rust"])["Rust"]
+    assert revision == {"revid": 2, "*": "edited rust text"}
+    assert len(server.calls) == calls + 2
+    # Up to date again, so served from the cache
+    assert ingest.fetch_batch(session, ["Rust"])["Rust"]["revid"] == 2
+    assert len(server.calls) == calls + 2
+
+
+def test_lru_eviction(tmp_path):
+    server = ValidatingServer({f"L{i}": f"text {i}" for i in range(5)})
+    cache = HttpCache(str(tmp_path / "cache.sqlite3"), max_entries=3)
+    session = CachedSession(server, cache)
+    for i in range(3):
+        ingest.fetch_batch(session, [f"L{i}"])
+    # Using L0 again makes L1 the least recently used
+    ingest.fetch_batch(session, ["L0"])
+    ingest.fetch_batch(session, ["L3"])
+    assert cache.size()[0] == 3
+    assert cache.counters["evicted"] == 1
+    offline = CachedSession(server, cache, offline=True)
+    assert ingest.fetch_batch(offline, ["L1"]) == {}
+    assert ingest.fetch_batch(offline, ["L0"])["L0"]["*"] == "text 0"
@@ -0,0 +1,260 @@
+import sys
+sys.path.append(".")
+import ingest
+
+
+class FakeResponse:
+    """ Stand-in for a requests.Response built from a json object """
+
+    def __init__(self, json_obj, status_code=200, headers=None):
+        self._json_obj = json_obj
+        self.status_code = status_code
+        self.ok = status_code < 400
+        self.headers = headers or {}
+        self.text = "" if json_obj is None else str(json_obj)
+        self.content = self.text.encode("utf-8")
+
+    def json(self):
+        return self._json_obj
+
+
+class FakeSession:
+    """ Answers wiki api queries from a dict of {title: article text} """
+
+    def __init__(self, articles, throttle_first=0, revids=None):
+        self.articles = articles
+        self.revids = revids or {}
+        self.throttle_first = throttle_first
+        self.calls = []
+
+    def get(self, url, params=None, timeout=None):
+        self.calls.append(params)
+        if len(self.calls) <= self.throttle_first:
+            return FakeResponse(None, status_code=429, headers={"Retry-After": "0"})
+        pages = {}
+        normalized = []
+        for idx, title in enumerate(params["titles"].split("|")):
+            canonical = title.replace("_", " ")
+            if canonical != title:
+                normalized.append({"from": title, "to": canonical})
+            if canonical in self.articles:
+                revision = {"revid": self.revids.get(canonical, 1)}
+                if "content" in params["rvprop"]:
+                    revision["*"] = self.articles[canonical]
+                pages[str(idx + 1)] = {"title": canonical, "revisions": [revision]}
+            else:
+                pages[str(-idx - 1)] = {"title": canonical, "missing": ""}
+        return FakeResponse({"query": {"normalized": normalized, "pages": pages}})
+
+
+def test_query_wiki_api_batches_titles():
+    """ Titles are fetched in multi-title queries and mapped back to names """
+    articles = {"C++": "cpp text", "Rust (programming language)": "rust text",
+                "Go (programming language)": "go text"}
+    name_to_title = {"c++": "C%2B%2B", "rust": "Rust_(programming_language)",
+                     "go": "Go_(programming_language)", "nope": "No_such_page"}
+    session = FakeSession(articles)
+    entries = ingest.query_wiki_api_for_latest(
+        name_to_title, workers=2, titles_per_query=2, session=session)
+    result = {e.name: e.json_text for e in entries}
+    assert result == {"c++": "cpp text", "rust": "rust text", "go": "go text"}
+    assert len(session.calls) == 2
+
+
+def test_fetch_entries_maps_shared_titles_to_every_name():
+    """ The fetch helper used by the pipeline and query_wiki_api_for_latest
+    returns an entry for each name of a page """
+    session = FakeSession({"Lisp (programming language)": "lisp text"})
+    title_to_names = ingest.group_titles({"lisp": "Lisp_(programming_language)",
+                                          "common lisp ": "Lisp_(programming_language)"})
+    entries = ingest.fetch_entries(session, list(title_to_names), title_to_names)
+    assert sorted(e.name for e in entries) == ["common lisp", "lisp"]
+    assert {e.json_text for e in entries} == {"lisp text"}
+
+
+def test_get_with_backoff_retries_throttled():
+    """ A 429 with Retry-After is retried instead of returned """
+    session = FakeSession({"Julia (programming language)": "julia text"},
+                          throttle_first=2)
+    revisions = ingest.fetch_batch(session, ["Julia_(programming_language)"])
+    assert revisions == {"Julia_(programming_language)": {"revid": 1, "*": "julia text"}}
+    assert len(session.calls) == 3
+
+
+def test_retry_delay_falls_back_to_exponential():
+    result = FakeResponse(None, status_code=503)
+    assert ingest.retry_delay(result, 0, backoff=1.0) == 1.0
+    assert ingest.retry_delay(result, 3, backoff=1.0) == 8.0
+    result = FakeResponse(None, status_code=429, headers={"Retry-After": "5"})
+    assert ingest.retry_delay(result, 3, backoff=1.0) == 5.0
+
+
+class FakeWrapper:
+    """ Minimal in-process stand-in for StorageWrapper """
+
+    def __init__(self, records, stored_fingerprints=None):
+        self.records = dict(records)
+        self.stored_fingerprints = dict(stored_fingerprints or {})
+        self.write_batches = []
+
+    def keys(self):
+        return list(self.records)
+
+    def revids(self):
+        return {name: revid for name, (text, revid) in self.records.items()}
+
+    def fingerprints(self):
+        return {name: self.stored_fingerprints.get(name) for name in self.records}
+
+    def find(self, name):
+        return self.records[name][0], None
+
+    def insert_or_update(self, name, text, date_str, revid=None, fingerprint=None):
+        self.records[name] = (text, revid)
+        self.stored_fingerprints[name] = fingerprint
+
+    def insert_or_update_many(self, entries):
+        entries = list(entries)
+        self.write_batches.append(len(entries))
+        for name, text, date_str, revid, fingerprint in entries:
+            self.insert_or_update(name, text, date_str, revid, fingerprint)
+
+    def update_metadata_many(self, entries):
+        for name, revid, fingerprint in entries:
+            self.records[name] = (self.records[name][0], revid)
+            self.stored_fingerprints[name] = fingerprint
+
+
+def test_incremental_update_only_downloads_changed():
+    """ Only articles whose revision id changed have their content fetched """
+    articles = {"Ruby (programming language)": "new ruby text",
+                "Scala (programming language)": "scala text"}
+    session = FakeSession(articles, revids={"Ruby (programming language)": 2,
+                                            "Scala (programming language)": 7})
+    wrapper = FakeWrapper({"ruby": ("old ruby text", 1), "scala": ("scala text", 7)})
+    name_to_title = {"ruby": "Ruby_(programming_language)",
+                     "scala": "Scala_(programming_language)"}
+    updated = ingest.update_cache_if_newer(
+        wrapper, name_to_title, incremental=True, check_similarity=False, session=session)
+    assert updated == ["ruby"]
+    assert wrapper.records["ruby"] == ("new ruby text", 2)
+    content_queries = [p for p in session.calls if "content" in p["rvprop"]]
+    assert [p["titles"] for p in content_queries] == ["Ruby_(programming_language)"]
+
+
+def test_pipeline_batches_writes_and_flushes_on_shutdown():
+    """ Every changed article reaches storage through small bounded queues,
+    written in batches, with unchanged copies filtered by the diff stage """
+    articles = {f"Lang{i}": f"text of language {i}" for i in range(25)}
+    wrapper = FakeWrapper({"lang0": ("text of language 0", 1),
+                           "lang1": ("completely different old text", 1)})
+    pipeline = ingest.IngestPipeline(
+        wrapper, session=FakeSession(articles), fetch_workers=3, diff_workers=2,
+        titles_per_query=4, queue_size=2, write_batch_size=5, flush_seconds=10)
+    updated = pipeline.run({f"lang{i}": f"Lang{i}" for i in range(25)})
+    assert sorted(updated) == sorted(f"lang{i}" for i in range(1, 25))
+    assert wrapper.records["lang7"] == ("text of language 7", 1)
+    assert sum(wrapper.write_batches) == 24
+    assert max(wrapper.write_batches) <= 5
+    assert pipeline.stats.counters["fetch"]["items"] == 25
+    assert pipeline.stats.counters["diff"]["items"] == 25
+    # lang0 is unchanged, but gets the fingerprint it was stored without
+    assert pipeline.stats.counters["write"]["items"] == 25
+    assert wrapper.stored_fingerprints["lang0"] is not None
+
+
+def test_pipeline_reraises_after_shutdown():
+    """ A storage failure stops nothing else and is raised once the run ends """
+    import pytest
+
+    class FailingWrapper(FakeWrapper):
+        def insert_or_update_many(self, entries):
+            raise RuntimeError("disk full")
+
+    pipeline = ingest.IngestPipeline(
+        FailingWrapper({}), session=FakeSession({f"L{i}": "x" for i in range(10)}),
+        fetch_workers=2, titles_per_query=1, queue_size=1, write_batch_size=2)
+    with pytest.raises(RuntimeError, match="disk full"):
+        pipeline.run({f"l{i}": f"L{i}" for i in range(10)})
+
+
+def test_pipeline_diffs_by_fingerprint_without_reading_text():
+    """ Records stored with a fingerprint are compared by it, so find is never
+    called, and written records get the fingerprint of their new text """
+    from wrappers.fingerprint import fingerprint
+
+    class NoReadWrapper(FakeWrapper):
+        def find(self, name):
+            raise AssertionError(f"read the stored text of {name}")
+
+    same = "the rust language [[Borrow checker]] and [[Cargo]] " * 50
+    wrapper = NoReadWrapper({"rust": (same, 1), "go": ("old go text " * 50, 1)},
+                            {"rust": fingerprint(same), "go": fingerprint("old go text " * 50)})
+    articles = {"Rust": same, "Go": "new go text [[Goroutine]] " * 50}
+    updated = ingest.IngestPipeline(wrapper, session=FakeSession(articles)).run(
+        {"rust": "Rust", "go": "Go"})
+    assert updated == ["go"]
+    assert wrapper.stored_fingerprints["go"] == fingerprint(articles["Go"])
+
+
+def test_minor_edit_advances_stored_revid():
+    """ A new revision too similar to save still has its revision id stored,
+    so the next incremental run does not download it again """
+    from wrappers.fingerprint import fingerprint
+
+    text = " ".join(f"[[Ruby term {i}]]" for i in range(2000))
+    wrapper = FakeWrapper({"ruby": (text, 1)}, {"ruby": fingerprint(text)})
+    session = FakeSession({"Ruby": text.replace("term 1000]]", "term 1000.]]")},
+                          revids={"Ruby": 2})
+    updated = ingest.update_cache_if_newer(wrapper, {"ruby": "Ruby"}, incremental=True,
+                                           session=session)
+    assert updated == []
+    assert wrapper.records["ruby"] == (text, 2)
+    assert wrapper.stored_fingerprints["ruby"] == fingerprint(text)
+
+    session.calls.clear()
+    assert ingest.update_cache_if_newer(wrapper, {"ruby": "Ruby"}, incremental=True,
+                                        session=session) == []
+    assert not [p for p in session.calls if "content" in p["rvprop"]]
+
+
+def test_one_word_edit_is_not_meaningful_by_fingerprint_or_text():
+    """ The fingerprint cutoff keeps the text ratio's verdicts: a one-word
+    edit is not saved, a new paragraph is """
+    import random
+    from wrappers.fingerprint import fingerprint
+    rng = random.Random(0)
+    vocabulary = [f"word{i}" for i in range(500)]
+    words = [rng.choice(vocabulary) for _ in range(600)]
+    stored = " ".join(words)
+    edited = " ".join(words[:300] + ["changed"] + words[301:])
+    extended = stored + " " + " ".join(rng.choice(vocabulary) for _ in range(60))
+    for text, meaningful in ((edited, False), (extended, True)):
+        entry = ingest.LangEntry("rust", text, 2, fingerprint(text))
+        assert ingest.is_meaningful_change(entry, stored_fingerprint=fingerprint(stored)) \
+            == meaningful
+        assert ingest.is_meaningful_change(entry._replace(fingerprint=None), stored) == meaningful
+
+
+def test_name_title_index_rebuilt_only_when_csv_changes(tmp_path, monkeypatch):
+    """ The language map comes from the index until the csv's contents change """
+    import os
+    import languages
+    csv_path = tmp_path / "languages.csv"
+    index_path = str(tmp_path / "index.json")
+    csv_path.write_text("ProgrammingLanguage,Source\n"
+                        "Rust,http://en.wikipedia.org/wiki/Rust_(programming_language)\n")
+    assert languages.make_name_title_dict(True, str(csv_path), index_path) == {
+        "rust": "Rust_(programming_language)"}
+
+    # A new modification time with the same contents keeps the parsed rows
+    with monkeypatch.context() as m:
+        m.setattr(languages, "read_name_title_csv", None)
+        os.utime(csv_path, ns=(0, 0))
+        assert languages.load_name_title_index(str(csv_path), index_path) == [
+            ("rust", "Rust_(programming_language)")]
+
+    csv_path.write_text("ProgrammingLanguage,Source\n"
+                        "Go,http://en.wikipedia.org/wiki/Go_(programming_language)\n")
+    assert languages.make_name_title_dict(True, str(csv_path), index_path) == {
+        "go": "Go_(programming_language)"}
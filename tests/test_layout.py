@@ -0,0 +1,49 @@
+import sys
+sys.path.append(".")
+import numpy as np
+import layout
+
+
+def ring_graph(n):
+    rows = np.arange(n)
+    cols = (rows + 1) % n
+    return rows, cols, np.ones(n)
+
+
+def test_force_layout_is_deterministic_and_rescaled():
+    rows, cols, weights = ring_graph(30)
+    first, _ = layout.force_layout(30, rows, cols, weights, seed=3)
+    second, _ = layout.force_layout(30, rows, cols, weights, seed=3)
+    assert np.array_equal(first, second)
+    assert first.shape == (30, 2)
+    assert np.isclose(np.abs(first).max(), 1.0)
+
+
+def test_force_layout_stops_early_and_warm_start_is_faster():
+    for n in (40, 200):
+        rows, cols, weights = ring_graph(n)
+        pos, iterations = layout.force_layout(n, rows, cols, weights, max_iterations=2000)
+        assert iterations < 2000
+        # Converged positions are already in balance: they stop at once and stay put
+        warm, warm_iterations = layout.force_layout(n, rows, cols, weights, initial_pos=pos)
+        assert warm_iterations <= 3
+        assert np.abs(warm - pos).max() < 0.02
+
+
+def test_multilevel_layout_of_a_large_graph():
+    rows, cols, weights = ring_graph(200)
+    parent, n_coarse, _ = layout.coarsen(200, rows, cols, weights, np.random.default_rng(0))
+    assert n_coarse < 150 and parent.max() == n_coarse - 1
+    pos, _ = layout.force_layout(200, rows, cols, weights)
+    # Neighbours on the ring end up closer than a random pair
+    edge_length = np.linalg.norm(pos[rows] - pos[cols], axis=1).mean()
+    opposite = np.linalg.norm(pos[:100] - pos[100:], axis=1).mean()
+    assert edge_length < opposite
+
+
+def test_positions_round_trip(tmp_path):
+    path = str(tmp_path / "positions.json")
+    layout.save_positions(["a", "b"], np.array([[0.5, -0.5], [1.0, 0.0]]), path)
+    pos = layout.load_positions(["b", "c"], path)
+    assert np.allclose(pos[0], [1.0, 0.0]) and np.isnan(pos[1]).all()
+    assert layout.load_positions(["x"], path) is None
@@ -0,0 +1,51 @@
+import sys
+sys.path.append(".")
+import json
+from datetime import date
+import pytest
+import metrics
+from wrappers.storage_wrapper import StorageWrapper
+
+
+def test_timers_counters_and_reports(tmp_path):
+    registry = metrics.Metrics()
+    with registry.timer("stage.counts"):
+        registry.count("http_bytes", 100)
+    with pytest.raises(ValueError):
+        with registry.timer("stage.counts"):
+            raise ValueError("stage failed")
+    registry.count("http_bytes", 50)
+
+    report = registry.report()
+    assert report["timers"]["stage.counts"]["calls"] == 2
+    assert report["counters"] == {"http_bytes": 150}
+    text = registry.prometheus_text()
+    assert 'unsupervised_pl_events_total{name="http_bytes"} 150' in text
+    assert 'unsupervised_pl_timer_calls_total{name="stage.counts"} 2' in text
+
+    path = metrics.write_report("test", prometheus=True, report_dir=str(tmp_path),
+                                metrics=registry)
+    with open(path) as f:
+        assert json.load(f)["counters"] == {"http_bytes": 150}
+    assert (tmp_path / "test.prom").read_text().startswith("# TYPE")
+
+
+def test_instrumented_storage_counts_round_trips():
+    registry = metrics.Metrics()
+    wrapper = metrics.InstrumentedStorage(StorageWrapper("test_metrics", uri="memory://"),
+                                          registry)
+    wrapper.open_or_create("languages")
+    wrapper.insert_or_update_many([("rust", "text", date.today(), 1),
+                                   ("go", "text", date.today(), 2)])
+    assert sorted(name for name, text, stored in wrapper.find_many(["rust", "go"])) == ["go", "rust"]
+    assert wrapper.collection_name == "languages"
+    assert registry.counters["db_round_trips"] == 3
+    assert registry.timers["storage.find_many"]["calls"] == 1
+
+
+def test_profiled_adds_cpu_and_memory_statistics():
+    registry = metrics.Metrics()
+    with metrics.profiled(cpu=True, memory=True, metrics=registry):
+        sorted(str(i) for i in range(10000))
+    assert "cumulative" in registry.profile["cpu"]
+    assert registry.profile["memory"]["peak_bytes"] > 0
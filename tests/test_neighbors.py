@@ -0,0 +1,67 @@
+import sys
+sys.path.append(".")
+import numpy as np
+from features import build_count_matrix, LabelledMatrix
+from sklearn.feature_extraction.text import TfidfTransformer
+from distances import pairwise
+from neighbors import NeighborIndex
+
+
+def make_tfidf(n_docs=30, vocab=60, seed=0):
+    rng = np.random.default_rng(seed)
+    docs = [(f"Lang{i:02d}", " ".join(f"[[noun{j}]]" for j in rng.integers(0, vocab, 25)))
+            for i in range(n_docs)]
+    counts = build_count_matrix(docs)
+    return LabelledMatrix(TfidfTransformer().fit_transform(counts.matrix).tocsr(),
+                          counts.index, counts.columns)
+
+
+def test_exact_neighbors_match_distance_matrix():
+    X = make_tfidf()
+    full = pairwise(X.matrix, X.matrix)
+    index = NeighborIndex(X, method="exact")
+    result = index.neighbors("lang05", k=3)
+    expected = [i for i in np.argsort(full[5], kind="stable") if i != 5][:3]
+    assert [name for name, d in result] == [X.index[i] for i in expected]
+    assert np.allclose([d for name, d in result], full[5, expected])
+
+
+def test_radius_edges_are_upper_triangular_and_thresholded():
+    X = make_tfidf()
+    full = pairwise(X.matrix, X.matrix)
+    radius = np.percentile(full[np.triu_indices(len(full), 1)], 10)
+    edges = NeighborIndex(X, method="exact").radius_edges(radius)
+    assert np.all(edges.row < edges.col)
+    expected = {(i, j) for i, j in zip(*np.triu_indices(len(full), 1)) if full[i, j] <= radius}
+    assert set(zip(edges.row, edges.col)) == expected
+    assert np.allclose(edges.data, full[edges.row, edges.col])
+
+
+def test_lsh_neighbors_use_exact_distances():
+    X = make_tfidf()
+    full = pairwise(X.matrix, X.matrix)
+    index = NeighborIndex(X, method="lsh", seed=1)
+    result = index.neighbors("Lang07", k=4)
+    assert len(result) == 4
+    for name, d in result:
+        assert np.isclose(d, full[7, X.index.index(name)])
+    edges = index.knn_edges(k=2)
+    assert np.all(edges.row < edges.col)
+
+
+def test_unsorted_and_dense_rows_give_the_same_neighbors():
+    """ A matrix with unsorted column indices, or a dense one, is indexed
+    the same as the canonical sparse matrix """
+    X = make_tfidf()
+    full = pairwise(X.matrix, X.matrix)
+    shuffled = X.matrix.tocsr()
+    shuffled = type(shuffled)((shuffled.data.copy(), shuffled.indices.copy(),
+                               shuffled.indptr.copy()), shape=shuffled.shape)
+    for row in range(shuffled.shape[0]):
+        span = slice(shuffled.indptr[row], shuffled.indptr[row + 1])
+        shuffled.indices[span] = shuffled.indices[span][::-1]
+        shuffled.data[span] = shuffled.data[span][::-1]
+    shuffled.has_sorted_indices = False
+    for matrix in (shuffled, X.matrix.toarray()):
+        edges = NeighborIndex(LabelledMatrix(matrix, X.index, X.columns)).knn_edges(k=3)
+        assert np.allclose(edges.data, full[edges.row, edges.col])
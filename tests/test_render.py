@@ -0,0 +1,42 @@
+import sys
+sys.path.append(".")
+import numpy as np
+import pandas as pd
+from scipy.spatial.distance import cdist
+import render
+
+
+def test_leaf_order_groups_clusters_and_downsample_averages_blocks():
+    """ Members of a cluster are adjacent in the leaf order, and the
+    downsampled image holds the means of the reordered blocks """
+    rng = np.random.default_rng(0)
+    centers = np.array([[0, 0], [10, 0], [0, 10]])
+    points = np.concatenate([c + rng.random((7, 2)) for c in centers])[rng.permutation(21)]
+    distances = cdist(points, points)
+    order = render.leaf_order(distances)
+    assert sorted(order) == list(range(21))
+    clusters = np.argmin(cdist(points[order], centers), axis=1)
+    assert np.count_nonzero(np.diff(clusters)) == 2
+
+    image = render.downsample(distances, order, max_size=5)
+    assert image.shape == (5, 5) and image.dtype == np.float32
+    ordered = distances[order][:, order]
+    assert np.isclose(image[0, 1], ordered[:5, 5:10].mean())
+    assert np.isclose(image[4, 4], ordered[20:, 20:].mean())
+    assert np.allclose(render.downsample(distances, order), ordered)
+
+
+def test_render_figures_in_separate_processes(tmp_path):
+    """ Both figures are written, with the heatmap downsampled """
+    rng = np.random.default_rng(1)
+    points = rng.random((30, 3))
+    labels = [f"lang{i}" for i in range(30)]
+    dist_mat = pd.DataFrame(cdist(points, points), index=labels, columns=labels)
+    rows, cols = np.triu_indices(30, k=1)
+    keep = dist_mat.to_numpy()[rows, cols] < 0.3
+    layout = (rows[keep], cols[keep], dist_mat.to_numpy()[rows, cols][keep], rng.random((30, 2)))
+    heatmap, graph = render.render_figures(
+        dist_mat, render.leaf_order(dist_mat.to_numpy()), layout, 10,
+        str(tmp_path / "heatmap.png"), str(tmp_path / "graph.png"), max_size=10)
+    assert (tmp_path / "heatmap.png").stat().st_size > 0
+    assert (tmp_path / "graph.png").stat().st_size > 0
@@ -0,0 +1,77 @@
+import sys
+sys.path.append(".")
+import json
+import threading
+import urllib.request
+import urllib.error
+from datetime import date
+import numpy as np
+import service
+from wrappers.storage_wrapper import StorageWrapper
+
+ARTICLES = {"rust": "[[LLVM]] [[Memory safety]] [[Cargo]] [[Cargo]]",
+            "c++": "[[LLVM]] [[Templates]] [[Memory safety]]",
+            "python": "[[Interpreter]] [[Duck typing]]",
+            "ruby": "[[Interpreter]] [[Duck typing]] [[Rails]]"}
+
+
+def get(server, path):
+    url = f"http://127.0.0.1:{server.server_address[1]}{path}"
+    try:
+        with urllib.request.urlopen(url) as response:
+            return response.status, json.loads(response.read())
+    except urllib.error.HTTPError as e:
+        return e.code, json.loads(e.read())
+
+
+def test_service_answers_queries_and_reloads(tmp_path, monkeypatch):
+    """ Queries are answered over http from the loaded model, and a new
+    document in storage is picked up by swapping in a new model """
+    monkeypatch.chdir(tmp_path)
+    wrapper = StorageWrapper("service_test", uri="memory://")
+    wrapper.delete_collection("languages")
+    wrapper.open_or_create("languages")
+    wrapper.insert_or_update_many(
+        (name, text, date(2024, 1, 1), i) for i, (name, text) in enumerate(ARTICLES.items()))
+    params = {"names": sorted(ARTICLES) + ["go"], "metric": "cityblock",
+              "distance_threshold": 10, "layout_engine": "fast"}
+    similarity = service.SimilarityService(params, wrapper=wrapper,
+                                           artifact_dir=str(tmp_path / "artifacts"))
+    assert similarity.check_for_updates()
+    model = similarity.model
+    server = service.make_server(similarity, port=0)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    try:
+        status, body = get(server, "/neighbors?lang=Ruby&k=2")
+        assert status == 200
+        assert body["neighbors"][0]["name"] == "Python"
+        assert np.isclose(body["neighbors"][0]["distance"], model.distance("ruby", "python"))
+        assert len(body["neighbors"]) == 2
+        status, body = get(server, "/distance?a=rust&b=c%2B%2B")
+        assert status == 200 and np.isclose(body["distance"], model.distances[
+            model.row_of("rust"), model.row_of("c++")])
+        status, body = get(server, "/terms?lang=rust&k=1")
+        assert body["terms"][0]["term"] == "[[cargo]]"
+        status, body = get(server, "/graph")
+        assert len(body["nodes"]) == 4
+        assert get(server, "/neighbors?lang=cobol")[0] == 404
+        assert get(server, "/distance?a=rust")[0] == 400
+        assert get(server, "/neighbors?lang=rust&k=two")[0] == 400
+
+        # Nothing stored changed, so the model is kept
+        assert not similarity.check_for_updates()
+        wrapper.insert_or_update("go", "[[Goroutine]] [[Cargo]] [[LLVM]]", date(2024, 2, 1), 9)
+        # The reload waits while a stages.py run holds the stage lock
+        with service.stages.stage_lock():
+            reload = threading.Thread(target=similarity.check_for_updates)
+            reload.start()
+            reload.join(0.2)
+            assert reload.is_alive() and similarity.model is model
+        reload.join()
+        assert similarity.model is not model
+        status, body = get(server, "/status")
+        assert body["languages"] == 5
+        assert get(server, "/neighbors?lang=go&k=1")[0] == 200
+    finally:
+        server.shutdown()
+        server.server_close()
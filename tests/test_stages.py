@@ -0,0 +1,149 @@
+import sys
+sys.path.append(".")
+import matplotlib
+matplotlib.use("Agg")
+from datetime import date
+import numpy as np
+import stages
+from wrappers.storage_wrapper import StorageWrapper
+
+ARTICLES = {"rust": "[[LLVM]] [[Memory safety]] [[Cargo]]",
+            "c++": "[[LLVM]] [[Templates]] [[Memory safety]]",
+            "python": "[[Interpreter]] [[Duck typing]]",
+            "ruby": "[[Interpreter]] [[Duck typing]] [[Rails]]"}
+
+
+def make_runner(tmp_path, **overrides):
+    wrapper = StorageWrapper("stages_test", uri="memory://")
+    wrapper.open_or_create("languages")
+    params = {"names": sorted(ARTICLES), "metric": "cityblock", "distance_threshold": 10,
+              "font_size": 10, "layout_engine": "fast",
+              "heatmap_path": str(tmp_path / "heatmap.png"),
+              "graph_path": str(tmp_path / "graph.png")}
+    params.update(overrides)
+    return wrapper, stages.StageRunner(params, wrapper=wrapper,
+                                       artifact_dir=str(tmp_path / "artifacts"))
+
+
+def run_all(runner):
+    for stage in stages.STAGES:
+        runner.result(stage)
+    return runner.ran
+
+
+def test_stages_rerun_only_what_changed(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    wrapper, runner = make_runner(tmp_path)
+    for collection_name in wrapper.collection_names():
+        wrapper.delete_collection(collection_name)
+    wrapper.open_or_create("languages")
+    wrapper.insert_or_update_many(
+        (name, text, date(2024, 1, 1), i) for i, (name, text) in enumerate(ARTICLES.items()))
+
+    assert run_all(runner) == list(stages.STAGES)
+    first = runner.result("distances").to_numpy().copy()
+
+    # Nothing changed: everything is loaded from disk
+    _, runner = make_runner(tmp_path)
+    assert run_all(runner) == []
+    assert (runner.result("distances").to_numpy() == first).all()
+
+    # A drawing parameter only redraws the figures
+    _, runner = make_runner(tmp_path, font_size=12)
+    assert run_all(runner) == ["figures"]
+
+    # The edge threshold changes the neighbour graph, layout and figures
+    _, runner = make_runner(tmp_path, font_size=12, distance_threshold=5)
+    assert run_all(runner) == ["neighbors", "layout", "figures"]
+    edges, labels = runner.result("neighbors")
+    full = runner.result("distances").to_numpy()
+    assert labels == list(runner.result("distances").index)
+    assert set(zip(edges.row, edges.col)) == {
+        (i, j) for i in range(4) for j in range(i + 1, 4) if full[i, j] <= 5}
+    rows, cols, distances, pos = runner.result("layout")
+    assert np.allclose(distances, full[rows, cols])
+
+    # Nearest neighbours only keep each language's closest within the threshold
+    _, runner = make_runner(tmp_path, font_size=12, distance_threshold=5, neighbor_k=1)
+    assert run_all(runner) == ["neighbors", "layout", "figures"]
+    _, runner = make_runner(tmp_path, font_size=12, distance_threshold=5)
+    run_all(runner)
+
+    # Warm-start positions are part of the layout's key, by content
+    import shutil
+    warm_start = str(tmp_path / "warm_start.json")
+    shutil.copy(str(tmp_path / "artifacts" / "layout_positions.json"), warm_start)
+    _, runner = make_runner(tmp_path, font_size=12, distance_threshold=5,
+                            layout_warm_start=warm_start)
+    assert run_all(runner) == ["layout", "figures"]
+    _, runner = make_runner(tmp_path, font_size=12, distance_threshold=5,
+                            layout_warm_start=warm_start)
+    assert run_all(runner) == []
+    with open(warm_start, "w") as f:
+        f.write('{"Rust": [0.5, 0.5]}')
+    _, runner = make_runner(tmp_path, font_size=12, distance_threshold=5,
+                            layout_warm_start=warm_start)
+    assert run_all(runner) == ["layout", "figures"]
+    assert not (tmp_path / "data" / "layout_positions.json").exists()
+
+    # An embedding reruns everything after the TF-IDF
+    _, runner = make_runner(tmp_path, font_size=12, distance_threshold=5,
+                            embedding_method="svd", embedding_dim=2)
+    assert run_all(runner) == ["embedding", "distances", "neighbors", "order", "layout",
+                               "figures"]
+    assert runner.result("embedding")[0].matrix.shape == (4, 2)
+    _, runner = make_runner(tmp_path, font_size=12, distance_threshold=5,
+                            embedding_method="svd", embedding_dim=2)
+    assert run_all(runner) == []
+
+    # A new revision of one article reruns everything downstream of the corpus
+    wrapper.insert_or_update("ruby", ARTICLES["ruby"] + " [[Gems]]", date(2024, 2, 1), revid=99)
+    _, runner = make_runner(tmp_path, font_size=12, distance_threshold=5)
+    assert run_all(runner) == list(stages.STAGES)
+    assert not (runner.result("distances").to_numpy() == first).all()
+
+
+def test_low_memory_distances_are_written_to_disk(tmp_path, monkeypatch):
+    """ --low-memory writes the float32 matrix straight to its memory-mapped artifact """
+    monkeypatch.chdir(tmp_path)
+    wrapper, runner = make_runner(tmp_path)
+    wrapper.insert_or_update_many(
+        (name, text, date(2024, 1, 1), i) for i, (name, text) in enumerate(ARTICLES.items()))
+    full = runner.result("distances").to_numpy().copy()
+    for embedding in ({}, {"embedding_method": "svd", "embedding_dim": 2}):
+        _, runner = make_runner(tmp_path, low_memory=True, memory_ceiling=2 ** 10, **embedding)
+        dist_mat = runner.result("distances")
+        assert "distances" in runner.ran
+        saved = np.load(runner.path("distances.npy"), mmap_mode="r")
+        assert saved.dtype == np.float32 and saved.shape == (4, 4)
+        assert not list((tmp_path / "artifacts").glob("**/distances.tmp.npy"))
+        if not embedding:
+            assert np.allclose(dist_mat.to_numpy(), full)
+
+
+def test_parse_args_stage_selection():
+    """ No stages or "all" selects every stage, and unknown stages are rejected """
+    import pytest
+    assert stages.parse_args([]).stages == list(stages.STAGES)
+    assert stages.parse_args(["all"]).stages == list(stages.STAGES)
+    assert stages.parse_args(["order", "layout"]).stages == ["order", "layout"]
+    with pytest.raises(SystemExit):
+        stages.parse_args(["plots"])
+
+
+def test_stage_lock_excludes_other_holders(tmp_path):
+    """ A second holder waits until the first releases the lock """
+    import threading
+    path = str(tmp_path / "stages.lock")
+    entered = threading.Event()
+
+    def hold():
+        with stages.stage_lock(path):
+            entered.set()
+
+    with stages.stage_lock(path):
+        thread = threading.Thread(target=hold)
+        thread.start()
+        assert not entered.wait(0.2)
+    thread.join(5)
+    assert entered.is_set()
@@ -1,7 +1,12 @@
+import os
 import pytest
 from datetime import datetime
 # @NOTE: Could remove some repeated boilerplate with a test fixture
 
+# Tests run against the in-memory backend unless TEST_STORAGE_URI names another,
+# e.g. TEST_STORAGE_URI=mongodb://localhost:27017/ to test against a live server
+TEST_URI = os.environ.get("TEST_STORAGE_URI", "memory://")
+
 
 def test_wrapper_import():
     """ Test that the wrappers class can be imported """
@@ -25,16 +30,16 @@ def test_open_or_create():
     import sys
     sys.path.append(".")
     from wrappers.storage_wrapper import StorageWrapper
-    wrapper = StorageWrapper("prod")
+    wrapper = StorageWrapper("prod", uri=TEST_URI)
     wrapper.delete_collection("test_collection")
-    assert "test_collection" not in wrapper.db.list_collection_names()
+    assert "test_collection" not in wrapper.collection_names()
     wrapper.open_or_create("test_collection")
-    assert "test_collection" in wrapper.db.list_collection_names()
+    assert "test_collection" in wrapper.collection_names()
     wrapper.delete_collection("test_collection")
 
     # Test that the open_or_create method switches to an existing collection if it does exist
     wrapper.open_or_create("test_collection")
-    assert wrapper.curr_collection.name == "test_collection"
+    assert wrapper.collection_name == "test_collection"
 
 
 def test_find():
@@ -42,7 +47,7 @@ def test_find():
     import sys
     sys.path.append(".")
     from wrappers.storage_wrapper import StorageWrapper
-    wrapper = StorageWrapper("test_db")
+    wrapper = StorageWrapper("test_db", uri=TEST_URI)
     wrapper.delete_collection("test_collection")
     wrapper.open_or_create("test_collection")
     record = {"name": "test", "value": "test value"}
@@ -66,7 +71,7 @@ def test_keys():
     import sys
     sys.path.append(".")
     from wrappers.storage_wrapper import StorageWrapper
-    wrapper = StorageWrapper("test_db")
+    wrapper = StorageWrapper("test_db", uri=TEST_URI)
     wrapper.open_or_create("test_collection")
     result = wrapper.keys()
     assert result == list()
@@ -91,7 +96,7 @@ def test_insert_or_update():
     import sys
     sys.path.append(".")
     from wrappers.storage_wrapper import StorageWrapper
-    wrapper = StorageWrapper("test_db")
+    wrapper = StorageWrapper("test_db", uri=TEST_URI)
     wrapper.open_or_create("test_collection")
 
     record = {"name": "test", "value": "test value"}
@@ -122,7 +127,7 @@ def test_delete():
     import sys
     sys.path.append(".")
     from wrappers.storage_wrapper import StorageWrapper
-    wrapper = StorageWrapper("test_db")
+    wrapper = StorageWrapper("test_db", uri=TEST_URI)
     wrapper.open_or_create("test_collection")
 
     record = {"name": "test", "value": "test value"}
@@ -137,3 +142,164 @@ def test_delete():
     result = wrapper.find("non-existent")
     assert result == None
     wrapper.delete_collection("test_collection")
+
+
+def test_insert_or_update_many():
+    # Test inserting and updating several records in one bulk write
+    import sys
+    sys.path.append(".")
+    from wrappers.storage_wrapper import StorageWrapper
+    wrapper = StorageWrapper("test_db", uri=TEST_URI)
+    wrapper.open_or_create("test_collection")
+    today = datetime.today().date()
+
+    wrapper.insert_or_update_many(
+        [("test1", "test value 1", today), ("test2", "test value 2", today, 7)])
+    wrapper.insert_or_update_many([("test1", "updated value 1", today)])
+    try:
+        assert wrapper.find("test1")[0] == "updated value 1"
+        assert wrapper.find("test2")[0] == "test value 2"
+        assert wrapper.revids() == {"test1": None, "test2": 7}
+    finally:
+        wrapper.delete_collection("test_collection")
+
+
+def test_find_many_and_iter_all():
+    # Test bulk reads return (name, text, date) and skip missing names
+    import sys
+    sys.path.append(".")
+    from wrappers.storage_wrapper import StorageWrapper
+    wrapper = StorageWrapper("test_db", uri=TEST_URI)
+    wrapper.open_or_create("test_collection")
+    today = datetime.today().date()
+    wrapper.insert_or_update_many(
+        [("test2", "test value 2", today), ("test1", "test value 1", today)])
+    try:
+        found = list(wrapper.find_many(["test1", "non-existent"]))
+        assert [(name, text) for name, text, date in found] == [
+            ("test1", "test value 1")]
+        every = list(wrapper.iter_all())
+        assert [name for name, text, date in every] == ["test1", "test2"]
+        assert every[0][2].date() == today
+    finally:
+        wrapper.delete_collection("test_collection")
+
+
+def test_record_encoding_round_trip():
+    # Test that version 2 records decode to the same text and date, and that
+    # version 1 records are still readable
+    import sys
+    import json
+    sys.path.append(".")
+    from wrappers.records import encode_record, decode_record
+    today = datetime.today().date()
+    for compression in (None, "zlib"):
+        record = encode_record("test", "test value " * 100, today, 5, compression)
+        assert record["size"] == len("test value " * 100)
+        text, date = decode_record(record)
+        assert text == "test value " * 100
+        assert date.date() == today
+    legacy = {"name": "test", "value": json.dumps(["test value", today.isoformat()])}
+    assert decode_record(legacy)[0] == "test value"
+
+
+@pytest.mark.skipif(not TEST_URI.startswith("mongodb"),
+                    reason="version 1 records only exist in MongoDB")
+def test_migrate_to_v2():
+    # Test that legacy records are rewritten in the version 2 format
+    import sys
+    import json
+    sys.path.append(".")
+    from wrappers.storage_wrapper import StorageWrapper
+    wrapper = StorageWrapper("test_db", uri=TEST_URI)
+    wrapper.delete_collection("test_collection")
+    today = datetime.today().date()
+    wrapper.backend.db["test_collection"].insert_one(
+        {"name": "test", "value": json.dumps(["test value", today.isoformat()]), "revid": 3})
+    try:
+        assert wrapper.migrate_to_v2("test_collection") == 1
+        stored = wrapper.backend.db["test_collection"].find_one({"name": "test"})
+        assert "value" not in stored and stored["schema"] == 2
+        assert wrapper.find("test")[0] == "test value"
+        assert wrapper.revids() == {"test": 3}
+    finally:
+        wrapper.delete_collection("test_collection")
+
+
+@pytest.mark.skipif(not TEST_URI.startswith("mongodb"),
+                    reason="only MongoDB collections were ever capped")
+def test_capped_collection_refuses_writes_until_migrated():
+    # Test that writing to a capped version 1 collection asks for a migration
+    import sys
+    sys.path.append(".")
+    from wrappers.storage_wrapper import StorageWrapper
+    wrapper = StorageWrapper("test_db", uri=TEST_URI)
+    wrapper.delete_collection("test_collection")
+    wrapper.backend.db.create_collection("test_collection", capped=True, size=2 ** 20)
+    today = datetime.today().date()
+    try:
+        wrapper.open_or_create("test_collection")
+        with pytest.raises(ValueError, match="migrate"):
+            wrapper.insert_or_update_many([("test", "test value", today, 1)])
+        wrapper.migrate_to_v2("test_collection")
+        wrapper.insert_or_update_many([("test", "test value", today, 1)])
+        assert wrapper.find("test")[0] == "test value"
+    finally:
+        wrapper.delete_collection("test_collection")
+
+
+def test_sqlite_backend(tmp_path):
+    # Test the sqlite backend round trips records through a local file
+    import sys
+    sys.path.append(".")
+    from wrappers.storage_wrapper import StorageWrapper
+    wrapper = StorageWrapper("test_db", uri=f"sqlite://{tmp_path}")
+    wrapper.open_or_create("test_collection")
+    today = datetime.today().date()
+    wrapper.insert_or_update_many(
+        [("test2", "test value 2", today, 4), ("test1", "test value 1", today)])
+    wrapper.insert_or_update("test1", "updated value 1", today)
+    assert wrapper.keys() == ["test1", "test2"]
+    assert wrapper.find("test1")[0] == "updated value 1"
+    assert [name for name, text, date in wrapper.iter_all()] == ["test1", "test2"]
+    assert wrapper.revids() == {"test1": None, "test2": 4}
+    wrapper.delete("test2")
+    assert wrapper.find("test2") is None
+    assert os.path.exists(tmp_path / "test_db.sqlite3")
+
+    # Test that a second wrapper sees the same file
+    reopened = StorageWrapper("test_db", uri=f"sqlite://{tmp_path}")
+    reopened.open_or_create("test_collection")
+    assert reopened.keys() == ["test1"]
+
+
+def test_fingerprints(tmp_path):
+    # Test that every backend stores fingerprints and returns them without the text
+    import sys
+    sys.path.append(".")
+    from wrappers.storage_wrapper import StorageWrapper
+    from wrappers.fingerprint import fingerprint, similarity, NUM_PERMUTATIONS
+    text = " ".join(f"word{i}" for i in range(2000))
+    edited = text.replace("word1000 ", "changed ")
+    assert len(fingerprint(text)) == NUM_PERMUTATIONS * 4
+    assert similarity(fingerprint(text), fingerprint(text)) == 1.0
+    assert similarity(fingerprint(text), fingerprint(edited)) > 0.9
+    assert similarity(fingerprint(text), fingerprint("something else entirely")) < 0.1
+
+    today = datetime.today().date()
+    for uri in (TEST_URI, f"sqlite://{tmp_path}"):
+        wrapper = StorageWrapper("test_db", uri=uri)
+        wrapper.open_or_create("test_collection")
+        try:
+            wrapper.insert_or_update_many([("test1", text, today, 3, fingerprint(text)),
+                                           ("test2", "no fingerprint", today)])
+            assert wrapper.fingerprints() == {"test1": fingerprint(text), "test2": None}
+            assert wrapper.revids() == {"test1": 3, "test2": None}
+            # Only the revision id and fingerprint change, and only for stored names
+            wrapper.update_metadata_many([("test2", 4, fingerprint("no fingerprint")),
+                                          ("missing", 5, None)])
+            assert wrapper.revids() == {"test1": 3, "test2": 4}
+            assert wrapper.fingerprints()["test2"] == fingerprint("no fingerprint")
+            assert wrapper.find("test2")[0] == "no fingerprint"
+        finally:
+            wrapper.delete_collection("test_collection")
@@ -0,0 +1,55 @@
+"""
+MinHash fingerprints of record text, stored alongside each record so a new
+copy of an article can be compared with the stored one without reading it.
+
+The fingerprint is a MinHash signature over word shingles: the fraction of
+positions where two signatures agree estimates the Jaccard similarity of the
+two texts' shingle sets.
+"""
+
+import re
+import zlib
+import numpy as np
+
+# The estimate moves in steps of 1 / NUM_PERMUTATIONS, so with 128 ingest.py's
+# cutoff of 0.95 means at most six of the 128 minimums may differ
+NUM_PERMUTATIONS = 128
+SHINGLE_WORDS = 3
+# Shingles hashed per step, to bound the temporary (shingles x permutations) array
+SHINGLE_BLOCK = 4096
+MERSENNE_PRIME = np.uint64((1 << 61) - 1)
+MAX_HASH = np.uint64((1 << 32) - 1)
+word_matcher = re.compile(r"\S+")
+
+# Fixed permutations, so fingerprints written by different runs are comparable
+_rng = np.random.default_rng(1)
+_A = _rng.integers(1, (1 << 61) - 1, size=NUM_PERMUTATIONS, dtype=np.uint64)
+_B = _rng.integers(0, (1 << 61) - 1, size=NUM_PERMUTATIONS, dtype=np.uint64)
+
+
+def shingle_hashes(text, size=SHINGLE_WORDS):
+    """ 32 bit hashes of the distinct runs of size consecutive words """
+    words = word_matcher.findall(text)
+    if len(words) < size:
+        words = words + [""] * (size - len(words))
+    shingles = {" ".join(words[i:i + size]) for i in range(len(words) - size + 1)}
+    return np.fromiter((zlib.crc32(s.encode("utf-8")) for s in shingles),
+                       dtype=np.uint64, count=len(shingles))
+
+
+def fingerprint(text):
+    """ MinHash signature of text, as NUM_PERMUTATIONS * 4 bytes """
+    hashes = shingle_hashes(text)
+    signature = np.full(NUM_PERMUTATIONS, MAX_HASH, dtype=np.uint64)
+    with np.errstate(over="ignore"):
+        for start in range(0, len(hashes), SHINGLE_BLOCK):
+            block = hashes[start:start + SHINGLE_BLOCK, None]
+            permuted = ((block * _A + _B) % MERSENNE_PRIME) & MAX_HASH
+            signature = np.minimum(signature, permuted.min(axis=0))
+    return signature.astype("<u4").tobytes()
+
+
+def similarity(a, b):
+    """ Estimated Jaccard similarity of the texts behind two fingerprints """
+    a, b = np.frombuffer(bytes(a), dtype="<u4"), np.frombuffer(bytes(b), dtype="<u4")
+    return float(np.mean(a == b))
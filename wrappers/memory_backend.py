@@ -0,0 +1,72 @@
+"""
+In-memory storage backend. Data lives for the life of the process and is
+shared by every wrapper opened on the same database name, like a server would be.
+"""
+
+from wrappers.records import to_datetime
+
+
+class MemoryBackend:
+    """ Stores each collection as a dict of {name: (text, date, revid, fingerprint)} """
+    # {db_name: {collection_name: {name: (text, date, revid, fingerprint)}}}
+    databases = {}
+
+    def __init__(self, db_name, compression=None):
+        # Text is kept as python strings, so compression does not apply
+        self.db = self.databases.setdefault(db_name, {})
+        self.collection_name = None
+
+    @property
+    def curr_collection(self):
+        # A dropped collection reads as empty and is recreated on the next write
+        return self.db.setdefault(self.collection_name, {})
+
+    def open_or_create(self, collection_name):
+        if collection_name not in self.db:
+            print(f"collection {collection_name} does not exist")
+            self.db[collection_name] = {}
+        self.collection_name = collection_name
+
+    def collection_names(self):
+        return list(self.db)
+
+    def find_many(self, names):
+        collection = self.curr_collection
+        for name in names:
+            if name in collection:
+                text, stored_date, _, _ = collection[name]
+                yield name, text, stored_date
+
+    def iter_all(self):
+        collection = self.curr_collection
+        for name in sorted(collection):
+            text, stored_date, _, _ = collection[name]
+            yield name, text, stored_date
+
+    def keys(self):
+        return sorted(self.curr_collection)
+
+    def revids(self):
+        return {name: revid for name, (_, _, revid, _) in self.curr_collection.items()}
+
+    def fingerprints(self):
+        return {name: fingerprint
+                for name, (_, _, _, fingerprint) in self.curr_collection.items()}
+
+    def insert_or_update_many(self, entries):
+        collection = self.curr_collection
+        for name, text, date_str, revid, fingerprint in entries:
+            collection[name] = (text, to_datetime(date_str), revid, fingerprint)
+
+    def update_metadata_many(self, entries):
+        collection = self.curr_collection
+        for name, revid, fingerprint in entries:
+            if name in collection:
+                text, stored_date, _, _ = collection[name]
+                collection[name] = (text, stored_date, revid, fingerprint)
+
+    def delete(self, name_of_entry):
+        self.curr_collection.pop(name_of_entry, None)
+
+    def delete_collection(self, collection_name):
+        self.db.pop(collection_name, None)
@@ -0,0 +1,22 @@
+"""
+One-shot migration of a collection from json-in-a-string records to version 2
+records with native fields and compressed text.
+
+Usage: python -m wrappers.migrate [db_name] [collection_name] [--compression zlib]
+"""
+
+import argparse
+from wrappers.storage_wrapper import StorageWrapper, COMPRESSION_METHODS, DEFAULT_COMPRESSION
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("db_name", nargs="?", default="prod")
+    parser.add_argument("collection_name", nargs="?", default="languages")
+    parser.add_argument("--compression", default=DEFAULT_COMPRESSION,
+                        choices=[c for c in COMPRESSION_METHODS if c is not None] + ["none"])
+    args = parser.parse_args()
+
+    compression = None if args.compression == "none" else args.compression
+    wrapper = StorageWrapper(args.db_name, compression=compression)
+    count = wrapper.migrate_to_v2(args.collection_name)
+    print(f"Migrated {count} records in {args.db_name}.{args.collection_name}")
@@ -0,0 +1,135 @@
+"""
+MongoDB storage backend. The only module that talks to pymongo.
+"""
+
+import pymongo
+from wrappers.records import decode_record, encode_record, DEFAULT_COMPRESSION
+from wrappers.fingerprint import fingerprint as text_fingerprint
+
+RECORD_PROJECTION = {"name": 1, "value": 1, "text": 1,
+                     "compression": 1, "date": 1, "_id": 0}
+
+
+class MongoBackend:
+    """ Stores each collection as a MongoDB collection of version 2 records """
+    db = None
+    client = None
+    curr_collection = None
+    capped = False
+
+    def __init__(self, db_name, uri="mongodb://localhost:27017/",
+                 compression=DEFAULT_COMPRESSION):
+        self.compression = compression
+        try:
+            # Connect to the mongo server
+            self.client = pymongo.MongoClient(uri)
+            # Get reference to db_name database, whether exists or not
+            self.db = self.client[db_name]
+            _ = self.db.list_collection_names()
+        except Exception as e:
+            print(e)
+
+    def open_or_create(self, collection_name):
+        """ Create a collection (in SQL, a table) """
+        # Create a collection if it does not exist. It is not capped, because a
+        # capped collection silently evicts old records once it is full.
+        if collection_name not in self.db.list_collection_names():
+            print(f"collection {collection_name} does not exist")
+            self.db.create_collection(collection_name)
+        self.curr_collection = self.db[collection_name]
+        # Collections from before version 2 records were capped, and upserts
+        # that grow a record fail in them, so writes wait for migrate_to_v2
+        self.capped = bool(self.curr_collection.options().get("capped"))
+        if self.capped:
+            print(f"collection {collection_name} is capped, run migrate_to_v2 before writing")
+        # The database enforces one record per name
+        self.curr_collection.create_index("name", unique=True)
+
+    def check_writable(self):
+        """ Raise before any write to a capped collection """
+        if self.capped:
+            name = self.curr_collection.name
+            raise ValueError(f"Collection {name} is a capped version 1 collection, run "
+                             f"python -m wrappers.migrate {self.db.name} {name} "
+                             "(migrate_to_v2) before writing to it")
+
+    def collection_names(self):
+        return self.db.list_collection_names()
+
+    def find_many(self, names):
+        cursor = self.curr_collection.find(
+            {"name": {"$in": list(names)}}, projection=RECORD_PROJECTION)
+        for object_as_dict in cursor:
+            yield (object_as_dict["name"], *decode_record(object_as_dict))
+
+    def iter_all(self):
+        cursor = self.curr_collection.find(
+            {}, projection=RECORD_PROJECTION).sort("name")
+        for object_as_dict in cursor:
+            yield (object_as_dict["name"], *decode_record(object_as_dict))
+
+    def keys(self):
+        return sorted(self.curr_collection.distinct("name"))
+
+    def revids(self):
+        cursor = self.curr_collection.find({}, projection={"name": 1, "revid": 1, "_id": 0})
+        return {doc["name"]: doc.get("revid") for doc in cursor}
+
+    def fingerprints(self):
+        cursor = self.curr_collection.find({}, projection={"name": 1, "fingerprint": 1, "_id": 0})
+        return {doc["name"]: doc.get("fingerprint") for doc in cursor}
+
+    def insert_or_update_many(self, entries):
+        self.check_writable()
+        operations = []
+        for name, text, date_str, revid, fingerprint in entries:
+            record = encode_record(name, text, date_str, revid, self.compression, fingerprint)
+            # The unique index on "name" guarantees the upsert touches at most
+            # one record. Unsetting "value" upgrades a version 1 record in place.
+            operations.append(pymongo.UpdateOne(
+                {"name": name}, {"$set": record, "$unset": {"value": ""}}, upsert=True))
+        if operations:
+            self.curr_collection.bulk_write(operations, ordered=False)
+
+    def update_metadata_many(self, entries):
+        self.check_writable()
+        operations = [pymongo.UpdateOne(
+            {"name": name}, {"$set": {"revid": revid, "fingerprint": fingerprint}})
+            for name, revid, fingerprint in entries]
+        if operations:
+            self.curr_collection.bulk_write(operations, ordered=False)
+
+    def delete(self, name_of_entry):
+        self.check_writable()
+        self.curr_collection.delete_one({"name": name_of_entry})
+
+    def delete_collection(self, collection_name):
+        self.db.drop_collection(collection_name)
+
+    def migrate_to_v2(self, collection_name, batch_size=50):
+        """ One-shot migration of a collection to version 2 records.
+        Records are copied into a new uncapped collection, which then replaces
+        the original, so this also removes the cap from older collections.
+        Fingerprints are computed on the way, so ingest never has to read
+        the text of a migrated record to tell whether it changed.
+        Returns the number of records migrated. """
+        source = self.db[collection_name]
+        staging_name = f"{collection_name}_v2_migration"
+        self.db.drop_collection(staging_name)
+        self.open_or_create(staging_name)
+        migrated = 0
+        batch = []
+        for object_as_dict in source.find({}, projection={**RECORD_PROJECTION, "revid": 1}):
+            text, stored_date = decode_record(object_as_dict)
+            batch.append((object_as_dict["name"], text, stored_date,
+                          object_as_dict.get("revid"), text_fingerprint(text)))
+            if len(batch) >= batch_size:
+                self.insert_or_update_many(batch)
+                migrated += len(batch)
+                batch = []
+        self.insert_or_update_many(batch)
+        migrated += len(batch)
+        self.curr_collection.rename(collection_name, dropTarget=True)
+        self.curr_collection = self.db[collection_name]
+        self.capped = False
+        return migrated
@@ -0,0 +1,112 @@
+"""
+Record format shared by the storage backends
+"""
+
+from datetime import datetime, date, time
+from collections import namedtuple
+import json
+import zlib
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+DbEntry = namedtuple("DbEntry", field_names=["text", "date"])
+
+######### DATABASE RECORD ####################
+# Version 1 (legacy, read only)
+# {"name": programming language name, "value", json.dumps(DbEntry), "revid": revision id}
+# DbEntry is an named tupled containing the text and the date it was added
+#
+# Version 2
+# {"name": programming language name, "schema": 2, "text": text or compressed bytes,
+#  "compression": None, "zlib" or "zstd", "date": datetime added,
+#  "revid": revision id, "size": length of the uncompressed text in bytes,
+#  "fingerprint": MinHash signature bytes of the text}
+#
+# revid is the wikipedia revision id of the text, or None if unknown.
+# fingerprint is written by ingest, see wrappers/fingerprint.py, and is None
+# for records written before fingerprints were stored and for feature caches
+SCHEMA_VERSION = 2
+COMPRESSION_METHODS = (None, "zlib", "zstd")
+DEFAULT_COMPRESSION = "zlib"
+
+
+def serialize_date(obj):
+    """JSON serializer for datetime objects not serializable by default json code"""
+
+    if isinstance(obj, (datetime, date)):
+        return obj.isoformat()
+    raise TypeError("Type %s not serializable" % type(obj))
+
+
+def to_datetime(obj):
+    """ BSON only stores datetimes, so promote dates and iso strings to datetime """
+    if isinstance(obj, datetime):
+        return obj
+    if isinstance(obj, date):
+        return datetime.combine(obj, time())
+    if isinstance(obj, str):
+        return datetime.fromisoformat(obj)
+    raise TypeError("Type %s not serializable" % type(obj))
+
+
+def check_compression(compression):
+    """ Validate a compression method, falling back to zlib if zstd is unavailable """
+    if compression not in COMPRESSION_METHODS:
+        raise ValueError(f"Unknown compression method {compression}")
+    if compression == "zstd" and zstandard is None:
+        print("zstandard is not installed, falling back to zlib compression")
+        return "zlib"
+    return compression
+
+
+def compress_text(text: str, compression):
+    """ Encode text for storage with the given compression method """
+    if compression is None:
+        return text
+    raw = text.encode("utf-8")
+    if compression == "zlib":
+        return zlib.compress(raw)
+    if compression == "zstd":
+        if zstandard is None:
+            raise ValueError("zstd compression requires the zstandard package")
+        return zstandard.ZstdCompressor().compress(raw)
+    raise ValueError(f"Unknown compression method {compression}")
+
+
+def decompress_text(stored, compression):
+    """ Inverse of compress_text """
+    if compression is None:
+        return stored
+    if compression == "zlib":
+        return zlib.decompress(stored).decode("utf-8")
+    if compression == "zstd":
+        if zstandard is None:
+            raise ValueError("zstd compression requires the zstandard package")
+        return zstandard.ZstdDecompressor().decompress(stored).decode("utf-8")
+    raise ValueError(f"Unknown compression method {compression}")
+
+
+def decode_value(value):
+    """ Decode the json "value" field of a version 1 record into (text, date) """
+    object_value_tuple = json.loads(value)
+    stored_json = object_value_tuple[0]
+    stored_date = datetime.fromisoformat(object_value_tuple[1])
+    return stored_json, stored_date
+
+
+def decode_record(object_as_dict):
+    """ Return (text, date) from a record in either schema version """
+    if "value" in object_as_dict:
+        return decode_value(object_as_dict["value"])
+    text = decompress_text(object_as_dict["text"], object_as_dict.get("compression"))
+    return text, object_as_dict["date"]
+
+
+def encode_record(name, text, date_str, revid=None, compression=DEFAULT_COMPRESSION,
+                  fingerprint=None):
+    """ Build a version 2 record """
+    return {"name": name, "schema": SCHEMA_VERSION,
+            "text": compress_text(text, compression), "compression": compression,
+            "date": to_datetime(date_str), "revid": revid,
+            "size": len(text.encode("utf-8")), "fingerprint": fingerprint}
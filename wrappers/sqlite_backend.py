@@ -0,0 +1,138 @@
+"""
+SQLite storage backend. Each database is a local file and each collection a
+table, so eda.py can run without a network hop or a database server.
+"""
+
+import os
+import re
+import sqlite3
+from datetime import datetime
+from wrappers.records import (compress_text, decompress_text, to_datetime,
+                              DEFAULT_COMPRESSION)
+
+# Collection names become table names, so only allow plain identifiers
+VALID_COLLECTION_NAME = re.compile(r"^[A-Za-z_][A-Za-z0-9_]*$")
+# sqlite limits the number of bound parameters per statement
+MAX_PARAMS_PER_QUERY = 500
+
+
+def table_name(collection_name):
+    if not VALID_COLLECTION_NAME.match(collection_name):
+        raise ValueError(f"Invalid collection name {collection_name}")
+    return f'"{collection_name}"'
+
+
+class SqliteBackend:
+    """ Stores each collection as a table of version 2 records in a WAL-mode sqlite file """
+
+    def __init__(self, db_name, directory="./data", compression=DEFAULT_COMPRESSION):
+        self.compression = compression
+        os.makedirs(directory, exist_ok=True)
+        self.path = os.path.join(directory, f"{db_name}.sqlite3")
+        # The connection may be shared with a writer thread; sqlite serializes access
+        self.connection = sqlite3.connect(self.path, check_same_thread=False)
+        # WAL lets readers (eda.py) run while ingest.py is writing
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute("PRAGMA synchronous=NORMAL")
+        self.collection_name = None
+
+    @property
+    def table(self):
+        return table_name(self.collection_name)
+
+    def create_table(self, collection_name):
+        # The primary key enforces one record per name
+        with self.connection:
+            self.connection.execute(
+                f"CREATE TABLE IF NOT EXISTS {table_name(collection_name)} ("
+                "name TEXT PRIMARY KEY, text BLOB, compression TEXT, "
+                "date TEXT, revid INTEGER, size INTEGER, fingerprint BLOB)")
+            # Tables created before fingerprints were stored gain the column
+            columns = [row[1] for row in self.connection.execute(
+                f"PRAGMA table_info({table_name(collection_name)})")]
+            if "fingerprint" not in columns:
+                self.connection.execute(
+                    f"ALTER TABLE {table_name(collection_name)} ADD COLUMN fingerprint BLOB")
+
+    def open_or_create(self, collection_name):
+        if collection_name not in self.collection_names():
+            print(f"collection {collection_name} does not exist")
+        self.create_table(collection_name)
+        self.collection_name = collection_name
+
+    def collection_names(self):
+        rows = self.connection.execute(
+            "SELECT name FROM sqlite_master WHERE type = 'table'")
+        return [row[0] for row in rows]
+
+    def decode_rows(self, rows):
+        for name, stored, compression, stored_date in rows:
+            yield name, decompress_text(stored, compression), datetime.fromisoformat(stored_date)
+
+    def find_many(self, names):
+        # A dropped collection reads as empty
+        if self.collection_name not in self.collection_names():
+            return
+        names = list(names)
+        for start in range(0, len(names), MAX_PARAMS_PER_QUERY):
+            chunk = names[start:start + MAX_PARAMS_PER_QUERY]
+            placeholders = ",".join("?" * len(chunk))
+            rows = self.connection.execute(
+                f"SELECT name, text, compression, date FROM {self.table} "
+                f"WHERE name IN ({placeholders})", chunk)
+            yield from self.decode_rows(rows)
+
+    def iter_all(self):
+        if self.collection_name not in self.collection_names():
+            return
+        rows = self.connection.execute(
+            f"SELECT name, text, compression, date FROM {self.table} ORDER BY name")
+        yield from self.decode_rows(rows)
+
+    def keys(self):
+        if self.collection_name not in self.collection_names():
+            return []
+        rows = self.connection.execute(f"SELECT name FROM {self.table} ORDER BY name")
+        return [row[0] for row in rows]
+
+    def revids(self):
+        if self.collection_name not in self.collection_names():
+            return {}
+        rows = self.connection.execute(f"SELECT name, revid FROM {self.table}")
+        return dict(rows.fetchall())
+
+    def fingerprints(self):
+        if self.collection_name not in self.collection_names():
+            return {}
+        rows = self.connection.execute(f"SELECT name, fingerprint FROM {self.table}")
+        return dict(rows.fetchall())
+
+    def insert_or_update_many(self, entries):
+        rows = [(name, compress_text(text, self.compression), self.compression,
+                 to_datetime(date_str).isoformat(), revid, len(text.encode("utf-8")), fingerprint)
+                for name, text, date_str, revid, fingerprint in entries]
+        # A dropped collection is recreated on the next write
+        self.create_table(self.collection_name)
+        with self.connection:
+            self.connection.executemany(
+                f"INSERT OR REPLACE INTO {self.table} "
+                "(name, text, compression, date, revid, size, fingerprint) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?)", rows)
+
+    def update_metadata_many(self, entries):
+        if self.collection_name not in self.collection_names():
+            return
+        with self.connection:
+            self.connection.executemany(
+                f"UPDATE {self.table} SET revid = ?, fingerprint = ? WHERE name = ?",
+                [(revid, fingerprint, name) for name, revid, fingerprint in entries])
+
+    def delete(self, name_of_entry):
+        if self.collection_name not in self.collection_names():
+            return
+        with self.connection:
+            self.connection.execute(f"DELETE FROM {self.table} WHERE name = ?", (name_of_entry,))
+
+    def delete_collection(self, collection_name):
+        with self.connection:
+            self.connection.execute(f"DROP TABLE IF EXISTS {table_name(collection_name)}")
@@ -1,87 +1,126 @@
-import pymongo
-from datetime import datetime, date
-from collections import namedtuple
-import json
-DbEntry = namedtuple("DbEntry", field_names=["text", "date"])
+import os
+from urllib.parse import urlparse
+from wrappers.records import (DbEntry, serialize_date, to_datetime, compress_text,
+                              decompress_text, decode_value, decode_record, encode_record,
+                              check_compression, SCHEMA_VERSION, COMPRESSION_METHODS,
+                              DEFAULT_COMPRESSION)
 
-######### DATABASE RECORD ####################
-# {"name": programming language name, "value", json.dumps(DbEntry)}
-# DbEntry is an named tupled containing the text and the date it was added
+######### STORAGE URI ####################
+# mongodb://host:port/       MongoDB server (default)
+# sqlite:///path/to/dir      one sqlite file per database in the directory,
+#                            sqlite:// alone uses ./data
+# memory://                  in-process dicts, shared by wrappers in the same process
+# The STORAGE_URI environment variable overrides the default.
+DEFAULT_URI = "mongodb://localhost:27017/"
 
 
-def serialize_date(obj):
-    """JSON serializer for datetime objects not serializable by default json code"""
-
-    if isinstance(obj, (datetime, date)):
-        return obj.isoformat()
-    raise TypeError("Type %s not serializable" % type(obj))
+def make_backend(db_name, uri, compression):
+    """ Create the storage backend named by the uri scheme """
+    scheme = urlparse(uri).scheme
+    # Backends are imported on demand so that e.g. sqlite does not need pymongo
+    if scheme in ("mongodb", "mongodb+srv"):
+        from wrappers.mongo_backend import MongoBackend
+        return MongoBackend(db_name, uri, compression)
+    if scheme == "sqlite":
+        from wrappers.sqlite_backend import SqliteBackend
+        directory = uri[len("sqlite://"):] or "./data"
+        return SqliteBackend(db_name, directory, compression)
+    if scheme == "memory":
+        from wrappers.memory_backend import MemoryBackend
+        return MemoryBackend(db_name, compression)
+    raise ValueError(f"Unsupported storage uri {uri}")
 
 
 class StorageWrapper:
-    """ Wrapper class to isolate pymongo dependency """
-    db = None
-    client = None
-    curr_collection = None
-
-    def __init__(self, db_name):
-        try:
-            # Connect to the mongo server
-            self.client = pymongo.MongoClient("mongodb://localhost:27017/")
-            # Get reference to db_name database, whether exists or not
-            self.db = self.client[db_name]
-            _ = self.db.list_collection_names()
-        except Exception as e:
-            print(e)
+    """ Wrapper class to isolate the database dependency.
+    The backing store is chosen by uri, see STORAGE URI above. """
+    backend = None
+    collection_name = None
+
+    def __init__(self, db_name, uri=None, compression=DEFAULT_COMPRESSION):
+        if uri is None:
+            uri = os.environ.get("STORAGE_URI", DEFAULT_URI)
+        self.db_name = db_name
+        self.uri = uri
+        self.compression = check_compression(compression)
+        self.backend = make_backend(db_name, uri, self.compression)
 
     def open_or_create(self, collection_name):
         """ Create a collection (in SQL, a table) """
-        # Create a collection if it does not exist
-        if collection_name not in self.db.list_collection_names():
-            print(f"collection {collection_name} does not exist")
-            self.db.create_collection(
-                collection_name, capped=True, size=50_000_000, max=1000)
-        self.curr_collection = self.db[collection_name]
+        self.backend.open_or_create(collection_name)
+        self.collection_name = collection_name
+
+    def collection_names(self):
+        """ Return a list of the collections in the database """
+        return self.backend.collection_names()
 
     def find(self, name_of_entry):
         """ Search for a record given a record name, returning tuple of (text, date).
         Returns None if does not find it. """
-        object_as_dict = self.curr_collection.find_one({"name": name_of_entry})
-        if object_as_dict is None:
-            return None
-        object_value_tuple = json.loads(object_as_dict["value"])
-        stored_json = object_value_tuple[0]
-        stored_date = datetime.fromisoformat(object_value_tuple[1])
-        return stored_json, stored_date
+        for _, stored_json, stored_date in self.find_many([name_of_entry]):
+            return stored_json, stored_date
+        return None
+
+    def find_many(self, names):
+        """ Generator of (name, text, date) for every record whose name is in names,
+        fetched with a single query. Names without a record are skipped. """
+        return self.backend.find_many(names)
+
+    def iter_all(self):
+        """ Generator of (name, text, date) for every record, sorted by name,
+        streamed from a single query """
+        return self.backend.iter_all()
 
     def keys(self):
         """ Return a list of the key names """
-        return list(self.curr_collection.distinct("name"))
-
-    def insert_or_update(self, name: str, text: str, date_str: str):
-        # Check if document with same "name" field is already in the collection
-
-        # Prep entry for insert or update
-        db_entry = DbEntry(text=text,
-                           date=serialize_date(date_str))
-        record = {"name": name, "value": json.dumps(db_entry)}
-        count = self.curr_collection.count_documents({"name": record["name"]})
-
-        if count == 1:
-            # Record already exists with that name, so we update existing
-            self.curr_collection.update_one(filter={"name": record["name"]}, update={
-                                            "$set": {"value": record["value"]}})
-        elif count > 1:
-            # Two or more records exists with that name, which breaks an invariant
-            # we have guarded here. That should never happen in normal
-            # operation
-            raise ValueError(
-                "Count of documents with a given name should not ever be greater than 1")
-        elif count == 0:
-            # No records exist with that, so we insert it for the first time
-            self.curr_collection.insert_one(record)
+        return self.backend.keys()
+
+    def revids(self):
+        """ Return a dict of {name: revision id} for every record, without
+        loading the record text """
+        return self.backend.revids()
+
+    def fingerprints(self):
+        """ Return a dict of {name: fingerprint bytes or None} for every record,
+        without loading the record text """
+        return self.backend.fingerprints()
+
+    def insert_or_update(self, name: str, text: str, date_str: str, revid=None,
+                         fingerprint=None):
+        """ Add a new record or replace the existing record with the same name """
+        self.insert_or_update_many([(name, text, date_str, revid, fingerprint)])
+
+    def insert_or_update_many(self, entries):
+        """ Upsert many records with a single bulk write.
+        entries is an iterable of (name, text, date), (name, text, date, revid)
+        or (name, text, date, revid, fingerprint) """
+        normalized = []
+        for entry in entries:
+            name, text, date_str, *rest = entry
+            rest = list(rest) + [None] * (2 - len(rest))
+            normalized.append((name, text, date_str, rest[0], rest[1]))
+        if normalized:
+            self.backend.insert_or_update_many(normalized)
+
+    def update_metadata_many(self, entries):
+        """ Set the revision id and fingerprint of existing records, keeping
+        their text and date. entries is an iterable of (name, revid, fingerprint).
+        Names without a record are ignored. """
+        entries = list(entries)
+        if entries:
+            self.backend.update_metadata_many(entries)
 
     def delete(self, name_of_entry):
-        self.curr_collection.delete_one({"name": name_of_entry})
+        self.backend.delete(name_of_entry)
 
     def delete_collection(self, collection_name):
-        self.db.drop_collection(collection_name)
+        self.backend.delete_collection(collection_name)
+
+    def migrate_to_v2(self, collection_name, batch_size=50):
+        """ One-shot migration of a collection to version 2 records.
+        Only MongoDB ever stored version 1 records. """
+        if not hasattr(self.backend, "migrate_to_v2"):
+            raise ValueError(f"Backend for {self.uri} has no version 1 records to migrate")
+        migrated = self.backend.migrate_to_v2(collection_name, batch_size)
+        self.collection_name = collection_name
+        return migrated